@@ -0,0 +1,84 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, List
+
+
+DEFAULT_CHECKLIST_CACHE_SIZE = 512
+DEFAULT_CHECKLIST_CACHE_TTL = 60 * 60
+
+
+def task_fields_revision(task_fields) -> str:
+    # The checklist only depends on field values, so two webhooks for the
+    # same task state share a revision whatever else changed in the task
+    payload = json.dumps(task_fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class ChecklistCache:
+    def __init__(
+        self,
+        max_size: int = DEFAULT_CHECKLIST_CACHE_SIZE,
+        ttl: int = DEFAULT_CHECKLIST_CACHE_TTL,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: Hashable):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] > time.monotonic():
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+
+    def _set(self, key: Hashable, checklist: List[str]):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, checklist)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def get_or_render(
+        self, key: Hashable, render: Callable[[], List[str]]
+    ) -> List[str]:
+        checklist = self._get(key)
+        if checklist is not None:
+            print(f"🫙 Checklist cache: hit ({self.stats()})")
+            return list(checklist)
+
+        print(f"⌛ Checklist cache: miss ({self.stats()})")
+        checklist = render()
+        if isinstance(checklist, list):
+            self._set(key, list(checklist))
+        return checklist
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> str:
+        return f"hits {self.hits}, misses {self.misses}, size {len(self._items)}"
+
+
+checklist_cache = ChecklistCache()
+
+
+def configure_checklist_cache(
+    max_size: int = DEFAULT_CHECKLIST_CACHE_SIZE,
+    ttl: int = DEFAULT_CHECKLIST_CACHE_TTL,
+) -> ChecklistCache:
+    checklist_cache.max_size = max_size
+    checklist_cache.ttl = ttl
+    checklist_cache.clear()
+    return checklist_cache
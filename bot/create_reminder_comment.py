@@ -1,16 +1,12 @@
-import json
-import hmac
-import hashlib
-from flask import Request
-from pyrus import client
-import pyrus.models
-import pyrus.models.requests
 from pyrus_api_handler import PyrusAPI
+from bot.job_queue import JobQueue
+from bot.webhook_dedup import WebhookDeduplicator, DEFAULT_DEDUP_TTL
+from bot.field_extractor import FieldKey, find_fields
+from reminder_store import ReminderStore
+from reminder_catalog import CatalogMirror
 from datetime import datetime
-from pyrus.models.entities import CatalogItem
 from typing import Union, TypedDict, List, Dict, Optional
 import locale
-import uuid
 
 
 locale.setlocale(locale.LC_TIME, "ru_RU.UTF-8")
@@ -22,73 +18,37 @@ class TrackedFieldsType(TypedDict):
 
 
 class CreateReminderComment:
+    JOB_NAME = "webhook-reminder"
+
     def __init__(
         self,
-        catalog_id: str,
+        reminder_store: ReminderStore,
+        catalog_mirror: CatalogMirror,
         cache,
         pyrus_secret_key: str,
         pyrus_login: str,
         sentry_sdk,
         traked_fields: TrackedFieldsType,
+        job_queue: Optional[JobQueue] = None,
+        dedup_ttl: int = DEFAULT_DEDUP_TTL,
     ):
         self.pyrus_secret_key = pyrus_secret_key
         self.pyrus_login = pyrus_login
         self.cache = cache
-        self.pyrus_client = client.PyrusAPI(self.pyrus_login, self.pyrus_secret_key)
         self.pyrus_api = PyrusAPI(self.cache, self.pyrus_login, self.pyrus_secret_key)
-        self.catalog_id = int(catalog_id)
+        self.reminder_store = reminder_store
+        self.catalog_mirror = catalog_mirror
         self.sentry_sdk = sentry_sdk
         self.tracked_fields = traked_fields
-
-    def _validate_request(self, signature, body):
-        # check if signature is set
-        if signature is None:
-            self.sentry_sdk.capture_message(
-                "⛔ The request does not have the X-Pyrus-Sig.", level="debug"
-            )
-            print("⛔ The request does not have the X-Pyrus-Sig.")
-            return False
-        # check if secret is set
-        if self.pyrus_secret_key is None or not self.pyrus_secret_key:
-            self.sentry_sdk.capture_message(
-                "Debug message: Secret is not set ❌", level="debug"
-            )
-            print("Secret is not set ❌")
-            return False
-        # check if body is set
-        if body is None or not body:
-            self.sentry_sdk.capture_message(
-                "Debug message: Body is not set ❌", level="debug"
-            )
-            print("Body is not set ❌")
-            return False
-
-        # chech signature
-        secret = str.encode(self.pyrus_secret_key)
-        digest = hmac.new(secret, msg=body, digestmod=hashlib.sha1).hexdigest()
-        return hmac.compare_digest(digest, signature.lower())
-
-    def _find_fields(
-        self, fields: dict, field_name: str, field_type: str = "text"
-    ) -> Union[dict, None]:
-        for field in fields:
-            isNestedField = (
-                "value" in field
-                and isinstance(field["value"], dict)
-                and "fields" in field["value"]
-                and isinstance(field["value"]["fields"], list)
-            )
-            if isNestedField:
-                return self._find_fields(
-                    field["value"]["fields"], field_name, field_type
-                )
-            if (
-                "type" in field
-                and field["type"] == field_type
-                and "name" in field
-                and field["name"] == field_name
-            ):
-                return field
+        self.tracked_field_keys: List[FieldKey] = [
+            (field_type, field_name)
+            for field_type, fields in traked_fields.items()
+            for field_name in fields
+        ]
+        self.job_queue = job_queue
+        self.deduplicator = WebhookDeduplicator(
+            self.cache, self.JOB_NAME, ttl=dedup_ttl
+        )
 
     def _create_shipment_date_comment_data(self, author, date: str, time: str = ""):
         id = author["id"]
@@ -130,130 +90,26 @@ class CreateReminderComment:
         }
 
     def _delete_reminder(self, task_id: str, type_message: str):
-        catalog_id = self.catalog_id
-        catalog_response = self.pyrus_client.get_catalog(catalog_id)
-
-        if catalog_response.items is not None:
-            items: Optional[List[CatalogItem]] = catalog_response.items
-            catalog_updated = {
-                "apply": "true",
-                "catalog_headers": ["id", "task_id", "timestamp", "message_type"],
-                "items": [],
-            }
-
-            for item in items:
-                if item.values is not None:
-                    item_id, item_task_id, item_timestamp, item_message_type = (
-                        item.values
-                    )
-
-                    if str(task_id) != str(item_task_id) and str(type_message) != str(
-                        item_message_type
-                    ):
-                        catalog_updated["items"].append({"values": [item.values]})
-
-            try:
-                request = pyrus.models.requests.SyncCatalogRequest(catalog_updated)
-                response = self.pyrus_client.sync_catalog(self.catalog_id, request)
-                delted = response.deleted
-                updated = response.updated
-                added = response.added
-                new_headers = response.catalog_headers
-
-                print(f"Delete Reminder: {task_id}")
-                print(f"🗑️ Deleted: {delted}")
-                print(f"✅ Updated: {updated}")
-                print(f"➕ Added: {added}")
-                print(f"📝 New headers: {new_headers}")
-            except Exception as e:
-                self.sentry_sdk.capture_message(e, level="error")
-            # return self.pyrus_api.post_request(
-            #     f"https://api.pyrus.com/v4/catalogs/{self.catalog_id}",
-            #     catalog_updated,
-            # )
-
-    def _save_or_update_reminder(self, task_id: str, task_date: str, type_message: str):
-        catalog_id = self.catalog_id
-        catalog_response = self.pyrus_client.get_catalog(catalog_id)
-        reminder_exists = False
-
-        if catalog_response.items is not None:
-            items: Optional[List[CatalogItem]] = catalog_response.items
-            catalog_updated = {
-                "apply": "true",
-                "catalog_headers": ["id", "task_id", "timestamp", "message_type"],
-                "items": [],
-            }
-
-            # Filling catalog
-            for item in items:
-                if item.values is not None:
-                    item_id, item_task_id, item_timestamp, item_message_type = (
-                        item.values
-                    )
-
-                    # Find item with the same task_id and type_message to update it
-                    if str(task_id) == str(item_task_id) and str(type_message) == str(
-                        item_message_type
-                    ):
-                        reminder_exists = True
-                        catalog_updated["items"].append(
-                            {
-                                "values": [
-                                    item_id,
-                                    item_task_id,
-                                    task_date,
-                                    item_message_type,
-                                ],
-                            }
-                        )
-                    else:
-                        # If item not found we adding this item to updated catalog
-                        catalog_updated["items"].append(
-                            {
-                                "values": [
-                                    item_id,
-                                    item_task_id,
-                                    item_timestamp,
-                                    item_message_type,
-                                ]
-                            }
-                        )
-
-            if not reminder_exists:
-                id = uuid.uuid4()
-                id_str = str(id)
-                catalog_updated["items"].append(
-                    {
-                        "values": [
-                            id_str,
-                            task_id,
-                            task_date,
-                            type_message,
-                        ],
-                    }
-                )
-
-            try:
-                request = pyrus.models.requests.SyncCatalogRequest(catalog_updated)
-                response = self.pyrus_client.sync_catalog(self.catalog_id, request)
-                delted = response.deleted
-                updated = response.updated
-                added = response.added
-                new_headers = response.catalog_headers
-
-                print(f"Save or Update Reminder: {task_id}")
-                print(f"🗑️ Deleted: {delted}")
-                print(f"✅ Updated: {updated}")
-                print(f"➕ Added: {added}")
-                print(f"📝 New headers: {new_headers}")
-            except Exception as e:
-                self.sentry_sdk.capture_message(e, level="error")
-
-            # return self.pyrus_api.post_request(
-            #     f"https://api.pyrus.com/v4/catalogs/{self.catalog_id}",
-            #     catalog_updated,
-            # )
+        # A reminder deleted before the catalog is imported would come back
+        # with the import
+        self.catalog_mirror.seed()
+        if self.reminder_store.delete(task_id, type_message):
+            print(f"Delete Reminder: {task_id}, {type_message}")
+            self.catalog_mirror.schedule()
+
+    def _save_or_update_reminder(
+        self,
+        task_id: str,
+        task_date: str,
+        type_message: str,
+        form_id: Optional[int] = None,
+    ):
+        self.catalog_mirror.seed()
+        reminder = self.reminder_store.upsert(
+            task_id, task_date, type_message, form_id=form_id
+        )
+        print(f"Save or Update Reminder: {task_id}, {reminder}")
+        self.catalog_mirror.schedule()
 
     def _process_text_field(
         self,
@@ -290,6 +146,7 @@ class CreateReminderComment:
         author: dict,
         task_field: dict,
         type_message: str,
+        form_id: Optional[int] = None,
     ):
         print("🚚 Processing date field...")
 
@@ -344,6 +201,7 @@ class CreateReminderComment:
                     task_id=task_id,
                     task_date=task_field_date_value,
                     type_message=type_message,
+                    form_id=form_id,
                 )
 
     def _handle_response(self, task: dict):
@@ -352,13 +210,14 @@ class CreateReminderComment:
         if "comments" in task and "field_updates" in task["comments"][0]:
             print(f"✅ Task has comments and field_updates")
             task_fields_updated = task["comments"][0]["field_updates"]
+            fields_found = find_fields(task_fields_updated, self.tracked_field_keys)
 
             if isinstance(self.tracked_fields, dict):
                 for field_type, fields in self.tracked_fields.items():
                     if field_type == "text" and isinstance(fields, dict):
                         for field_name, field_value in fields.items():
-                            task_field_found = self._find_fields(
-                                task_fields_updated, field_name, field_type
+                            task_field_found = fields_found.get(
+                                (field_type, field_name)
                             )
                             if task_field_found is not None:
                                 self._process_text_field(
@@ -372,8 +231,8 @@ class CreateReminderComment:
                             )  # Field Name: Тип оплаты / Статус, Field Value: ✅Нал (чек)
                     elif field_type == "date" and isinstance(fields, list):
                         for field_name in fields:
-                            task_field_found = self._find_fields(
-                                task_fields_updated, field_name, field_type
+                            task_field_found = fields_found.get(
+                                (field_type, field_name)
                             )
                             if task_field_found is not None:
                                 type_message = (
@@ -386,6 +245,7 @@ class CreateReminderComment:
                                     author=task["author"],
                                     task_field=task_field_found,
                                     type_message=type_message,
+                                    form_id=task.get("form_id"),
                                 )
                             print(
                                 f"✅ Field Type: {field_type}, Field Name: {field_name}, Task Field Founed: {task_field_found}"
@@ -393,35 +253,13 @@ class CreateReminderComment:
 
         return "{}", 200
 
-    def process_request(self, request: Request):
-        print("🔐 Processing request...")
-        signature = request.headers.get("X-Pyrus-Sig")
-        body = request.data
-
-        if not self._validate_request(signature=signature, body=body):
-            self.sentry_sdk.capture_message(
-                "Debug message: ❌ Signature is not correct", level="debug"
-            )
-            print("❌ Signature is not correct")
-            return "🚫 Access Denied", 403
-
-        print("✅ Signature_correct")
+    def handle_task(self, task: dict):
+        return self._handle_response(task)
 
-        try:
-            data = json.loads(body)
+    def process_request(self, data: dict):
+        # The payload is checked and parsed by WebhookIngress
+        task = data["task"]
+        return self.deduplicator.run(
+            task, self._handle_response, self.job_queue, self.JOB_NAME
+        )
 
-            if "task" in data:
-                task = data["task"]
-                return self._handle_response(task)
-            else:
-                print("😢 Body does not contain 'task'")
-                self.sentry_sdk.capture_message(
-                    "Debug message: 😢 Body does not contain 'task'", level="debug"
-                )
-                return "🚫 Access Denied", 403
-        except json.JSONDecodeError:
-            self.sentry_sdk.capture_message(
-                "Debug message: 😢 Body is not valid JSON", level="debug"
-            )
-            print("😢 Body is not valid JSON")
-            return "🚫 Access Denied", 403
@@ -0,0 +1,105 @@
+import json
+import hashlib
+from typing import Iterable, Optional
+
+
+DEFAULT_ECHO_TTL = 5 * 60
+
+
+class EchoGuard:
+    # A field the bot writes to a linked task fires a webhook for that task
+    # too. Such echoes are recognised by the author of the newest comment,
+    # once the bot's own user id is learned from its first write: a comment
+    # by anyone else is never an echo, even when it sets the value the bot
+    # wrote. Before that, a comment whose field updates all are
+    # (task, field, value) the bot wrote a moment ago is taken for the echo.
+    # The fingerprints are spent on that comment, a later one setting the
+    # same values is not dropped.
+    def __init__(self, cache, namespace: str, ttl: int = DEFAULT_ECHO_TTL):
+        self.cache = cache
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def _bot_user_key(self) -> str:
+        return f"echo_bot_user:{self.namespace}"
+
+    def _fingerprint_key(self, task_id, field_id, value) -> str:
+        payload = json.dumps(value, sort_keys=True, ensure_ascii=False)
+        digest = hashlib.sha1(payload.encode()).hexdigest()
+        return f"echo:{self.namespace}:{task_id}:{field_id}:{digest}"
+
+    def _echo_comment_key(self, task_id, comment_id) -> str:
+        return f"echo_comment:{self.namespace}:{task_id}:{comment_id}"
+
+    def bot_user_id(self) -> Optional[int]:
+        return self.cache.get(self._bot_user_key())
+
+    def expect_write(self, task_id, field_updates: Iterable[dict]):
+        # Called before the write is sent: Pyrus may deliver its webhook
+        # before the response to the write comes back
+        for field_update in field_updates:
+            self.cache.set(
+                self._fingerprint_key(
+                    task_id, field_update["id"], field_update["value"]
+                ),
+                True,
+                timeout=self.ttl,
+            )
+
+    def forget_write(self, task_id, field_updates: Iterable[dict]):
+        # The write failed, a later change to the same value is not an echo
+        for field_update in field_updates:
+            self.cache.delete(
+                self._fingerprint_key(
+                    task_id, field_update["id"], field_update["value"]
+                )
+            )
+
+    def remember_author(self, task=None):
+        # The comment the bot just added is the newest one of the task
+        comments = getattr(task, "comments", None)
+        if comments:
+            author = getattr(comments[-1], "author", None)
+            if author is not None and author.id is not None:
+                self.cache.set(self._bot_user_key(), author.id, timeout=0)
+
+    def is_echo(self, task: dict) -> bool:
+        comments = [
+            comment for comment in task.get("comments") or [] if "id" in comment
+        ]
+        if "id" not in task or not comments:
+            return False
+        comment = max(comments, key=lambda comment: comment["id"])
+
+        bot_user_id = self.bot_user_id()
+        author_id = (comment.get("author") or {}).get("id")
+        if bot_user_id is not None and author_id is not None:
+            if author_id == bot_user_id:
+                print(f"🔁 Echo guard: task {task['id']} was changed by the bot itself")
+                return True
+            return False
+
+        # A redelivery of a comment already taken for an echo
+        echo_comment_key = self._echo_comment_key(task["id"], comment["id"])
+        if self.cache.get(echo_comment_key):
+            return True
+
+        field_updates = comment.get("field_updates") or []
+        fingerprint_keys = [
+            self._fingerprint_key(
+                task["id"], field_update["id"], field_update.get("value")
+            )
+            for field_update in field_updates
+            if "id" in field_update
+        ]
+        if (
+            field_updates
+            and len(fingerprint_keys) == len(field_updates)
+            and all(self.cache.get(key) for key in fingerprint_keys)
+        ):
+            for key in fingerprint_keys:
+                self.cache.delete(key)
+            self.cache.set(echo_comment_key, True, timeout=self.ttl)
+            print(f"🔁 Echo guard: task {task['id']} only repeats the bot's writes")
+            return True
+        return False
@@ -0,0 +1,52 @@
+from pyrus.models.entities import FormField, Title
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+
+# (field type, field name), e.g. ("date", "Дата отгрузки")
+FieldKey = Tuple[str, str]
+
+Field = Union[dict, FormField]
+
+
+def _nested_fields(field: Field) -> Optional[List[Any]]:
+    if isinstance(field, dict):
+        value = field.get("value")
+        if isinstance(value, dict) and isinstance(value.get("fields"), list):
+            return value["fields"]
+    elif isinstance(field.value, Title) and isinstance(field.value.fields, list):
+        return field.value.fields
+    return None
+
+
+def _field_key(field: Field) -> FieldKey:
+    if isinstance(field, dict):
+        return field.get("type"), field.get("name")  # type: ignore
+    return field.type, field.name  # type: ignore
+
+
+def find_fields(
+    fields: Iterable[Field], wanted: Iterable[FieldKey]
+) -> Dict[FieldKey, Field]:
+    # One depth-first pass over the fields and their title groups. Fields
+    # inside a group are checked before the group itself, the first match
+    # for each key wins and the walk stops once every key is found.
+    wanted = set(wanted)
+    found: Dict[FieldKey, Field] = {}
+
+    def walk(fields) -> bool:
+        for field in fields:
+            if not isinstance(field, (dict, FormField)):
+                continue
+            nested = _nested_fields(field)
+            if nested is not None and walk(nested):
+                return True
+            key = _field_key(field)
+            if key in wanted and key not in found:
+                found[key] = field
+                if len(found) == len(wanted):
+                    return True
+        return False
+
+    if wanted:
+        walk(fields)
+    return found
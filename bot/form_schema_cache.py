@@ -0,0 +1,155 @@
+import hmac
+import json
+import time
+import hashlib
+from flask import request
+from typing import Dict, Iterable, Optional, Set
+from pyrus_api_handler import PyrusAPI, PYRUS_API_URL
+from bot.visibility_conditions import compile_visibility_conditions
+
+
+# Only new field ids are noticed before the ttl runs out, changed names,
+# steps or visibility conditions wait for it (or for invalidate())
+DEFAULT_FORM_SCHEMA_TTL = 15 * 60
+# Part of the cache key, bump it when the cached schema layout changes so
+# entries written by an older release are not read
+FORM_SCHEMA_VERSION = 2
+
+
+def form_field_ids(form_fields: Iterable[dict]) -> Set[int]:
+    field_ids = set()
+    for field in form_fields:
+        if "id" in field:
+            field_ids.add(field["id"])
+        info = field.get("info")
+        if isinstance(info, dict) and isinstance(info.get("fields"), list):
+            field_ids |= form_field_ids(info["fields"])
+    return field_ids
+
+
+def form_field_names(form_fields: Iterable[dict]) -> Dict[str, dict]:
+    # Field name -> {"id", "type"}, the first field wins for repeated names
+    field_names: Dict[str, dict] = {}
+    for field in form_fields:
+        if "name" in field and "id" in field and field["name"] not in field_names:
+            field_names[field["name"]] = {"id": field["id"], "type": field.get("type")}
+        info = field.get("info")
+        if isinstance(info, dict) and isinstance(info.get("fields"), list):
+            for name, nested in form_field_names(info["fields"]).items():
+                field_names.setdefault(name, nested)
+    return field_names
+
+
+def task_field_ids(task_fields: Iterable[dict]) -> Set[int]:
+    field_ids = set()
+    for field in task_fields:
+        if "id" in field:
+            field_ids.add(field["id"])
+        value = field.get("value")
+        if isinstance(value, dict) and isinstance(value.get("fields"), list):
+            field_ids |= task_field_ids(value["fields"])
+    return field_ids
+
+
+class FormSchemaCache:
+    def __init__(self, cache, pyrus_api: PyrusAPI, ttl: int = DEFAULT_FORM_SCHEMA_TTL):
+        self.cache = cache
+        self.pyrus_api = pyrus_api
+        self.ttl = ttl
+
+    def _cache_key(self, form_id) -> str:
+        return f"form_schema:v{FORM_SCHEMA_VERSION}:{int(form_id)}"
+
+    def _version(self, form_fields) -> str:
+        # Pyrus does not expose a form revision, the fingerprint of the
+        # field definitions stands in for it
+        payload = json.dumps(form_fields, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def _covers(self, schema: dict, task_fields) -> bool:
+        # Cheap revalidation: a task that carries a field the cached form
+        # does not know about was made from a newer form definition
+        if task_fields is None:
+            return True
+        unknown_ids = task_field_ids(task_fields) - set(schema["field_ids"])
+        if unknown_ids:
+            print(f"⚠️ Form schema: unknown field ids {sorted(unknown_ids)}")
+            return False
+        return True
+
+    def get(self, form_id, task_fields=None) -> Optional[dict]:
+        """Cached schema of the form, downloaded again when it expires.
+
+        With task_fields the entry is dropped early only when the task
+        carries a field id the form does not know. Removed fields, renamed
+        fields and changed required steps or visibility conditions go
+        unnoticed for up to the ttl, invalidate() drops them at once.
+        """
+        schema = self.cache.get(self._cache_key(form_id))
+        if schema is not None and self._covers(schema, task_fields):
+            print(f"🫙 Form schema: form {form_id} version {schema['version'][:8]}")
+            return schema
+        return self.refresh(form_id)
+
+    def refresh(self, form_id) -> Optional[dict]:
+        print(f"⌛ Form schema: downloading form {form_id}")
+        form = self.pyrus_api.get_request(f"{PYRUS_API_URL}/forms/{int(form_id)}")
+        if form is None or "fields" not in form:
+            return None
+
+        schema = {
+            "form_id": int(form_id),
+            "version": self._version(form["fields"]),
+            "fields": form["fields"],
+            "field_ids": sorted(form_field_ids(form["fields"])),
+            "field_names": form_field_names(form["fields"]),
+            "visibility_conditions": None,
+            "fetched_at": time.time(),
+        }
+        previous = self.cache.get(self._cache_key(form_id))
+        if (
+            previous is not None
+            and previous["version"] == schema["version"]
+            and previous.get("visibility_conditions") is not None
+        ):
+            # Same form version, keep the conditions compiled for it
+            print(f"✅ Form schema: form {form_id} is unchanged")
+            schema["visibility_conditions"] = previous["visibility_conditions"]
+        else:
+            schema["visibility_conditions"] = compile_visibility_conditions(
+                form["fields"]
+            )
+        self.cache.set(self._cache_key(form_id), schema, timeout=self.ttl)
+        return schema
+
+    def field_by_name(
+        self, form_id, field_name: str, field_type: Optional[str] = None
+    ) -> Optional[dict]:
+        schema = self.get(form_id)
+        if schema is None:
+            return None
+        field = schema["field_names"].get(field_name)
+        if field is None or (field_type is not None and field["type"] != field_type):
+            return None
+        return field
+
+    def invalidate(self, form_id):
+        print(f"🗑️ Form schema: invalidating form {form_id}")
+        self.cache.delete(self._cache_key(form_id))
+
+
+def invalidate_view(form_schema_cache: FormSchemaCache, admin_token: Optional[str]):
+    # POST /form-schema/<int:form_id>/invalidate. Operators drop a cached form
+    # right after editing it in Pyrus, the next webhook downloads it again.
+    # Disabled without an admin token.
+    def invalidate_form_schema(form_id):
+        authorization = request.headers.get("Authorization", "").encode()
+        if not admin_token or not hmac.compare_digest(
+            authorization, f"Bearer {admin_token}".encode()
+        ):
+            return "🚫 Access Denied", 403
+
+        form_schema_cache.invalidate(form_id)
+        return "{}", 200
+
+    return invalidate_form_schema
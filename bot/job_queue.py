@@ -0,0 +1,315 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_STALE_AFTER = 10 * 60
+DEFAULT_REQUEUE_INTERVAL = 60
+
+Job = Tuple[Any, str, Any]  # (job id, job name, payload)
+
+
+class MemoryQueueBackend:
+    # Jobs live in process memory and are lost on restart. A failed job is
+    # queued again until it has run max_attempts times.
+    def __init__(self, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        self._queue: "queue.Queue[Job]" = queue.Queue()
+        self._next_id = 0
+        self._attempts: Dict[Any, int] = {}
+        self._lock = threading.Lock()
+
+    def put(self, name: str, payload: Any):
+        with self._lock:
+            self._next_id += 1
+            job_id = self._next_id
+        self._queue.put((job_id, name, payload))
+        return job_id
+
+    def get(self, timeout: float) -> Optional[Job]:
+        try:
+            job = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            self._attempts[job[0]] = self._attempts.get(job[0], 0) + 1
+        return job
+
+    def ack(self, job_id):
+        with self._lock:
+            self._attempts.pop(job_id, None)
+
+    def fail(self, job_id, error: str, job: Optional[Job] = None) -> bool:
+        # True when the job is queued again
+        with self._lock:
+            if job is None or self._attempts.get(job_id, 0) >= self.max_attempts:
+                self._attempts.pop(job_id, None)
+                return False
+        self._queue.put(job)
+        return True
+
+    def size(self) -> int:
+        return self._queue.qsize()
+
+
+class SQLiteQueueBackend:
+    # Jobs survive restarts and can be shared by workers on the same host.
+    # While a job runs its updated_at is refreshed every third of
+    # stale_after, so a job left "running" by a dead process is the only one
+    # queued again after stale_after seconds. The workers look for such jobs
+    # every requeue_interval seconds. A failed job is queued again until it
+    # has run max_attempts times, then it is kept as "failed".
+    def __init__(
+        self,
+        path: str,
+        stale_after: int = DEFAULT_STALE_AFTER,
+        requeue_interval: float = DEFAULT_REQUEUE_INTERVAL,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    ):
+        self.path = path
+        self.stale_after = stale_after
+        self.requeue_interval = requeue_interval
+        self.max_attempts = max_attempts
+        self._requeued_at = 0.0
+        self._requeue_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running: Set[Any] = set()
+        self._running_lock = threading.Lock()
+        self._heartbeat_thread: Optional[threading.Thread] = None
+        connection = self._connect()
+        try:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status_id ON jobs (status, id)"
+            )
+        finally:
+            connection.close()
+        self._requeue_stale()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def _requeue_stale(self):
+        self._requeued_at = time.monotonic()
+        connection = self._connect()
+        try:
+            # A job that kept killing its worker is not run once more
+            cursor = connection.execute(
+                """
+                UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END
+                WHERE status = 'running' AND updated_at < ?
+                """,
+                (self.max_attempts, time.time() - self.stale_after),
+            )
+            if cursor.rowcount:
+                print(f"♻️ Job queue: {cursor.rowcount} unfinished jobs queued again")
+        finally:
+            connection.close()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.stale_after / 3)
+            with self._running_lock:
+                job_ids = list(self._running)
+            if not job_ids:
+                continue
+            try:
+                connection = self._connect()
+                try:
+                    connection.executemany(
+                        "UPDATE jobs SET updated_at = ? WHERE id = ? AND status = 'running'",
+                        [(time.time(), job_id) for job_id in job_ids],
+                    )
+                finally:
+                    connection.close()
+            except sqlite3.Error as e:
+                print(f"❌ Job queue: heartbeat failed: {e}")
+
+    def _track(self, job_id):
+        with self._running_lock:
+            self._running.add(job_id)
+            if self._heartbeat_thread is None:
+                self._heartbeat_thread = threading.Thread(
+                    target=self._heartbeat, name="job-queue-heartbeat", daemon=True
+                )
+                self._heartbeat_thread.start()
+
+    def _untrack(self, job_id):
+        with self._running_lock:
+            self._running.discard(job_id)
+
+    def put(self, name: str, payload: Any):
+        connection = self._connect()
+        try:
+            cursor = connection.execute(
+                "INSERT INTO jobs (name, payload, updated_at) VALUES (?, ?, ?)",
+                (name, json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+            job_id = cursor.lastrowid
+        finally:
+            connection.close()
+        self._wakeup.set()
+        return job_id
+
+    def _claim(self) -> Optional[Job]:
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT id, name, payload FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (time.time(), row[0]),
+                )
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+        if row is None:
+            return None
+        self._track(row[0])
+        return row[0], row[1], json.loads(row[2])
+
+    def _requeue_stale_periodically(self):
+        # A worker restarted right after a crash finds its old jobs too
+        # fresh to requeue, they are picked up by a later check
+        with self._requeue_lock:
+            if time.monotonic() - self._requeued_at < self.requeue_interval:
+                return
+            self._requeue_stale()
+
+    def get(self, timeout: float) -> Optional[Job]:
+        self._requeue_stale_periodically()
+        job = self._claim()
+        if job is None:
+            # Local puts wake the worker at once, jobs from other processes
+            # are picked up on the next poll
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+            job = self._claim()
+        return job
+
+    def ack(self, job_id):
+        self._untrack(job_id)
+        connection = self._connect()
+        try:
+            connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        finally:
+            connection.close()
+
+    def fail(self, job_id, error: str, job: Optional[Job] = None) -> bool:
+        # True when the job is queued again
+        self._untrack(job_id)
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                """
+                UPDATE jobs SET
+                    status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END,
+                    error = ?,
+                    updated_at = ?
+                WHERE id = ?
+                RETURNING status
+                """,
+                (self.max_attempts, error, time.time(), job_id),
+            ).fetchone()
+        finally:
+            connection.close()
+        requeued = row is not None and row[0] == "queued"
+        if requeued:
+            self._wakeup.set()
+        return requeued
+
+    def size(self) -> int:
+        connection = self._connect()
+        try:
+            return connection.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued'"
+            ).fetchone()[0]
+        finally:
+            connection.close()
+
+
+class JobQueue:
+    def __init__(self, backend, workers: int = DEFAULT_WORKERS, sentry_sdk=None):
+        self.backend = backend
+        self.workers = workers
+        self.sentry_sdk = sentry_sdk
+        self.handlers: Dict[str, Callable[[Any], Any]] = {}
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+
+    def register(self, name: str, handler: Callable[[Any], Any]):
+        self.handlers[name] = handler
+
+    def enqueue(self, name: str, payload: Any):
+        if name not in self.handlers:
+            raise KeyError(f"No handler registered for job '{name}'")
+        job_id = self.backend.put(name, payload)
+        print(f"📥 Job queue: job {job_id} '{name}' is queued")
+        return job_id
+
+    def _run_job(self, job: Job):
+        job_id, name, payload = job
+        print(f"⌛ Job queue: running job {job_id} '{name}'")
+        try:
+            self.handlers[name](payload)
+            self.backend.ack(job_id)
+            print(f"✅ Job queue: job {job_id} '{name}' is done")
+        except Exception as e:
+            if self.backend.fail(job_id, traceback.format_exc(), job):
+                print(f"⚠️ Job queue: job {job_id} '{name}' failed, retrying: {e}")
+            else:
+                print(f"❌ Job queue: job {job_id} '{name}' failed: {e}")
+            if self.sentry_sdk is not None:
+                self.sentry_sdk.capture_exception(e)
+
+    def _work(self):
+        while not self._stopping.is_set():
+            job = self.backend.get(timeout=1)
+            if job is not None:
+                self._run_job(job)
+
+        # Drain what is left so an orderly shutdown does not drop webhooks
+        job = self.backend.get(timeout=0)
+        while job is not None:
+            self._run_job(job)
+            job = self.backend.get(timeout=0)
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"job-queue-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        print(f"✅ Job queue: {self.workers} workers started")
+
+    def stop(self, timeout: float = 30):
+        self._stopping.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self._threads = []
@@ -1,7 +1,45 @@
-import json
 import random
-from flask import Request
 from pyrus_api_handler import PyrusAPI
+from bot.form_schema_cache import FormSchemaCache, DEFAULT_FORM_SCHEMA_TTL
+from bot.checklist_cache import checklist_cache, task_fields_revision
+from bot.visibility_conditions import (
+    compile_visibility_conditions,
+    evaluate_visibility,
+)
+
+
+def _is_group(field) -> bool:
+    value = field.get("value")
+    return value is not None and isinstance(value, dict) and "fields" in value
+
+
+class TaskFieldIndex:
+    def __init__(self, task_fields):
+        # id -> field, first match in depth-first order (any nesting level)
+        self.by_id = {}
+        # id -> [(field, title group it is shown in, is_top_level)] for top
+        # level fields and fields of top level groups, in task order
+        self.candidates = {}
+        self._index(task_fields, None)
+
+    def _index(self, fields, parent):
+        for field in fields:
+            field_id = field["id"]
+            if field_id not in self.by_id:
+                self.by_id[field_id] = field
+            if _is_group(field):
+                if parent is None:
+                    for field_lv_2 in field["value"]["fields"]:
+                        self.candidates.setdefault(field_lv_2["id"], []).append(
+                            (field_lv_2, field, False)
+                        )
+                self._index(field["value"]["fields"], field)
+            if parent is None:
+                # a hidden group is skipped together with its own id
+                group = field if _is_group(field) else None
+                self.candidates.setdefault(field_id, []).append(
+                    (field, group, True)
+                )
 
 
 def format_fields(
@@ -10,140 +48,41 @@ def format_fields(
     required_step,
     field_html_tag_begin="<li>",
     field_html_tag_end="</li>",
+    visibility_conditions=None,
 ):
     if form_fields is None or task_fields is None or required_step is None:
         print("⚠️ No form_fields or task_fields or required_step")
         return False
 
+    # Conditions compiled with the cached form schema are passed in,
+    # otherwise they are compiled from form_fields here
+    if visibility_conditions is None:
+        visibility_conditions = compile_visibility_conditions(form_fields)
+    task_field_index = TaskFieldIndex(task_fields)
+    visibility = {}
     filtered_fields_list = []
     formated_fields_list = []
 
-    def _filtered_field(field_id, task_fields):
-        found_field = {}
-
-        for fields_from_list in task_fields:
-            # if second level
-            value = fields_from_list.get("value")
-            if value is not None and isinstance(value, dict) and "fields" in value:
-                # if value and fields:
-                # if this is group check visiability
-                if not _check_visibility_condition(fields_from_list, task_fields):
-                    continue
-
-                # find field in group by id
-                for fields_from_list_lv_2 in fields_from_list["value"]["fields"]:
-                    if fields_from_list_lv_2["id"] == field_id:
-                        found_field = fields_from_list_lv_2
-
-            # if one level
-            if fields_from_list["id"] == field_id:
-                found_field = fields_from_list
-
-        if not _check_visibility_condition(found_field, task_fields):
-            return None
-
-        return found_field
-
-    def _check_visibility_condition(task_field, task_fields):
-        def find_field_by_id(field_id, field_list):
-            for field in field_list:
-                if field["id"] == field_id:
-                    return field
-                value = field.get("value")
-                if value is not None and isinstance(value, dict) and "fields" in value:
-                    nested_fields = value["fields"]
-                    found_field = find_field_by_id(field_id, nested_fields)
-                    if found_field is not None:
-                        return found_field
-            return None
-
-        def check_field(current_field):
-            if (
-                field is None
-                or current_field["condition_type"] is None
-                or current_field["field_id"] is None
-                or current_field["value"] is None
-            ):
-                print("⛔ check_field: is not ready")
-                return False
-
-            condition_type = int(current_field["condition_type"])
-            field_id = current_field["field_id"]
-            value = current_field["value"]
-            filtered_field = [find_field_by_id(field_id, task_fields)]
-            if isinstance(filtered_field[-1], type(None)):
-                print("⛔ filtered_field: is None and not ready")
-                return False
-
-            chosen_field = filtered_field[-1]
-
-            # Check if field has condition_type 3 or 2 (Заполнено и не Заполнено)
-            if condition_type == 2 or condition_type == 3:
-                type_chosen_field = chosen_field.get("type")
-                value_chosen_field = chosen_field.get("value")
-                if type_chosen_field == "multiple_choice":
-                    if (
-                        condition_type == 2 and value_chosen_field is None
-                    ):  # Не заполнено
-                        return True
-                    if (
-                        condition_type == 3 and value_chosen_field is not None
-                    ):  # Заполнено
-                        return True
-                if type_chosen_field == "checkmark":
-                    if condition_type == 2 and value_chosen_field == "unchecked":
-                        return True
-                    if condition_type == 3 and value_chosen_field == "checked":
-                        return True
-            if (
-                "value" in chosen_field
-                and "choice_ids" in chosen_field["value"]
-                and int(value) in chosen_field["value"]["choice_ids"]
-            ):
-                return True
-
-            return False
-
-        # Check if field has visibility_condition
-        visibility_condition = task_field.get("visibility_condition")
-        if visibility_condition is None:
-            return True
-
-        # Check if field has children (conditions) lv 1
-        conditions = visibility_condition.get("children")
-        conditions_id = visibility_condition.get("field_id")
-        if conditions_id is not None:
-            conditions_is_empty = conditions_id == 0 and conditions is None
-            if conditions_is_empty:
-                return True
-        if conditions is None:
-            return False
-
-        # Loop over conditions (children - lv 1)
-        for condition in conditions:
-            # Get options of the current conditon (children - lv 2 - options))
-            condition_options = condition.get("children")
-            if condition_options is None:
-                is_valid_field = check_field(condition)
-                if not is_valid_field:
-                    return False
-                continue
-
-            has_correct_value_lv2 = (
-                False  # Flag for checking if in one condition has correct value
+    def _is_visible(task_field):
+        key = id(task_field)
+        if key not in visibility:
+            visibility[key] = evaluate_visibility(
+                visibility_conditions.get(task_field["id"], True),
+                task_field_index.by_id,
             )
+        return visibility[key]
 
-            # Loop over options (children - lv 2)
-            for option in condition_options:
-                # Check to find corrent field and if it has correct value
-                if check_field(option):
-                    has_correct_value_lv2 = True
-                    break
-
-            if not has_correct_value_lv2:
-                return False
-
-        return True
+    def _filtered_field(field_id):
+        # the last match in the task wins, fields of hidden groups are skipped
+        for found_field, group, is_top_level in reversed(
+            task_field_index.candidates.get(field_id, [])
+        ):
+            if group is not None and not _is_visible(group):
+                continue
+            if not _is_visible(found_field):
+                return None
+            return found_field, is_top_level
+        return None
 
     for field in form_fields:
         if (
@@ -151,8 +90,8 @@ def format_fields(
             and "required_step" in field["info"]
             and field["info"]["required_step"] == required_step
         ):
-            found_field = _filtered_field(field["id"], task_fields)
-            if found_field:
+            found_field = _filtered_field(field["id"])
+            if found_field and found_field[0]:
                 filtered_fields_list.append(found_field)
         elif "info" in field and "fields" in field["info"]:
             for field_lv_two in field["info"]["fields"]:
@@ -161,65 +100,44 @@ def format_fields(
                     and "required_step" in field_lv_two["info"]
                     and field_lv_two["info"]["required_step"] == required_step
                 ):
-                    found_field = _filtered_field(field_lv_two["id"], task_fields)
-                    if found_field:
+                    found_field = _filtered_field(field_lv_two["id"])
+                    if found_field and found_field[0]:
                         filtered_fields_list.append(found_field)
 
-    for (
-        filtered_field
-    ) in filtered_fields_list:  # loop over filtered fields from form API
-        for task_field in task_fields:  # loop over fields from task API
-            if (
-                "value" in task_field
-                and isinstance(task_field["value"], dict)
-                and "fields" in task_field["value"]
-            ):  # field has second level of fields
-                for task_field_lv_2 in task_field["value"]["fields"]:
-                    if filtered_field["id"] == task_field_lv_2["id"]:
-                        formated_fields_list.append(
-                            f'{field_html_tag_begin}{"✅" if "value" in task_field_lv_2 and task_field_lv_2["value"] != "unchecked" or "value" in task_field_lv_2 and task_field_lv_2["value"] == "checked" else "✔️" if "value" in task_field_lv_2 and task_field_lv_2["value"] == "unchecked" else "❌"}{filtered_field["name"]}{field_html_tag_end}'
-                        )
-            else:
-                if filtered_field["id"] == task_field["id"]:
-                    formated_fields_list.append(
-                        f'{field_html_tag_begin}{"✅" if "value" in task_field and task_field["value"] != "unchecked" or "value" in task_field and task_field["value"] == "checked" else "✔️" if "value" in task_field and task_field["value"] == "unchecked" else "❌"}{filtered_field["name"]}{field_html_tag_end}'
-                    )
+    for filtered_field, is_top_level in filtered_fields_list:
+        # title groups are listed through their fields, not on their own
+        if is_top_level and _is_group(filtered_field):
+            continue
+        formated_fields_list.append(
+            f'{field_html_tag_begin}{"✅" if "value" in filtered_field and filtered_field["value"] != "unchecked" or "value" in filtered_field and filtered_field["value"] == "checked" else "✔️" if "value" in filtered_field and filtered_field["value"] == "unchecked" else "❌"}{filtered_field["name"]}{field_html_tag_end}'
+        )
 
     return formated_fields_list
 
 
 class ReminderStep:
     def __init__(
-        self, cache, request: Request, pyrus_secret_key: str, pyrus_login: str
+        self,
+        cache,
+        data: dict,
+        pyrus_secret_key: str,
+        pyrus_login: str,
+        form_schema_ttl: int = DEFAULT_FORM_SCHEMA_TTL,
     ):
         self.pyrus_login = pyrus_login
         self.pyrus_secret_key = pyrus_secret_key
-        self.request = request
-        self.signature = self.request.headers.get("X-Pyrus-Sig")
-        self.body = request.data
+        # The payload is checked and parsed by WebhookIngress
+        self.data = data
         self.cache = cache
         self.pyrus_api = PyrusAPI(self.cache, self.pyrus_login, self.pyrus_secret_key)
-
-    def _validate_request(self):
-        # check if signature is set
-        if self.signature is None:
-            print("⛔ The request does not have the X-Pyrus-Sig.")
-            return False
-        # check if secret is set
-        if self.pyrus_secret_key is None or not self.pyrus_secret_key:
-            print(f"Secret is not set ❌")
-            return False
-        # check if body is set
-        if self.body is None or not self.body:
-            print(f"Body is not set ❌")
-            return False
-
-        return True
+        self.form_schema_cache = FormSchemaCache(
+            self.cache, self.pyrus_api, ttl=form_schema_ttl
+        )
 
     def _prepare_response(self):
         print("⌛ Preparing response")
 
-        task = json.loads(self.request.data)["task"]
+        task = self.data["task"]
         task_fields = task["fields"]
         current_step_num = int(task["current_step"]) if "current_step" in task else None
         if current_step_num is None:
@@ -252,9 +170,6 @@ class ReminderStep:
         comment = task["comments"][-1]
 
         has_approval_choice = "approval_choice" in comment
-        has_approvals_added = "approvals_added" in comment
-        has_approvals_rerequested = "approvals_rerequested" in comment
-        has_approvals_removed = "approvals_removed" in comment
         is_changed_step = "changed_step" in comment
 
         if has_approval_choice or task_was_created or is_changed_step:
@@ -274,9 +189,7 @@ class ReminderStep:
                 if str(approval["approval_choice"]) == "approved"
             ]
 
-            form = self.pyrus_api.get_request(
-                f"https://api.pyrus.com/v4/forms/{int(task['form_id'])}"
-            )
+            form = self.form_schema_cache.get(task["form_id"], task_fields)
 
             if form is None:
                 print("⚠️ Form not found, id:", task["form_id"])
@@ -284,12 +197,25 @@ class ReminderStep:
 
             # print("form", form)
 
-            formatted_fields = format_fields(
-                form["fields"],
-                task_fields,
+            # The checklist only changes with the form version, the task
+            # field values and the step, approve/revoke/re-request webhooks
+            # for the same task revision reuse it
+            checklist_key = (
+                form["form_id"],
+                form["version"],
+                task_fields_revision(task_fields),
                 current_step_num,
-                field_html_tag_begin="<li>",
-                field_html_tag_end="</li>",
+            )
+            formatted_fields = checklist_cache.get_or_render(
+                checklist_key,
+                lambda: format_fields(
+                    form["fields"],
+                    task_fields,
+                    current_step_num,
+                    field_html_tag_begin="<li>",
+                    field_html_tag_end="</li>",
+                    visibility_conditions=form["visibility_conditions"],
+                ),
             )
             # print("✅ formatted_fields is ready", formatted_fields)
 
@@ -350,16 +276,25 @@ class ReminderStep:
         print("⚠️ No response")
         return "{}", 200
 
-    def _filter_required_fields(self, field, current_step_num):
-        if "info" in field and "required_step" in field["info"]:
-            return int(field["info"]["required_step"]) == current_step_num
-        else:
-            return False
-
     def process_request(self):
-        if not self._validate_request():
-            print("❌ Signature is not correct")
-            return "🚫 Access Denied", 403
-
-        print("✅ Signature_correct")
         return self._prepare_response()
+
+
+def reminder_step_view(
+    cache,
+    pyrus_secret_key: str,
+    pyrus_login: str,
+    form_schema_ttl: int = DEFAULT_FORM_SCHEMA_TTL,
+):
+    # /step-reminder, wrapped by WebhookIngress.route which passes the payload
+    def reminder_step_page(data):
+        reminder_step = ReminderStep(
+            cache=cache,
+            data=data,
+            pyrus_secret_key=pyrus_secret_key,
+            pyrus_login=pyrus_login,
+            form_schema_ttl=form_schema_ttl,
+        )
+        return reminder_step.process_request()
+
+    return reminder_step_page
@@ -1,15 +1,37 @@
-import json
-import hmac
-import hashlib
-from flask import Request
-from pyrus import client
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pyrus_api_handler import PyrusAPI
-from pyrus.models.entities import FormField, Title
+from pyrus_client import PyrusClient
+from bot.job_queue import JobQueue
+from bot.webhook_dedup import WebhookDeduplicator, DEFAULT_DEDUP_TTL
+from bot.echo_guard import EchoGuard, DEFAULT_ECHO_TTL
+from bot.field_extractor import FieldKey, find_fields
+from bot.form_schema_cache import FormSchemaCache, DEFAULT_FORM_SCHEMA_TTL
+from pyrus.models.entities import FormField
 from pyrus.models.requests import TaskCommentRequest
-from typing import Union, List
+from typing import Any, Dict, List, Optional, Tuple
+
+
+DEFAULT_VALUE_CACHE_TTL = 5 * 60
+DEFAULT_SYNC_CONCURRENCY = 4
+
+# (link field, field in the current task, field in the linked task)
+FieldMapping = Tuple[str, str, str]
+
+
+def field_mappings(traked_fields: dict) -> List[FieldMapping]:
+    # A link field maps one [source, target] pair or a list of them
+    mappings = []
+    for field_traked, fields in traked_fields.items():
+        pairs = fields if fields and isinstance(fields[0], (list, tuple)) else [fields]
+        for source_field_name, field_name in pairs:
+            mappings.append((field_traked, source_field_name, field_name))
+    return mappings
 
 
 class SyncTaskData:
+    JOB_NAME = "webhook-sync-task-data"
+
     def __init__(
         self,
         cache,
@@ -17,90 +39,247 @@ class SyncTaskData:
         pyrus_login: str,
         sentry_sdk,
         traked_fields: dict,
+        job_queue: Optional[JobQueue] = None,
+        dedup_ttl: int = DEFAULT_DEDUP_TTL,
+        form_schema_ttl: int = DEFAULT_FORM_SCHEMA_TTL,
+        value_cache_ttl: int = DEFAULT_VALUE_CACHE_TTL,
+        echo_ttl: int = DEFAULT_ECHO_TTL,
+        max_concurrency: int = DEFAULT_SYNC_CONCURRENCY,
     ):
         self.pyrus_secret_key = pyrus_secret_key
         self.pyrus_login = pyrus_login
         self.cache = cache
-        self.pyrus_client = client.PyrusAPI(self.pyrus_login, self.pyrus_secret_key)
+        self.pyrus_client = PyrusClient(
+            self.pyrus_login, self.pyrus_secret_key, cache=self.cache
+        )
         self.pyrus_api = PyrusAPI(self.cache, self.pyrus_login, self.pyrus_secret_key)
+        self.form_schema_cache = FormSchemaCache(
+            self.cache, self.pyrus_api, ttl=form_schema_ttl
+        )
+        self.value_cache_ttl = value_cache_ttl
         self.sentry_sdk = sentry_sdk
         self.tracked_fields = traked_fields
+        self.field_mappings = field_mappings(traked_fields)
+        self.tracked_field_keys: List[FieldKey] = list(
+            dict.fromkeys(
+                key
+                for field_traked, source_field_name, _ in self.field_mappings
+                for key in (("form_link", field_traked), ("text", source_field_name))
+            )
+        )
+        self.max_concurrency = max_concurrency
+        self.job_queue = job_queue
+        self.deduplicator = WebhookDeduplicator(
+            self.cache, self.JOB_NAME, ttl=dedup_ttl
+        )
+        self.echo_guard = EchoGuard(self.cache, self.pyrus_login, ttl=echo_ttl)
+        # Writes skipped because the linked task already held the value,
+        # linked tasks are synced from several threads
+        self.skipped_writes = 0
+        self._stats_lock = threading.Lock()
 
-    def _validate_request(self, signature, body):
-        # check if signature is set
-        if signature is None:
-            self.sentry_sdk.capture_message(
-                "⛔ The request does not have the X-Pyrus-Sig.", level="debug"
+    def _link_form_key(self, field_traked: str) -> str:
+        return f"sync_link_form:{field_traked}"
+
+    def _value_key(self, task_id, field_id) -> str:
+        return f"sync_value:{task_id}:{field_id}"
+
+    def _remember_value(self, task_id, field_id, value):
+        # Wrapped, so an empty field is told apart from an unknown one
+        self.cache.set(
+            self._value_key(task_id, field_id),
+            {"value": value},
+            timeout=self.value_cache_ttl,
+        )
+
+    def _cached_target_fields(
+        self, id_task_to_update, mappings: List[FieldMapping]
+    ) -> Optional[Dict[str, Tuple[int, Optional[dict]]]]:
+        # Linked task field name -> (field id, {"value": ...} last written or
+        # read by the bot, when it is known). The field ids belong to the form
+        # of the linked task: once the form behind the link fields is known
+        # they come from the cached form definition and the task is not read.
+        resolved: Dict[str, Tuple[int, Optional[dict]]] = {}
+        for field_traked, _, field_name in mappings:
+            form_id = self.cache.get(self._link_form_key(field_traked))
+            field = (
+                self.form_schema_cache.field_by_name(form_id, field_name, "text")
+                if form_id is not None
+                else None
+            )
+            if field is None:
+                return None
+            resolved[field_name] = (
+                field["id"],
+                self.cache.get(self._value_key(id_task_to_update, field["id"])),
+            )
+        print(
+            f"🫙 Поля задачи '{id_task_to_update}' найдены в кэше формы: {list(resolved)}"
+        )
+        return resolved
+
+    def _read_target_fields(
+        self, id_task_to_update, mappings: List[FieldMapping]
+    ) -> Optional[Dict[str, Tuple[int, Optional[dict]]]]:
+        # Linked task field name -> (field id, {"value": ...} with the value
+        # the task holds now)
+        print(f"➡️ Получаем связанную задачу, id:'{id_task_to_update}'")
+        responce_task_to_update = self.pyrus_client.get_task(id_task_to_update)
+        task_to_update = responce_task_to_update.task
+        if task_to_update is None or task_to_update.fields is None:
+            print(
+                f"❌  Не удалось получить задачу '{id_task_to_update}', error: {responce_task_to_update.error}, error_code: {responce_task_to_update.error_code}, original_response: {responce_task_to_update.original_response}, task: {responce_task_to_update.task}"
             )
-            print("⛔ The request does not have the X-Pyrus-Sig.")
-            return False
-        # check if secret is set
-        if self.pyrus_secret_key is None or not self.pyrus_secret_key:
             self.sentry_sdk.capture_message(
-                "Debug message: Secret is not set ❌", level="debug"
+                f"Webhook Sync Task Data Debug: Ошибка палучения задачи '{id_task_to_update}': '{responce_task_to_update.error}'",
+                level="error",
+            )
+            return None
+
+        if task_to_update.form_id is not None:
+            for field_traked in {mapping[0] for mapping in mappings}:
+                self.cache.set(
+                    self._link_form_key(field_traked),
+                    task_to_update.form_id,
+                    timeout=self.form_schema_cache.ttl,
+                )
+
+        field_names = list(dict.fromkeys(mapping[2] for mapping in mappings))
+        print(
+            f"➡️ Задачу получили, id:'{id_task_to_update}'✅, находим в задаче поля {field_names}"
+        )
+        fields_found = find_fields(
+            task_to_update.fields, [("text", field_name) for field_name in field_names]
+        )
+        resolved = {}
+        for field_name in field_names:
+            field_task_to_update = fields_found.get(("text", field_name))
+            if not isinstance(field_task_to_update, FormField):
+                print(
+                    f"➡️ Поле '{field_name}' для обновления в связанноей задачи: ❌ Не найдено, поля связанной задачи: {task_to_update.fields}"
+                )
+                continue
+            print(
+                f"➡️ Поле для обновления в связанноей задачи: '✅ Найдено, поле: {field_task_to_update.name}'"
+            )
+            self._remember_value(
+                id_task_to_update, field_task_to_update.id, field_task_to_update.value
+            )
+            resolved[field_name] = (
+                field_task_to_update.id,
+                {"value": field_task_to_update.value},
+            )
+        return resolved
+
+    def _sync_linked_task(self, task: dict, id_task_to_update, updates: List[tuple]):
+        # One read at most and one write for all the fields of a linked task
+        mappings = [update[:3] for update in updates]
+        target_fields = self._cached_target_fields(id_task_to_update, mappings)
+        if target_fields is not None and any(
+            target_fields[field_name][1] == {"value": value_field_to_update}
+            for _, _, field_name, value_field_to_update in updates
+        ):
+            # The value cache only says the write may be skipped: someone may
+            # have edited the field by hand in Pyrus since. The task is read
+            # to confirm before a write is skipped.
+            target_fields = None
+        if target_fields is None:
+            target_fields = self._read_target_fields(id_task_to_update, mappings)
+        if target_fields is None:
+            return
+
+        field_updates: Dict[int, Any] = {}
+        synced_fields = []
+        for _, source_field_name, field_name, value_field_to_update in updates:
+            if field_name not in target_fields:
+                continue
+            field_id_to_update, current_value = target_fields[field_name]
+            if (
+                current_value is not None
+                and current_value["value"] == value_field_to_update
+            ):
+                with self._stats_lock:
+                    self.skipped_writes += 1
+                    skipped_writes = self.skipped_writes
+                print(
+                    f"⏩ Поле '{field_name}' в задаче '{id_task_to_update}' уже содержит значение '{value_field_to_update}', обновление пропущено (всего пропущено: {skipped_writes})"
+                )
+                continue
+            field_updates[field_id_to_update] = value_field_to_update
+            synced_fields.append((field_name, source_field_name))
+
+        if not field_updates:
+            return
+
+        print(
+            f"➡️ Обновляняем поля {[field[0] for field in synced_fields]} в задаче '{id_task_to_update}' и оставяем коментарий"
+        )
+        data_to_update_field_task: TaskCommentRequest = TaskCommentRequest(
+            text="\n".join(
+                f"Значение поля '{field_name}' было сихронизированно с полем '{source_field_name}' из связанной задачи '{task['text']}'"
+                for field_name, source_field_name in synced_fields
+            ),
+            field_updates=[
+                {"id": field_id, "value": value}
+                for field_id, value in field_updates.items()
+            ],
+        )
+        self.echo_guard.expect_write(
+            id_task_to_update, data_to_update_field_task.field_updates
+        )
+        try:
+            comment_task = self.pyrus_client.comment_task(
+                task_id=id_task_to_update,
+                task_comment_request=data_to_update_field_task,
+            )
+        except Exception:
+            self.echo_guard.forget_write(
+                id_task_to_update, data_to_update_field_task.field_updates
+            )
+            raise
+        if comment_task.error is None:
+            print(f"➡️ Задача '{id_task_to_update}' обновлена ✅")
+            for field_id, value in field_updates.items():
+                self._remember_value(id_task_to_update, field_id, value)
+            self.echo_guard.remember_author(comment_task.task)
+        else:
+            self.echo_guard.forget_write(
+                id_task_to_update, data_to_update_field_task.field_updates
+            )
+            # The linked task may belong to another form now, learn it again
+            # from the next task read
+            for field_traked in {mapping[0] for mapping in mappings}:
+                self.cache.delete(self._link_form_key(field_traked))
+            print(
+                f"❌  Ошибка обновления задачи '{id_task_to_update}': error '{comment_task.error}', error_code '{comment_task.error_code}', original_response '{comment_task.original_response}', task '{comment_task.task}'"
             )
-            print("Secret is not set ❌")
-            return False
-        # check if body is set
-        if body is None or not body:
             self.sentry_sdk.capture_message(
-                "Debug message: Body is not set ❌", level="debug"
+                f"Webhook Sync Task Data Debug: Ошибка обновления задачи '{id_task_to_update}': '{comment_task.error}'",
+                level="error",
             )
-            print("Body is not set ❌")
-            return False
 
-        # chech signature
-        secret = str.encode(self.pyrus_secret_key)
-        digest = hmac.new(secret, msg=body, digestmod=hashlib.sha1).hexdigest()
-        return hmac.compare_digest(digest, signature.lower())
+    def _sync_linked_tasks(self, task: dict, linked_tasks: Dict[Any, List[tuple]]):
+        if len(linked_tasks) <= 1:
+            for id_task_to_update, updates in linked_tasks.items():
+                self._sync_linked_task(task, id_task_to_update, updates)
+            return
 
-    def _find_field_by_name(
-        self,
-        fields: Union[dict, List[FormField]],
-        field_name: str,
-        field_type: str = "text",
-    ) -> Union[dict, FormField, None]:
-        for field in fields:
-            if isinstance(field, dict):
-                if (
-                    "value" in field
-                    and isinstance(field["value"], dict)
-                    and "fields" in field["value"]
-                    and isinstance(field["value"]["fields"], list)
-                ):
-                    nested_fields = field["value"]["fields"]
-                    found_field = self._find_field_by_name(
-                        nested_fields, field_name, field_type
-                    )
-                    if found_field is not None:
-                        return found_field
-                if (
-                    "type" in field
-                    and field["type"] == field_type
-                    and "name" in field
-                    and field["name"] == field_name
-                ):
-                    return field
-            elif isinstance(field, FormField):
-                if (
-                    field.value is not None
-                    and isinstance(field.value, Title)
-                    and field.value.fields is not None
-                    and isinstance(field.value.fields, List)
-                ):
-                    nested_fields = field.value.fields
-                    found_field = self._find_field_by_name(
-                        nested_fields, field_name, field_type
-                    )
-                    if found_field is not None:
-                        return found_field
-                if (
-                    field.type is not None
-                    and field.type == field_type
-                    and field.name is not None
-                    and field.name == field_name
-                ):
-                    return field
+        # Linked tasks are independent, a failure in one does not stop others
+        with ThreadPoolExecutor(
+            max_workers=min(len(linked_tasks), self.max_concurrency),
+            thread_name_prefix="sync-task-data",
+        ) as executor:
+            futures = {
+                id_task_to_update: executor.submit(
+                    self._sync_linked_task, task, id_task_to_update, updates
+                )
+                for id_task_to_update, updates in linked_tasks.items()
+            }
+        for id_task_to_update, future in futures.items():
+            error = future.exception()
+            if error is not None:
+                print(f"❌  Ошибка обновления задачи '{id_task_to_update}': {error}")
+                self.sentry_sdk.capture_exception(error)
 
     def _handle_response(self, task: dict):
         print("🚚 Hadling the response...")
@@ -113,37 +292,52 @@ class SyncTaskData:
             print(f"✅ Task has comments and field_updates")
             task_fields_updated: dict = task["comments"][0]["field_updates"]
             task_fields: dict = task["fields"]
+            updated_fields_found = find_fields(
+                task_fields_updated, self.tracked_field_keys
+            )
+            # Links that were not updated are looked up in the task fields,
+            # all of them in one more pass
+            task_fields_found = find_fields(
+                task_fields,
+                [
+                    ("form_link", field_traked)
+                    for field_traked, _, _ in self.field_mappings
+                    if ("form_link", field_traked) not in updated_fields_found
+                ],
+            )
 
-            for field_traked, fields in self.tracked_fields.items():
+            # Linked task id -> [(link field, source field, linked task field, value)]
+            linked_tasks: Dict[Any, List[tuple]] = {}
+            for field_traked, source_field_name, field_name in self.field_mappings:
 
                 print(
-                    f"🔎 Ищем в обновленных, поле, для опрделения номера задачи, где будем сихронизировать значения, в текущей задаче с полем — '{fields[0]}' и в найденой задаче с полем — '{fields[1]}'"
+                    f"🔎 Ищем в обновленных, поле, для опрделения номера задачи, где будем сихронизировать значения, в текущей задаче с полем — '{source_field_name}' и в найденой задаче с полем — '{field_name}'"
                 )
-                task_tracked_main_updated_field_found = self._find_field_by_name(
-                    task_fields_updated, field_traked, "form_link"
+                task_tracked_main_updated_field_found = updated_fields_found.get(
+                    ("form_link", field_traked)
                 )
                 if task_tracked_main_updated_field_found is None:
                     print(
-                        f"❌ В списке обновленных полей, поле для определения задачи — '{field_traked}' не найдено"
+                        f"❌ В списке обновленных полей, поле для определения задачи — '{field_traked}' не найдено"
                     )
                     print(
-                        f"🔎 Ищем в списке полей, поле, для опрделения номера задачи, где будем сихронизировать значения, в текущей задаче с полем — '{fields[0]}' и в найденой задаче с полем — '{fields[1]}'"
+                        f"🔎 Ищем в списке полей, поле, для опрделения номера задачи, где будем сихронизировать значения, в текущей задаче с полем — '{source_field_name}' и в найденой задаче с полем — '{field_name}'"
                     )
-                    task_tracked_main_updated_field_found = self._find_field_by_name(
-                        task_fields, field_traked, "form_link"
+                    task_tracked_main_updated_field_found = task_fields_found.get(
+                        ("form_link", field_traked)
                     )
                 print(
-                    f"➡️ Значение поля для опрделения задачи — {f'✅ Найдено, поле: {task_tracked_main_updated_field_found}' if task_tracked_main_updated_field_found else f'❌ Не найдено, список обновленных полей: {task_fields_updated}'}"
+                    f"➡️ Значение поля для опрделения задачи — {f'✅ Найдено, поле: {task_tracked_main_updated_field_found}' if task_tracked_main_updated_field_found else f'❌ Не найдено, список обновленных полей: {task_fields_updated}'}"
                 )
 
                 print(
-                    f"🔎 Ищем в обновленных, поле '{fields[0]}', для сихронизиции значения в текущей задаче."
+                    f"🔎 Ищем в обновленных, поле '{source_field_name}', для сихронизиции значения в текущей задаче."
                 )
-                task_tracked_updated_field_one_found = self._find_field_by_name(
-                    task_fields_updated, fields[0], "text"
+                task_tracked_updated_field_one_found = updated_fields_found.get(
+                    ("text", source_field_name)
                 )
                 print(
-                    f"➡️ Значение поля '{fields[0]}' для сихронизации значения c другой задачей — {f'✅ Найдено, поле: {task_tracked_updated_field_one_found}' if task_tracked_updated_field_one_found else f'❌ Не найдено'}"
+                    f"➡️ Значение поля '{source_field_name}' для сихронизации значения c другой задачей — {f'✅ Найдено, поле: {task_tracked_updated_field_one_found}' if task_tracked_updated_field_one_found else f'❌ Не найдено'}"
                 )
 
                 if (
@@ -158,75 +352,17 @@ class SyncTaskData:
                         )
                         continue
 
-                    value_field_to_update = task_tracked_updated_field_one_found[
-                        "value"
-                    ]
                     id_task_to_update = task_tracked_main_updated_field_found["value"][
                         "task_id"
                     ]
-
-                    print(f"➡️ Получаем связанную задачу, id:'{id_task_to_update}'")
-                    field_name_task_to_update: str = fields[1]
-                    responce_task_to_update = self.pyrus_client.get_task(
-                        id_task_to_update
-                    )
-                    task_to_update = responce_task_to_update.task
-
-                    if task_to_update is not None and task_to_update.fields is not None:
-                        print(
-                            f"➡️ Задачу получили, id:'{id_task_to_update}'✅, находим в задаче поле '{field_name_task_to_update}'"
-                        )
-                        field_task_to_update = self._find_field_by_name(
-                            field_name=field_name_task_to_update,
-                            fields=task_to_update.fields,
-                        )
-                        if (
-                            isinstance(field_task_to_update, FormField)
-                            and field_task_to_update
-                        ):
-                            print(
-                                f"➡️ Поле для обновления в связанноей задачи: '✅ Найдено, поле: {field_task_to_update.name}'"
-                            )
-                            print(
-                                f"➡️ Обновляняем поле '{field_name_task_to_update}' в задаче '{id_task_to_update}' и оставяем коментарий"
-                            )
-                            data_to_update_field_task: TaskCommentRequest = (
-                                TaskCommentRequest(
-                                    text=f"Значение поля '{field_name_task_to_update}' было сихронизированно с полем '{fields[0]}' из связанной задачи '{task['text']}'",
-                                    field_updates=[
-                                        {
-                                            "id": field_task_to_update.id,
-                                            "value": value_field_to_update,
-                                        }
-                                    ],
-                                )
-                            )
-                            comment_task = self.pyrus_client.comment_task(
-                                task_id=id_task_to_update,
-                                task_comment_request=data_to_update_field_task,
-                            )
-                            if comment_task.error is None:
-                                print(f"➡️ Задача '{id_task_to_update}' обновлена ✅")
-                            else:
-                                print(
-                                    f"❌  Ошибка обновления задачи '{id_task_to_update}': error '{comment_task.error}', error_code '{comment_task.error_code}', original_response '{comment_task.original_response}', task '{comment_task.task}'"
-                                )
-                                self.sentry_sdk.capture_message(
-                                    f"Webhook Sync Task Data Debug: Ошибка обновления задачи '{id_task_to_update}': '{comment_task.error}'",
-                                    level="error",
-                                )
-                        else:
-                            print(
-                                f"➡️ Поле для обновления задаче в связанноей задачи: ❌ Не найдено, поля связанной задачи: {task_to_update.fields}"
-                            )
-                    else:
-                        print(
-                            f"❌  Не удалось получить задачу '{id_task_to_update}', error: {responce_task_to_update.error}, error_code: {responce_task_to_update.error_code}, original_response: {responce_task_to_update.original_response}, task: {responce_task_to_update.task}"
-                        )
-                        self.sentry_sdk.capture_message(
-                            f"Webhook Sync Task Data Debug: Ошибка палучения задачи '{id_task_to_update}': '{responce_task_to_update.error}'",
-                            level="error",
+                    linked_tasks.setdefault(id_task_to_update, []).append(
+                        (
+                            field_traked,
+                            source_field_name,
+                            field_name,
+                            task_tracked_updated_field_one_found["value"],
                         )
+                    )
                 else:
                     print(
                         f"❌  Ошибка обновления задачи. 'task_tracked_main_updated_field_found' или 'task_tracked_updated_field_one_found' нет или не являются словарями: '{task_tracked_main_updated_field_found}', '{task_tracked_updated_field_one_found}'"
@@ -235,37 +371,22 @@ class SyncTaskData:
                         f"Webhook Sync Task Data Debug: Ошибка обновления задачи. 'task_tracked_main_updated_field_found' или 'task_tracked_updated_field_one_found' нет или не являются словарями: '{task_tracked_main_updated_field_found}', '{task_tracked_updated_field_one_found}'",
                         level="error",
                     )
+
+            self._sync_linked_tasks(task, linked_tasks)
         return "{}", 200
 
-    def process_request(self, request: Request):
-        print("🔐 Processing request...")
-        signature = request.headers.get("X-Pyrus-Sig")
-        body = request.data
+    def handle_task(self, task: dict):
+        return self._handle_response(task)
 
-        if not self._validate_request(signature=signature, body=body):
-            self.sentry_sdk.capture_message(
-                "Debug message: ❌ Signature is not correct", level="debug"
-            )
-            print("❌ Signature is not correct")
-            return "🚫 Access Denied", 403
+    def process_request(self, data: dict):
+        # The payload is checked and parsed by WebhookIngress
+        task = data["task"]
+        # Echoes of the bot's own writes are dropped before any
+        # outbound call
+        if self.echo_guard.is_echo(task):
+            return "{}", 200
 
-        print("✅ Signature_correct")
+        return self.deduplicator.run(
+            task, self._handle_response, self.job_queue, self.JOB_NAME
+        )
 
-        try:
-            data = json.loads(body)
-
-            if "task" in data:
-                task = data["task"]
-                return self._handle_response(task)
-            else:
-                print("😢 Body does not contain 'task'")
-                self.sentry_sdk.capture_message(
-                    "Debug message: 😢 Body does not contain 'task'", level="debug"
-                )
-                return "🚫 Access Denied", 403
-        except json.JSONDecodeError:
-            self.sentry_sdk.capture_message(
-                "Debug message: 😢 Body is not valid JSON", level="debug"
-            )
-            print("😢 Body is not valid JSON")
-            return "🚫 Access Denied", 403
@@ -0,0 +1,100 @@
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+
+# A compiled condition is True (always visible), False (never visible) or a
+# tuple of clauses. The field is visible when every clause has at least one
+# matching leaf. A leaf is (field_id, condition_type, choice_id).
+Leaf = Tuple[int, int, Optional[int]]
+Program = Union[bool, Tuple[Tuple[Leaf, ...], ...]]
+
+CONDITION_EMPTY = 2  # Не заполнено
+CONDITION_FILLED = 3  # Заполнено
+
+
+def _compile_leaf(condition: dict) -> Optional[Leaf]:
+    if (
+        condition.get("condition_type") is None
+        or condition.get("field_id") is None
+        or condition.get("value") is None
+    ):
+        return None
+
+    try:
+        choice_id = int(condition["value"])
+    except (TypeError, ValueError):
+        choice_id = None
+    return (condition["field_id"], int(condition["condition_type"]), choice_id)
+
+
+def compile_visibility_condition(visibility_condition: Optional[dict]) -> Program:
+    if visibility_condition is None:
+        return True
+
+    conditions = visibility_condition.get("children")
+    if visibility_condition.get("field_id") == 0 and conditions is None:
+        return True
+    if conditions is None:
+        return False
+
+    clauses = []
+    for condition in conditions:
+        options = condition.get("children")
+        if options is None:
+            options = [condition]
+        leaves = tuple(
+            leaf for leaf in (_compile_leaf(option) for option in options) if leaf
+        )
+        # A clause nothing can satisfy hides the field whatever the task holds
+        if not leaves:
+            return False
+        clauses.append(leaves)
+
+    return tuple(clauses) if clauses else True
+
+
+def compile_visibility_conditions(form_fields: Iterable[dict]) -> Dict[int, Program]:
+    programs: Dict[int, Program] = {}
+    for field in form_fields:
+        if "visibility_condition" in field:
+            programs[field["id"]] = compile_visibility_condition(
+                field["visibility_condition"]
+            )
+        info = field.get("info")
+        if isinstance(info, dict) and isinstance(info.get("fields"), list):
+            programs.update(compile_visibility_conditions(info["fields"]))
+    return programs
+
+
+def _leaf_matches(leaf: Leaf, fields_by_id: Dict[int, dict]) -> bool:
+    field_id, condition_type, choice_id = leaf
+    chosen_field = fields_by_id.get(field_id)
+    if chosen_field is None:
+        return False
+
+    value = chosen_field.get("value")
+    if condition_type == CONDITION_EMPTY or condition_type == CONDITION_FILLED:
+        field_type = chosen_field.get("type")
+        if field_type == "multiple_choice":
+            if condition_type == CONDITION_EMPTY and value is None:
+                return True
+            if condition_type == CONDITION_FILLED and value is not None:
+                return True
+        if field_type == "checkmark":
+            if condition_type == CONDITION_EMPTY and value == "unchecked":
+                return True
+            if condition_type == CONDITION_FILLED and value == "checked":
+                return True
+
+    return (
+        choice_id is not None
+        and isinstance(value, dict)
+        and choice_id in value.get("choice_ids", ())
+    )
+
+
+def evaluate_visibility(program: Program, fields_by_id: Dict[int, dict]) -> bool:
+    if program is True or program is False:
+        return program
+    return all(
+        any(_leaf_matches(leaf, fields_by_id) for leaf in clause) for clause in program
+    )
@@ -0,0 +1,76 @@
+from typing import Callable, Optional, Tuple
+
+
+DEFAULT_DEDUP_TTL = 60 * 60
+
+Response = Tuple[str, int]
+
+
+class WebhookDeduplicator:
+    # Pyrus redelivers a webhook when we answer too slowly. A delivery is
+    # identified by the task id and the id of its newest comment, repeats get
+    # the stored response back without being processed again.
+    def __init__(self, cache, namespace: str, ttl: int = DEFAULT_DEDUP_TTL):
+        self.cache = cache
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def _cache_key(self, task: dict) -> Optional[str]:
+        comments = task.get("comments")
+        if "id" not in task or not comments:
+            return None
+        comment_ids = [comment["id"] for comment in comments if "id" in comment]
+        if not comment_ids:
+            return None
+        return f"webhook_dedup:{self.namespace}:{task['id']}:{max(comment_ids)}"
+
+    def begin(self, task: dict) -> Optional[Response]:
+        key = self._cache_key(task)
+        if key is None:
+            return None
+
+        # add() only succeeds for the first delivery, a redelivery that comes
+        # while it is still running gets the empty answer
+        if self.cache.add(key, ("{}", 200), timeout=self.ttl):
+            return None
+
+        response = self.cache.get(key)
+        print(f"♻️ Webhook dedup: repeated delivery {key}")
+        return tuple(response) if response is not None else ("{}", 200)  # type: ignore
+
+    def complete(self, task: dict, response: Response):
+        key = self._cache_key(task)
+        if key is not None:
+            self.cache.set(key, tuple(response), timeout=self.ttl)
+
+    def abort(self, task: dict):
+        # Forget a failed delivery so the next redelivery is processed
+        key = self._cache_key(task)
+        if key is not None:
+            self.cache.delete(key)
+
+    def run(
+        self,
+        task: dict,
+        handle: Callable[[dict], Response],
+        job_queue=None,
+        job_name: Optional[str] = None,
+    ) -> Response:
+        duplicate_response = self.begin(task)
+        if duplicate_response is not None:
+            return duplicate_response
+
+        try:
+            # Fast-ack mode: answer Pyrus right away, a queue worker
+            # makes the outbound calls
+            if job_queue is not None:
+                job_queue.enqueue(job_name, task)
+                response = ("{}", 200)
+            else:
+                response = handle(task)
+        except Exception:
+            self.abort(task)
+            raise
+
+        self.complete(task, response)
+        return response
@@ -0,0 +1,98 @@
+import functools
+import hashlib
+import hmac
+import json
+from flask import Request, request
+from typing import Any, Callable, Optional
+
+
+# Pyrus sends the whole task with all of its comments, a long-lived task
+# weighs several megabytes
+DEFAULT_MAX_BODY_SIZE = 32 * 1024 * 1024
+SIGNATURE_HEADER = "X-Pyrus-Sig"
+
+ACCESS_DENIED = ("🚫 Access Denied", 403)
+BODY_TOO_LARGE = ("🚫 Body is too large", 413)
+
+
+@functools.lru_cache(maxsize=None)
+def _hmac_state(secret: str):
+    # The key schedule is computed once per secret, every request copies it
+    return hmac.new(secret.encode(), digestmod=hashlib.sha1)
+
+
+class WebhookIngress:
+    # Checks every Pyrus webhook before its handler runs: body size,
+    # X-Pyrus-Sig and the JSON payload. The body is parsed once and the
+    # handler gets the payload.
+    def __init__(
+        self,
+        secret: Optional[str],
+        sentry_sdk=None,
+        max_body_size: int = DEFAULT_MAX_BODY_SIZE,
+    ):
+        self.secret = secret
+        self.sentry_sdk = sentry_sdk
+        self.max_body_size = max_body_size
+
+    def _reject(self, message: str, response=ACCESS_DENIED):
+        print(message)
+        if self.sentry_sdk is not None:
+            self.sentry_sdk.capture_message(f"Debug message: {message}", level="debug")
+        return response
+
+    def _read_body(self, request: Request) -> Optional[bytes]:
+        # Reads at most one byte over the limit, whatever the client sent
+        body = request.stream.read(self.max_body_size + 1)
+        if len(body) > self.max_body_size:
+            return None
+        return body
+
+    def verify(self, signature: str, body: bytes) -> bool:
+        state = _hmac_state(self.secret).copy()
+        state.update(body)
+        return hmac.compare_digest(state.hexdigest(), signature.lower())
+
+    def handle(self, request: Request, handler: Callable[[dict], Any]):
+        print("🔐 Processing request...")
+        if (
+            request.content_length is not None
+            and request.content_length > self.max_body_size
+        ):
+            return self._reject(
+                f"⛔ Body is too large: {request.content_length} bytes", BODY_TOO_LARGE
+            )
+
+        signature = request.headers.get(SIGNATURE_HEADER)
+        if signature is None:
+            return self._reject("⛔ The request does not have the X-Pyrus-Sig.")
+        if not self.secret:
+            return self._reject("Secret is not set ❌")
+
+        body = self._read_body(request)
+        if body is None:
+            return self._reject("⛔ Body is too large", BODY_TOO_LARGE)
+        if not body:
+            return self._reject("Body is not set ❌")
+
+        if not self.verify(signature, body):
+            return self._reject("❌ Signature is not correct")
+        print("✅ Signature_correct")
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return self._reject("😢 Body is not valid JSON")
+
+        if not isinstance(data, dict) or not isinstance(data.get("task"), dict):
+            return self._reject("😢 Body does not contain 'task'")
+
+        return handler(data)
+
+    def route(self, handler: Callable[[dict], Any]):
+        # Flask view decorator, the view receives the parsed payload
+        @functools.wraps(handler)
+        def view():
+            return self.handle(request, handler)
+
+        return view
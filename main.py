@@ -1,8 +1,9 @@
 import os
+import time
+import atexit
 import logging
 from dotenv import load_dotenv, find_dotenv
 from flask import Flask
-from flask import request
 from flask_caching import Cache
 from flask_apscheduler import APScheduler
 import sentry_sdk
@@ -10,10 +11,22 @@ from datetime import datetime
 import pytz
 
 from pyrus_api_handler import PyrusAPI
-from bot.reminder_step import ReminderStep
+from pyrus_client import PyrusClient
+from pyrus_transport import configure_transport
+from pyrus_auth import configure_token_broker
+from pyrus_rate_limit import configure_outbound_scheduler
+from bot.reminder_step import reminder_step_view
+from bot.checklist_cache import configure_checklist_cache
+from bot.form_schema_cache import FormSchemaCache, invalidate_view
 from bot.sync_task_data import SyncTaskData
 from notify_in_pyrus_task import Notification_in_pyrus_task
 from bot.create_reminder_comment import CreateReminderComment, TrackedFieldsType
+from bot.job_queue import JobQueue, MemoryQueueBackend, SQLiteQueueBackend
+from bot.webhook_ingress import WebhookIngress
+from reminder_store import ReminderStore
+from reminder_catalog import CatalogMirror
+from scheduler_lease import SchedulerLease
+from reminder_scheduler import ReminderScheduler
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -53,6 +66,43 @@ REMINDER_SECRET_KEY = os.getenv("REMINDER_SECRET_KEY")
 SYNC_LOGIN = os.getenv("SYNC_LOGIN")
 SYNC_SECRET_KEY = os.getenv("SYNC_SECRET_KEY")
 DEFAULT_PORT = os.getenv("DEFAULT_PORT")
+PYRUS_POOL_SIZE = int(os.getenv("PYRUS_POOL_SIZE", "10"))
+PYRUS_CONNECT_TIMEOUT = float(os.getenv("PYRUS_CONNECT_TIMEOUT", "5"))
+PYRUS_READ_TIMEOUT = float(os.getenv("PYRUS_READ_TIMEOUT", "30"))
+PYRUS_TOKEN_LIFETIME = int(os.getenv("PYRUS_TOKEN_LIFETIME", "43200"))
+PYRUS_TOKEN_REFRESH_MARGIN = int(os.getenv("PYRUS_TOKEN_REFRESH_MARGIN", "600"))
+PYRUS_RATE_LIMIT = float(os.getenv("PYRUS_RATE_LIMIT", "5"))
+PYRUS_RATE_BURST = int(os.getenv("PYRUS_RATE_BURST", "10"))
+PYRUS_MAX_ATTEMPTS = int(os.getenv("PYRUS_MAX_ATTEMPTS", "4"))
+FORM_SCHEMA_TTL = int(os.getenv("FORM_SCHEMA_TTL", "900"))
+FORM_SCHEMA_ADMIN_TOKEN = os.getenv("FORM_SCHEMA_ADMIN_TOKEN")
+CHECKLIST_CACHE_SIZE = int(os.getenv("CHECKLIST_CACHE_SIZE", "512"))
+CHECKLIST_CACHE_TTL = int(os.getenv("CHECKLIST_CACHE_TTL", "3600"))
+WEBHOOK_FAST_ACK = os.getenv("WEBHOOK_FAST_ACK", "false").lower() in ("1", "true", "yes")
+WEBHOOK_QUEUE_BACKEND = os.getenv("WEBHOOK_QUEUE_BACKEND", "memory")
+WEBHOOK_QUEUE_PATH = os.getenv("WEBHOOK_QUEUE_PATH", "webhook_jobs.sqlite3")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "2"))
+WEBHOOK_JOB_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_JOB_MAX_ATTEMPTS", "3"))
+WEBHOOK_DEDUP_TTL = int(os.getenv("WEBHOOK_DEDUP_TTL", "3600"))
+SYNC_VALUE_CACHE_TTL = int(os.getenv("SYNC_VALUE_CACHE_TTL", "300"))
+SYNC_ECHO_TTL = int(os.getenv("SYNC_ECHO_TTL", "300"))
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", "4"))
+WEBHOOK_MAX_BODY_SIZE = int(os.getenv("WEBHOOK_MAX_BODY_SIZE", "33554432"))
+REMINDER_STORE_PATH = os.getenv("REMINDER_STORE_PATH", "reminders.sqlite3")
+REMINDER_CATALOG_ID = "211552"
+REMINDER_SNAPSHOT_TTL = int(os.getenv("REMINDER_SNAPSHOT_TTL", "86400"))
+REMINDER_FLUSH_WINDOW = float(os.getenv("REMINDER_FLUSH_WINDOW", "2"))
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "8"))
+NOTIFY_REGISTER_BATCH_SIZE = int(os.getenv("NOTIFY_REGISTER_BATCH_SIZE", "100"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "3"))
+NOTIFY_RETRY_DELAY = float(os.getenv("NOTIFY_RETRY_DELAY", "60"))
+SCHEDULER_LEASE_PATH = os.getenv("SCHEDULER_LEASE_PATH", "scheduler.sqlite3")
+SCHEDULER_LEASE_TTL = float(os.getenv("SCHEDULER_LEASE_TTL", "60"))
+REMINDER_SWEEP_INTERVAL = float(os.getenv("REMINDER_SWEEP_INTERVAL", "300"))
+REMINDER_TIMERS = os.getenv("REMINDER_TIMERS", "false").lower() in ("1", "true", "yes")
+REMINDER_DELIVERY_TIME = datetime.strptime(
+    os.getenv("REMINDER_DELIVERY_TIME", "08:05"), "%H:%M"
+).time()
 
 required_env_vars = {
     "RS_LOGIN": RS_LOGIN,
@@ -80,22 +130,67 @@ app = Flask(__name__)
 # - Set debug mode based on FLASK_ENV
 app.config["DEBUG"] = os.getenv("FLASK_ENV") or "development"
 # - Set up configuration for the cache and scheduler
+# - CACHE_TYPE=FileSystemCache (with CACHE_DIR) or RedisCache (with CACHE_REDIS_URL)
+#   shares the cache between gunicorn workers
 config = {
-    "CACHE_TYPE": "SimpleCache",
+    "CACHE_TYPE": os.getenv("CACHE_TYPE", "SimpleCache"),
     "CACHE_DEFAULT_TIMEOUT": 300,
     "SCHEDULER_TIMEZONE": "Europe/Moscow",
 }
+for cache_option in ("CACHE_DIR", "CACHE_REDIS_URL"):
+    if os.getenv(cache_option):
+        config[cache_option] = os.getenv(cache_option)
 app.config.from_mapping(config)
 
 # Initialize the cache
 CACHE = Cache(app)
 
 # initialize scheduler
+# - every worker process runs the scheduler, the lease picks the one that
+#   runs the jobs
+scheduler_lease = SchedulerLease(SCHEDULER_LEASE_PATH, ttl=SCHEDULER_LEASE_TTL)
+scheduler_lease.start()
+atexit.register(scheduler_lease.stop)
 scheduler = APScheduler()
 scheduler.api_enabled = True
 scheduler.init_app(app)
 scheduler.start()
 
+# Initialize the shared HTTP transport for all Pyrus clients
+configure_outbound_scheduler(
+    rate=PYRUS_RATE_LIMIT,
+    burst=PYRUS_RATE_BURST,
+    max_attempts=PYRUS_MAX_ATTEMPTS,
+)
+configure_transport(
+    pool_size=PYRUS_POOL_SIZE,
+    connect_timeout=PYRUS_CONNECT_TIMEOUT,
+    read_timeout=PYRUS_READ_TIMEOUT,
+)
+configure_token_broker(
+    token_lifetime=PYRUS_TOKEN_LIFETIME,
+    refresh_margin=PYRUS_TOKEN_REFRESH_MARGIN,
+)
+
+# Initialize the rendered step checklist cache
+configure_checklist_cache(max_size=CHECKLIST_CACHE_SIZE, ttl=CHECKLIST_CACHE_TTL)
+
+# Initialize the reminder store, the Pyrus catalog mirrors it in the background
+reminder_store = ReminderStore(REMINDER_STORE_PATH)
+catalog_mirror = CatalogMirror(
+    reminder_store,
+    PyrusClient(
+        REMINDER_LOGIN if REMINDER_LOGIN is not None else "",
+        REMINDER_SECRET_KEY if REMINDER_SECRET_KEY is not None else "",
+        cache=CACHE,
+    ),
+    REMINDER_CATALOG_ID,
+    snapshot_ttl=REMINDER_SNAPSHOT_TTL,
+    flush_window=REMINDER_FLUSH_WINDOW,
+)
+catalog_mirror.start()
+atexit.register(catalog_mirror.stop)
+
 # Initialize the Pyrus API
 pyrus_api = PyrusAPI(
     CACHE,
@@ -109,50 +204,117 @@ def index_page():
     return "✅ Server is ready"
 
 
-@app.route("/step-reminder", methods=["GET", "POST"])
-def reminder_step_page():
-    reminder_step_page = ReminderStep(
-        cache=CACHE,
-        request=request,
-        pyrus_secret_key=RS_SECRET_KEY if RS_SECRET_KEY is not None else "",
-        pyrus_login=RS_LOGIN if RS_LOGIN is not None else "",
-    )
-    return reminder_step_page.process_request()
+# Every webhook goes through its ingress: size limit, signature, JSON payload
+reminder_step_ingress = WebhookIngress(
+    RS_SECRET_KEY, sentry_sdk=sentry_sdk, max_body_size=WEBHOOK_MAX_BODY_SIZE
+)
+sync_task_data_ingress = WebhookIngress(
+    SYNC_SECRET_KEY, sentry_sdk=sentry_sdk, max_body_size=WEBHOOK_MAX_BODY_SIZE
+)
+reminder_ingress = WebhookIngress(
+    REMINDER_SECRET_KEY, sentry_sdk=sentry_sdk, max_body_size=WEBHOOK_MAX_BODY_SIZE
+)
 
 
-@app.route("/webhook-sync-task-data", methods=["GET", "POST"])
-def webhook_sync_task_data():
+app.add_url_rule(
+    "/step-reminder",
+    view_func=reminder_step_ingress.route(
+        reminder_step_view(
+            CACHE,
+            RS_SECRET_KEY if RS_SECRET_KEY is not None else "",
+            RS_LOGIN if RS_LOGIN is not None else "",
+            form_schema_ttl=FORM_SCHEMA_TTL,
+        )
+    ),
+    methods=["GET", "POST"],
+)
+
+
+def create_sync_task_data(job_queue=None) -> SyncTaskData:
+    # Link field -> [source, target] or a list of [source, target] pairs
     TRACKED_FIELD = {
         "Заказ в Pyrus": ["№ ордеров из 1С", "№ ордера"],
     }
-    sync_task_data = SyncTaskData(
+    return SyncTaskData(
         cache=CACHE,
         pyrus_secret_key=SYNC_SECRET_KEY if SYNC_SECRET_KEY is not None else "",
         pyrus_login=SYNC_LOGIN if SYNC_LOGIN is not None else "",
         sentry_sdk=sentry_sdk,
         traked_fields=TRACKED_FIELD,
+        job_queue=job_queue,
+        dedup_ttl=WEBHOOK_DEDUP_TTL,
+        form_schema_ttl=FORM_SCHEMA_TTL,
+        value_cache_ttl=SYNC_VALUE_CACHE_TTL,
+        echo_ttl=SYNC_ECHO_TTL,
+        max_concurrency=SYNC_CONCURRENCY,
     )
-    return sync_task_data.process_request(request=request)
 
 
-@app.route(rule="/webhook-reminder", methods=["GET", "POST"])
-def webhook_reminder():
-    CATALOG_ID = "211552"
+def create_reminder_comment(job_queue=None) -> CreateReminderComment:
     TRACKED_FIELDS: TrackedFieldsType = {
         "text": {
             "Тип оплаты / Статус": "✅Нал (чек)",
         },
         "date": ["Дата отгрузки", "Дата планируемой оплаты"],
     }
-    create_reminder_comment = CreateReminderComment(
-        CATALOG_ID,
+    return CreateReminderComment(
+        reminder_store,
+        catalog_mirror,
         CACHE,
         REMINDER_SECRET_KEY if REMINDER_SECRET_KEY is not None else "",
         REMINDER_LOGIN if REMINDER_LOGIN is not None else "",
         sentry_sdk,
         TRACKED_FIELDS,
+        job_queue=job_queue,
+        dedup_ttl=WEBHOOK_DEDUP_TTL,
     )
-    return create_reminder_comment.process_request(request)
+
+
+def run_webhook_job(create_handler):
+    def run(task):
+        with app.app_context():
+            create_handler().handle_task(task)
+
+    return run
+
+
+# Initialize the webhook job queue (fast-ack mode)
+webhook_job_queue = None
+if WEBHOOK_FAST_ACK:
+    webhook_job_queue = JobQueue(
+        (
+            SQLiteQueueBackend(WEBHOOK_QUEUE_PATH, max_attempts=WEBHOOK_JOB_MAX_ATTEMPTS)
+            if WEBHOOK_QUEUE_BACKEND == "sqlite"
+            else MemoryQueueBackend(max_attempts=WEBHOOK_JOB_MAX_ATTEMPTS)
+        ),
+        workers=WEBHOOK_WORKERS,
+        sentry_sdk=sentry_sdk,
+    )
+    webhook_job_queue.register(
+        SyncTaskData.JOB_NAME, run_webhook_job(create_sync_task_data)
+    )
+    webhook_job_queue.register(
+        CreateReminderComment.JOB_NAME, run_webhook_job(create_reminder_comment)
+    )
+    webhook_job_queue.start()
+    atexit.register(webhook_job_queue.stop)
+    logger.info(f"✅ Fast-ack mode: webhooks are queued ({WEBHOOK_QUEUE_BACKEND})")
+
+
+@app.route("/webhook-sync-task-data", methods=["GET", "POST"])
+@sync_task_data_ingress.route
+def webhook_sync_task_data(data):
+    sync_task_data = create_sync_task_data(job_queue=webhook_job_queue)
+    return sync_task_data.process_request(data)
+
+
+@app.route(rule="/webhook-reminder", methods=["GET", "POST"])
+@reminder_ingress.route
+def webhook_reminder(data):
+    create_reminder_comment_handler = create_reminder_comment(
+        job_queue=webhook_job_queue
+    )
+    return create_reminder_comment_handler.process_request(data)
 
 
 @app.route("/current-time", methods=["GET"])
@@ -162,18 +324,69 @@ def current_time():
     return f"Current time in {app.config['SCHEDULER_TIMEZONE']}: {current_time}"
 
 
-@scheduler.task("cron", id="notify_job", hour=8, minute=5)
+app.add_url_rule(
+    "/form-schema/<int:form_id>/invalidate",
+    view_func=invalidate_view(
+        FormSchemaCache(CACHE, pyrus_api, ttl=FORM_SCHEMA_TTL),
+        FORM_SCHEMA_ADMIN_TOKEN,
+    ),
+    methods=["POST"],
+)
+
+
+def create_notification() -> Notification_in_pyrus_task:
+    return Notification_in_pyrus_task(
+        reminder_store,
+        catalog_mirror,
+        REMINDER_LOGIN,
+        REMINDER_SECRET_KEY,
+        sentry_sdk,
+        CACHE,
+        max_concurrency=NOTIFY_CONCURRENCY,
+        register_batch_size=NOTIFY_REGISTER_BATCH_SIZE,
+    )
+
+
+@scheduler_lease.guard
 def notify_job():
-    try:
-        logger.info("Starting notify_job")
-        catalog_id = "211552"
-        notification = Notification_in_pyrus_task(
-            catalog_id, REMINDER_LOGIN, REMINDER_SECRET_KEY, sentry_sdk, CACHE
-        )
-        notification.send()
-        logger.info("notify_job completed successfully")
-    except Exception as e:
-        logger.error(f"Error in notify_job: {e}")
+    # Every attempt resumes from the notify journal, so retrying does not
+    # send a reminder twice
+    for attempt in range(1, NOTIFY_MAX_ATTEMPTS + 1):
+        try:
+            logger.info(f"Starting notify_job, attempt {attempt}")
+            notification = create_notification()
+            notification.send()
+            logger.info("notify_job completed successfully")
+            return
+        except Exception as e:
+            logger.error(f"Error in notify_job: {e}")
+            if attempt < NOTIFY_MAX_ATTEMPTS:
+                time.sleep(NOTIFY_RETRY_DELAY)
+
+
+def deliver_reminders(reminders, expired_reminders):
+    create_notification().deliver(reminders, expired_reminders)
+
+
+# Reminders are delivered either by per-reminder timers or by the daily job
+if REMINDER_TIMERS:
+    reminder_scheduler = ReminderScheduler(
+        reminder_store,
+        deliver_reminders,
+        delivery_time=REMINDER_DELIVERY_TIME,
+        lease=scheduler_lease,
+        sweep_interval=REMINDER_SWEEP_INTERVAL,
+    )
+    reminder_scheduler.start()
+    atexit.register(reminder_scheduler.stop)
+else:
+    scheduler.add_job(
+        id="notify_job",
+        func=notify_job,
+        trigger="cron",
+        hour=REMINDER_DELIVERY_TIME.hour,
+        minute=REMINDER_DELIVERY_TIME.minute,
+    )
 
 
 if __name__ == "__main__":
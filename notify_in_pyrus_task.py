@@ -1,21 +1,37 @@
-from pyrus import client
-import pyrus.models.requests
-from pyrus.models.entities import CatalogItem
-from pyrus_api_handler import PyrusAPI
+import asyncio
+from pyrus.models.entities import Task
+from pyrus.models.requests import FormRegisterRequest
+from pyrus_api_handler import AsyncPyrusAPI, DEFAULT_MAX_CONCURRENCY
+from pyrus_client import PyrusClient
+from reminder_store import ReminderStore
+from reminder_catalog import CatalogMirror
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List
+
+
+DEFAULT_REGISTER_BATCH_SIZE = 100
 
 
 class Notification_in_pyrus_task:
     def __init__(
-        self, catalog_id, pyrus_login, pyrus_security_key, sentry_sdk, cache=None
+        self,
+        reminder_store: ReminderStore,
+        catalog_mirror: CatalogMirror,
+        pyrus_login,
+        pyrus_security_key,
+        sentry_sdk,
+        cache=None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        register_batch_size: int = DEFAULT_REGISTER_BATCH_SIZE,
     ):
-        self.catalog_id = int(catalog_id)
-        self.pyrus_client = client.PyrusAPI(pyrus_login, pyrus_security_key)
-        self.pyrus_api = PyrusAPI(
-            cache, pyrus_login, pyrus_security_key, self.pyrus_client.access_token
+        self.reminder_store = reminder_store
+        self.catalog_mirror = catalog_mirror
+        self.pyrus_client = PyrusClient(pyrus_login, pyrus_security_key, cache=cache)
+        self.async_pyrus_api = AsyncPyrusAPI(
+            cache, pyrus_login, pyrus_security_key, max_concurrency=max_concurrency
         )
         self.sentry_sdk = sentry_sdk
+        self.register_batch_size = register_batch_size
 
     def _create_shipment_date_formatted_text(self, author, date: str, time: str = ""):
         author_link_name = f"<a href='https://pyrus.com/t#{author.id}'>{author.first_name} {author.last_name}</a>"
@@ -43,92 +59,171 @@ class Notification_in_pyrus_task:
             )
             raise Exception(auth_response.original_response)
 
-    def _get_catalog(self):
-        catalog_response = self.pyrus_client.get_catalog(self.catalog_id)
-        items = catalog_response.items
-        return items
-
     def _get_task(self, task_id):
-        task = self.pyrus_client.get_task(int(task_id)).task
-        return task
+        response = self.pyrus_client.get_task(int(task_id))
+        if response.task is not None:
+            return response.task
+        if (response.original_response or {}).get("status_code") == 404:
+            # The task is gone, its reminder is dropped
+            print(f"⚠️ Notify: Task {task_id} is not found")
+            return None
+        # Anything else fails the reminder, it stays in the store for a retry
+        raise Exception(
+            f"Task {task_id} is not available: {response.error} ({response.error_code})"
+        )
 
-    def send(self):
-        self._auth()
-        catalog: Optional[List[CatalogItem]] = self._get_catalog()
-        if catalog is not None:
-            date_now = datetime.now().date()
-            catalog_headers = ["id", "task_id", "timestamp", "message_type"]
-            catalog_items_new = []
-            for item in catalog:
-                if item.values is not None:
-                    id, item_id, item_timestamp, item_type_message = item.values
-                    timestamp = datetime.strptime(str(item_timestamp), "%Y-%m-%d")
-                    if timestamp.date() == date_now:
-                        task = self._get_task(item_id)
-                        if (
-                            item_type_message == "shipment_date"
-                            and task is not None
-                            and task.author is not None
-                        ):
-                            formatted_text = self._create_shipment_date_formatted_text(
-                                author=task.author, date=item_timestamp
-                            )
-                            """ Pyrus lib doesn't support formatting text
-
-                                # request = pyrus.models.requests.TaskCommentRequest(
-                                #     text=formatted_text
-                                # )
-                                # task = self.pyrus_client.comment_task(
-                                #     int(item_id), request
-                                # ).task
-                            """
-                            self.pyrus_api.post_request(
-                                url=f"https://api.pyrus.com/v4/tasks/{int(item_id)}/comments",
-                                data={"formatted_text": formatted_text},
-                            )
-                            print(
-                                "✅ Notify: Notification is sent. This item will be deleted"
-                            )
-                        if (
-                            item_type_message == "payment_date"
-                            and task is not None
-                            and task.author is not None
-                        ):
-                            formatted_text = self._create_payment_date_formatted_text(
-                                author=task.author
-                            )
-                            self.pyrus_api.post_request(
-                                url=f"https://api.pyrus.com/v4/tasks/{int(item_id)}/comments",
-                                data={"formatted_text": formatted_text},
-                            )
-                            print(
-                                "✅ Notify: Notification is sent. This item will be deleted"
-                            )
-                    if timestamp.date() > date_now:
-                        print("✅ Notify: This item will be added to new catalog")
-                        catalog_items_new.append(
-                            [id, item_id, item_timestamp, item_type_message]
-                        )
-                    if timestamp.date() < date_now:
-                        print("⚒️ Notify: This item will be deleted")
-                        pass
-            request = pyrus.models.requests.SyncCatalogRequest(
-                apply=True, catalog_headers=catalog_headers, items=catalog_items_new
+    def _get_register_tasks(self, form_id: int, task_ids: List[int]) -> Dict[int, Task]:
+        request = FormRegisterRequest(
+            task_ids=task_ids, include_archived=True, item_count=len(task_ids)
+        )
+        response = self.pyrus_client.get_registry(form_id, request)
+        if response.tasks is None:
+            print(f"⚠️ Notify: Form {form_id} register failed: {response.error}")
+            return {}
+        return {task.id: task for task in response.tasks}
+
+    async def _prefetch_tasks(self, task_ids) -> Dict[int, Task]:
+        # Tasks with a known form come from the form register, a batch of
+        # them per request. The rest is fetched one by one in _notify_item.
+        tasks_by_form: Dict[int, List[int]] = {}
+        for task_id, form_id in self.reminder_store.form_ids(task_ids).items():
+            tasks_by_form.setdefault(form_id, []).append(int(task_id))
+
+        batches = [
+            (form_id, form_task_ids[i : i + self.register_batch_size])
+            for form_id, form_task_ids in tasks_by_form.items()
+            for i in range(0, len(form_task_ids), self.register_batch_size)
+        ]
+        results = await self.async_pyrus_api.gather(
+            *(
+                self.async_pyrus_api.call(self._get_register_tasks, *batch)
+                for batch in batches
+            ),
+            return_exceptions=True,
+        )
+
+        tasks: Dict[int, Task] = {}
+        for batch, result in zip(batches, results):
+            if isinstance(result, BaseException):
+                print(f"⚠️ Notify: Form {batch[0]} register failed: {result}")
+            else:
+                tasks.update(result)
+        print(f"🔎 Notify: {len(tasks)} tasks fetched from {len(batches)} registers")
+        return tasks
+
+    async def _notify_item(self, reminder, run_date, tasks):
+        reminder_id, item_id, item_timestamp, item_type_message = reminder
+        task = tasks.get(int(item_id))
+        if task is None or task.author is None:
+            task = await self.async_pyrus_api.call(self._get_task, item_id)
+        if task is None or task.author is None:
+            return
+
+        if item_type_message == "shipment_date":
+            item_date, _, item_time = item_timestamp.partition(" ")
+            formatted_text = self._create_shipment_date_formatted_text(
+                author=task.author, date=item_date, time=item_time
+            )
+        elif item_type_message == "payment_date":
+            formatted_text = self._create_payment_date_formatted_text(
+                author=task.author
             )
-            response = self.pyrus_client.sync_catalog(self.catalog_id, request)
+        else:
+            return
+
+        """ Pyrus lib doesn't support formatting text
 
-            deleted = response.deleted
-            if deleted:
-                print("🔎 Notify: deleted: ", deleted)
+            # request = pyrus.models.requests.TaskCommentRequest(
+            #     text=formatted_text
+            # )
+            # task = self.pyrus_client.comment_task(
+            #     int(item_id), request
+            # ).task
+        """
+        await self.async_pyrus_api.comment_task(
+            item_id, {"formatted_text": formatted_text}
+        )
+        # Journal the comment right away, a rerun after a crash skips it
+        self.reminder_store.mark_sent(run_date, reminder_id)
+        print("✅ Notify: Notification is sent. This item will be deleted")
+
+    async def _notify_due_items(self, due_items, run_date):
+        tasks = await self._prefetch_tasks(due_item[1] for due_item in due_items)
+        # One failed reminder must not cancel the others, failures come back
+        # as exceptions in the results
+        return await self.async_pyrus_api.gather(
+            *(self._notify_item(due_item, run_date, tasks) for due_item in due_items),
+            return_exceptions=True,
+        )
+
+    def _deliver(self, reminders, expired_items, run_date, flush: bool):
+        for _ in expired_items:
+            print("⚒️ Notify: This item will be deleted")
+
+        self.reminder_store.prune_journal(run_date)
+        already_sent = self.reminder_store.sent_on(run_date)
+        sent_items = []
+        due_items = []
+        for reminder in reminders:
+            if reminder[0] in already_sent:
+                sent_items.append(reminder)
+            else:
+                due_items.append(reminder)
+        if sent_items:
+            print(f"⏩ Notify: {len(sent_items)} reminders were sent by an earlier run")
+
+        print(f"🔔 Notify: Sending {len(due_items)} notifications...")
+        try:
+            results = asyncio.run(self._notify_due_items(due_items, run_date))
+        finally:
+            self.async_pyrus_api.close()
+
+        # Reminders that failed stay in the store so a rerun can send them
+        failed_items = []
+        for reminder, result in zip(due_items, results):
+            if isinstance(result, BaseException):
+                failed_items.append(reminder)
+                print(f"❌ Notify: Reminder {reminder} failed: {result}")
+                self.sentry_sdk.capture_exception(result)
+            else:
+                sent_items.append(reminder)
+        print(f"🔔 Notify: {len(sent_items)} reminders processed")
+
+        deleted = self.reminder_store.delete_ids(
+            reminder[0] for reminder in expired_items + sent_items
+        )
+        print(f"🔎 Notify: deleted: {deleted}")
+        if flush:
+            self.catalog_mirror.flush()
+        else:
+            self.catalog_mirror.schedule()
 
-            updated = response.updated
-            if updated:
-                print("🔎 Notify: updated: ", updated)
+        if failed_items:
+            # Let the caller retry, the journal keeps the sent ones from
+            # being sent twice
+            raise Exception(f"{len(failed_items)} reminders were not sent")
+
+    def send(self):
+        self._auth()
+        # The local store is the source of truth, make sure it holds the
+        # catalog before reading due reminders from it
+        self.catalog_mirror.seed()
 
-            added = response.added
-            if added:
-                print("🔎 Notify: added: ", added)
+        date_now = datetime.now().date()
+        self._deliver(
+            self.reminder_store.due_on(date_now),
+            self.reminder_store.due_before(date_now),
+            date_now,
+            flush=True,
+        )
 
-            new_headers = response.catalog_headers
-            if new_headers:
-                print("🔎 Notify: new_headers: ", new_headers)
+    def deliver(self, reminders, expired_items=()):
+        # Entry point for the reminder timers: sends the given reminders
+        # only, the catalog is written behind
+        self._auth()
+        # Deletes must not come before the catalog import, it would bring
+        # the sent reminders back
+        self.catalog_mirror.seed()
+        self._deliver(
+            list(reminders), list(expired_items), datetime.now().date(), flush=False
+        )
@@ -1,114 +1,137 @@
-import json
+import asyncio
+import functools
 import requests
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Callable, Awaitable, List
+from pyrus_auth import token_broker
+from pyrus_transport import get_transport
+
+
+PYRUS_API_URL = "https://api.pyrus.com/v4"
+DEFAULT_MAX_CONCURRENCY = 8
 
 
 class PyrusAPI:
     print("✅ All required environment variables are set")
 
-    def __init__(self, cache, pyrus_login: str, pyrus_secret_key: str, token=None):
+    def __init__(self, cache, pyrus_login: str, pyrus_secret_key: str):
         self.cache = cache
-        self.token = token
+        self.token: Optional[str] = None
         self.pyrus_login = pyrus_login
         self.pyrus_secret_key = pyrus_secret_key
 
-    def _auth(self) -> str:
-        print("⌛ Starting API authentication request to Pyrus")
-
-        try:
-            r = requests.get(
-                "https://api.pyrus.com/v4/auth",
-                params={
-                    "login": self.pyrus_login,
-                    "security_key": self.pyrus_secret_key,
-                },
-            )
-            r.raise_for_status()  # This line raises an HTTPError if the HTTP request returned an unsuccessful status code
-            auth_data: dict = json.loads(r.text)
-        except requests.exceptions.RequestException as e:
-            # Handle any request exceptions
-            print(f"❌ API AUTH: Failed to get authentication token from Pyrus: {e}")
-            raise Exception(e)
-
-        token: str = auth_data["access_token"]
-        print(f"✅ API AUTH: Success to get authentication token from Pyrus")
+    def _auth(self, stale_token: Optional[str] = None) -> str:
+        # Tokens are shared per login through the broker and the cache,
+        # /auth is only called when there is no fresh token anywhere
+        self.token = token_broker.get_token(
+            self.pyrus_login, self.pyrus_secret_key, self.cache, stale_token
+        )
+        return self.token
 
-        return token
+    def _send(self, method: str, url: str, token: str, **kwargs) -> requests.Response:
+        return get_transport().request(
+            method,
+            url,
+            login=self.pyrus_login,
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+            },
+            **kwargs,
+        )
 
-    def get_request(self, url: str) -> dict:
-        print("⌛ API GET: Making a  request...")
-
-        if self.token is None:
-            print(
-                "⚠️ API GET: Authentication token is not in cache, creating a new one..."
-            )
-            self.token = self._auth()
-            print("🫙 API GET: Saving authentication token in cache...")
-            self.cache.set("pyrus_auth_token", self.token)
-        else:
-            print("🫙 API GET: Authentication token in cache")
-
-        headers = {
-            "Authorization": f"Bearer {self.token}",
-            "Content-Type": "application/json",
-        }
+    def _request(self, method: str, url: str, log_name: str, **kwargs) -> dict:
+        token = self._auth()
 
         try:
-            r = requests.get(url, headers=headers)
+            r = self._send(method, url, token, **kwargs)
+            # Handle 401 Unauthorized error: the token was revoked before it
+            # expired, get a new one and try once more
+            if r.status_code == 401:
+                print(f"⚠️ {log_name}: Authentication token is rejected, renewing...")
+                token = self._auth(stale_token=token)
+                r = self._send(method, url, token, **kwargs)
             r.raise_for_status()  # This line raises an HTTPError if the HTTP request returned an unsuccessful status code
-            r_data: dict = json.loads(r.text)
+            r_data: dict = r.json()
             # Process the response data
             return r_data
         except requests.exceptions.HTTPError as err:
-            # Handle 401 Unauthorized error
-            if r.status_code == 401:
-                self.token = self._auth()
-                self.cache.set("pyrus_auth_token", self.token)
-                return self.get_request(url)
-            else:
-                # Handle other HTTP errors
-                print(f"⚠️ API GET: HTTP error occurred: {err}")
-                raise Exception(err)
+            # Handle other HTTP errors
+            print(f"⚠️ {log_name}: HTTP error occurred: {err}")
+            raise Exception(err)
         except requests.exceptions.RequestException as e:
             # Handle any request exceptions
-            print(f"⚠️ API GET: An error occurred: {e}")
+            print(f"⚠️ {log_name}: An error occurred: {e}")
             raise Exception(e)
 
+    def get_request(self, url: str) -> dict:
+        print("⌛ API GET: Making a  request...")
+        return self._request("GET", url, "API GET")
+
     def post_request(self, url, data: Dict[str, Any]) -> dict:
         print("⌛ API POST: Making request...")
+        return self._request("POST", url, "API POST", json=data)
 
-        if self.token is None:
-            print(
-                "⚠️ API POST: Authentication token is not in cache, creating a new one..."
+    def comment_task(self, task_id, data: Dict[str, Any]) -> dict:
+        return self.post_request(f"{PYRUS_API_URL}/tasks/{int(task_id)}/comments", data)
+
+    def get_catalog(self, catalog_id) -> dict:
+        return self.get_request(f"{PYRUS_API_URL}/catalogs/{int(catalog_id)}")
+
+    def sync_catalog(self, catalog_id, data: Dict[str, Any]) -> dict:
+        return self.post_request(f"{PYRUS_API_URL}/catalogs/{int(catalog_id)}", data)
+
+
+class AsyncPyrusAPI:
+    # asyncio front for PyrusAPI. Calls run in worker threads on the shared
+    # pooled session, at most max_concurrency of them at the same time, so
+    # keep it below the transport pool size.
+    def __init__(
+        self,
+        cache,
+        pyrus_login: str,
+        pyrus_secret_key: str,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ):
+        self.pyrus_api = PyrusAPI(cache, pyrus_login, pyrus_secret_key)
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="pyrus-async"
+        )
+        self._semaphores: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # asyncio.Semaphore is bound to the loop it is first used in, and
+        # every asyncio.run() starts a new loop
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores = {loop: asyncio.Semaphore(self.max_concurrency)}
+        return self._semaphores[loop]
+
+    async def call(self, func: Callable, *args, **kwargs):
+        async with self._semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(func, *args, **kwargs)
             )
-            self.token = self._auth()
-            print("🫙 API POST: Saving authentication token in cache...")
-            self.cache.set("pyrus_auth_token", self.token)
-        else:
-            print("🫙 API GET: Authentication token in cache")
 
-        headers = {
-            "Authorization": f"Bearer {self.token}",
-            "Content-Type": "application/json",
-        }
+    def close(self):
+        self._executor.shutdown(wait=False)
 
-        try:
-            r = requests.post(url=url, json=data, headers=headers)
-            r.raise_for_status()  # This line raises an HTTPError if the HTTP request returned an unsuccessful status code
-            r_data = r.json()
-            # Process the response data
-            return r_data
-        except requests.exceptions.HTTPError as err:
-            # Handle 401 Unauthorized error
-            if r.status_code == 401:
-                self.token = self._auth()
-                self.cache.set("pyrus_auth_token", self.token)
-                return self.post_request(url, data)
-            else:
-                # Handle other HTTP errors
-                print(f"⚠️ API POST: HTTP error occurred: {err}")
-                raise Exception(err)
-        except requests.exceptions.RequestException as e:
-            # Handle any request exceptions
-            print(f"⚠️ API POST: An error occurred: {e}")
-            raise Exception(e)
+    async def gather(self, *calls: Awaitable, return_exceptions: bool = False) -> List:
+        return await asyncio.gather(*calls, return_exceptions=return_exceptions)
+
+    async def get_request(self, url: str) -> dict:
+        return await self.call(self.pyrus_api.get_request, url)
+
+    async def post_request(self, url, data: Dict[str, Any]) -> dict:
+        return await self.call(self.pyrus_api.post_request, url, data)
+
+    async def comment_task(self, task_id, data: Dict[str, Any]) -> dict:
+        return await self.call(self.pyrus_api.comment_task, task_id, data)
+
+    async def get_catalog(self, catalog_id) -> dict:
+        return await self.call(self.pyrus_api.get_catalog, catalog_id)
+
+    async def sync_catalog(self, catalog_id, data: Dict[str, Any]) -> dict:
+        return await self.call(self.pyrus_api.sync_catalog, catalog_id, data)
@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+import requests
+from typing import Dict, Optional
+from pyrus_transport import get_transport
+
+
+PYRUS_AUTH_URL = "https://api.pyrus.com/v4/auth"
+DEFAULT_TOKEN_LIFETIME = 12 * 60 * 60
+DEFAULT_REFRESH_MARGIN = 10 * 60
+
+
+class TokenBroker:
+    def __init__(
+        self,
+        token_lifetime: int = DEFAULT_TOKEN_LIFETIME,
+        refresh_margin: int = DEFAULT_REFRESH_MARGIN,
+    ):
+        self.token_lifetime = token_lifetime
+        self.refresh_margin = refresh_margin
+        self._tokens: Dict[str, dict] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def _cache_key(self, login: str) -> str:
+        return f"pyrus_auth_token:{login}"
+
+    def _lock_for(self, login: str) -> threading.Lock:
+        with self._locks_lock:
+            if login not in self._locks:
+                self._locks[login] = threading.Lock()
+            return self._locks[login]
+
+    def _is_fresh(self, entry: Optional[dict], stale_token: Optional[str]) -> bool:
+        if not entry or "token" not in entry or "expires_at" not in entry:
+            return False
+        if stale_token is not None and entry["token"] == stale_token:
+            return False
+        return time.time() < entry["expires_at"] - self.refresh_margin
+
+    def _lookup(self, login: str, cache, stale_token: Optional[str]) -> Optional[dict]:
+        entry = self._tokens.get(login)
+        if self._is_fresh(entry, stale_token):
+            return entry
+
+        if cache is not None:
+            entry = cache.get(self._cache_key(login))
+            if self._is_fresh(entry, stale_token):
+                self._tokens[login] = entry  # type: ignore
+                return entry
+
+        return None
+
+    def _request_token(self, login: str, secret_key: str) -> dict:
+        print("⌛ Starting API authentication request to Pyrus")
+
+        try:
+            r = get_transport().request(
+                "GET",
+                PYRUS_AUTH_URL,
+                login=login,
+                params={
+                    "login": login,
+                    "security_key": secret_key,
+                },
+            )
+            r.raise_for_status()  # This line raises an HTTPError if the HTTP request returned an unsuccessful status code
+            auth_data: dict = json.loads(r.text)
+        except requests.exceptions.RequestException as e:
+            # Handle any request exceptions
+            print(f"❌ API AUTH: Failed to get authentication token from Pyrus: {e}")
+            raise Exception(e)
+
+        print(f"✅ API AUTH: Success to get authentication token from Pyrus")
+
+        return auth_data
+
+    def get_auth(
+        self,
+        login: str,
+        secret_key: str,
+        cache=None,
+        stale_token: Optional[str] = None,
+    ) -> dict:
+        # {"token", "api_url", "files_url", "expires_at"}, the origins are the
+        # hosts /auth assigned to the account (None when it did not say).
+        # stale_token is the token the caller just got a 401 with, it is
+        # never handed out again even if it has not expired yet
+        entry = self._lookup(login, cache, stale_token)
+        if entry is not None:
+            return entry
+
+        # Only one thread per login goes to /auth, the others wait here and
+        # pick up the fresh token on the second lookup
+        with self._lock_for(login):
+            entry = self._lookup(login, cache, stale_token)
+            if entry is not None:
+                return entry
+
+            print("⚠️ API AUTH: Authentication token is missing or expiring")
+            auth_data = self._request_token(login, secret_key)
+            entry = {
+                "token": auth_data["access_token"],
+                "api_url": auth_data.get("api_url"),
+                "files_url": auth_data.get("files_url"),
+                "expires_at": time.time() + self.token_lifetime,
+            }
+            self._tokens[login] = entry
+            if cache is not None:
+                print("🫙 API AUTH: Saving authentication token in cache...")
+                cache.set(self._cache_key(login), entry, timeout=self.token_lifetime)
+
+            return entry
+
+    def get_token(
+        self,
+        login: str,
+        secret_key: str,
+        cache=None,
+        stale_token: Optional[str] = None,
+    ) -> str:
+        return self.get_auth(login, secret_key, cache, stale_token)["token"]
+
+
+token_broker = TokenBroker()
+
+
+def configure_token_broker(
+    token_lifetime: int = DEFAULT_TOKEN_LIFETIME,
+    refresh_margin: int = DEFAULT_REFRESH_MARGIN,
+) -> TokenBroker:
+    token_broker.token_lifetime = token_lifetime
+    token_broker.refresh_margin = refresh_margin
+    return token_broker
@@ -0,0 +1,92 @@
+import os
+import requests
+from pyrus import client
+from pyrus_auth import token_broker
+from pyrus_transport import get_transport
+
+
+class PyrusClient(client.PyrusAPI):
+    # pyrus-api calls the module level requests.get/post, so every call opens
+    # a new connection. Route them through the shared pooled session instead.
+    def __init__(
+        self,
+        login=None,
+        security_key=None,
+        access_token=None,
+        proxy=None,
+        person_id=None,
+        cache=None,
+    ):
+        super().__init__(login, security_key, access_token, proxy, person_id)
+        self.cache = cache
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        return get_transport().request(
+            method, url, login=self.login or "", proxies=self.proxy, **kwargs
+        )
+
+    def _auth(self):
+        # The token comes from the shared broker, so this client, PyrusAPI and
+        # every other instance with the same login reuse a single /auth call.
+        # A token that was just rejected with 401 is passed as stale.
+        try:
+            auth = token_broker.get_auth(
+                self.login, self.security_key, self.cache, self.access_token
+            )
+        except Exception as e:
+            self.access_token = None
+            return {"error": str(e), "error_code": "authentication_failed"}
+
+        # The account may live on other API and files hosts than the default
+        self._set_origins(auth.get("api_url"), auth.get("files_url"))
+        self.access_token = auth["token"]
+        return {
+            "access_token": self.access_token,
+            "api_url": auth.get("api_url"),
+            "files_url": auth.get("files_url"),
+        }
+
+    def _get_response(self, response, get_file, request):
+        result = super()._get_response(response, get_file, request)
+        # Failed calls keep their HTTP status, so a missing task (404) can be
+        # told from one that could not be fetched right now
+        if isinstance(result, dict) and response.status_code != 200:
+            result.setdefault("status_code", response.status_code)
+        return result
+
+    def _get_request(self, url):
+        headers = self._create_default_headers()
+        return self._send("GET", url, headers=headers)
+
+    def _get_file_request(self, url):
+        headers = self._create_default_headers()
+        return self._send("GET", url, headers=headers, stream=True)
+
+    def _post_file_request(self, url, file_path):
+        headers = self._create_default_headers()
+        # requests sets the multipart Content-Type with its boundary
+        del headers["Content-Type"]
+        size = os.path.getsize(file_path)
+        if size > self.MAX_FILE_SIZE_IN_BYTES:
+            raise Exception(
+                "File size should not exceed {} MB".format(
+                    self.MAX_FILE_SIZE_IN_BYTES / 1024 / 1024
+                )
+            )
+        with open(file_path, "rb") as file:
+            return self._send("POST", url, headers=headers, files={"file": file})
+
+    def _post_request(self, url, body):
+        headers = self._create_default_headers()
+        data = self.serialize_request(body) if body else None
+        return self._send("POST", url, headers=headers, data=data)
+
+    def _put_request(self, url, body):
+        headers = self._create_default_headers()
+        data = self.serialize_request(body) if body else None
+        return self._send("PUT", url, headers=headers, data=data)
+
+    def _delete_request(self, url, body):
+        headers = self._create_default_headers()
+        data = self.serialize_request(body) if body else None
+        return self._send("DELETE", url, headers=headers, data=data)
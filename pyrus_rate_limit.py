@@ -0,0 +1,187 @@
+import random
+import threading
+import time
+import requests
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional
+
+
+DEFAULT_RATE = 5.0
+DEFAULT_BURST = 10
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 30.0
+
+# 500, 502 and 504 may mean the request was applied (a gateway times out
+# while Pyrus is still handling it), so they are only retried for reads.
+# 429 is handled on its own for every method.
+RETRY_STATUSES = {503}
+RETRY_STATUSES_IDEMPOTENT = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(
+                    self.paused_until - now, (1 - self.tokens) / self.rate, 0.001
+                )
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        # After a 429 every caller of this login waits, not only the one
+        # that got it
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class OutboundScheduler:
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE,
+        burst: int = DEFAULT_BURST,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        backoff_base: float = DEFAULT_BACKOFF_BASE,
+        backoff_max: float = DEFAULT_BACKOFF_MAX,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+
+    def _bucket(self, login: str) -> TokenBucket:
+        with self._buckets_lock:
+            if login not in self._buckets:
+                self._buckets[login] = TokenBucket(self.rate, self.burst)
+            return self._buckets[login]
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: a random delay up to the exponential ceiling
+        ceiling = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+    def _should_retry_status(self, method: str, status_code: int) -> bool:
+        if method.upper() in IDEMPOTENT_METHODS:
+            return status_code in RETRY_STATUSES_IDEMPOTENT
+        return status_code in RETRY_STATUSES
+
+    def _should_retry_error(self, method: str, error: Exception) -> bool:
+        # A connect failure never reached Pyrus; anything later might have
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        if method.upper() in IDEMPOTENT_METHODS:
+            return isinstance(
+                error,
+                (requests.exceptions.ConnectionError, requests.exceptions.Timeout),
+            )
+        return False
+
+    def send(
+        self, login: str, method: str, send: Callable[[], requests.Response]
+    ) -> requests.Response:
+        bucket = self._bucket(login)
+        attempt = 0
+
+        while True:
+            attempt += 1
+            bucket.acquire()
+
+            try:
+                response = send()
+            except requests.exceptions.RequestException as e:
+                if attempt >= self.max_attempts or not self._should_retry_error(
+                    method, e
+                ):
+                    raise
+                delay = self._backoff(attempt)
+                print(
+                    f"⚠️ Outbound: {method} failed ({e}), retry {attempt}/{self.max_attempts - 1} in {delay:.1f}s"
+                )
+                time.sleep(delay)
+                continue
+
+            if response.status_code == 429:
+                delay = parse_retry_after(response.headers.get("Retry-After"))
+                if delay is None:
+                    delay = self._backoff(attempt)
+                bucket.pause(delay)
+            elif self._should_retry_status(method, response.status_code):
+                delay = self._backoff(attempt)
+            else:
+                return response
+
+            if attempt >= self.max_attempts:
+                print(
+                    f"❌ Outbound: {method} {response.url} still {response.status_code} after {attempt} attempts"
+                )
+                return response
+
+            print(
+                f"⚠️ Outbound: {method} {response.url} got {response.status_code}, retry {attempt}/{self.max_attempts - 1} in {delay:.1f}s"
+            )
+            response.close()
+            time.sleep(delay)
+
+
+_scheduler = OutboundScheduler()
+
+
+def configure_outbound_scheduler(
+    rate: float = DEFAULT_RATE,
+    burst: int = DEFAULT_BURST,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    backoff_base: float = DEFAULT_BACKOFF_BASE,
+    backoff_max: float = DEFAULT_BACKOFF_MAX,
+) -> OutboundScheduler:
+    global _scheduler
+
+    _scheduler = OutboundScheduler(rate, burst, max_attempts, backoff_base, backoff_max)
+    print(
+        f"✅ Outbound: {rate} requests/s per login, burst {burst}, {max_attempts} attempts"
+    )
+    return _scheduler
+
+
+def get_outbound_scheduler() -> OutboundScheduler:
+    return _scheduler
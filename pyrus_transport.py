@@ -0,0 +1,94 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Optional
+from pyrus_rate_limit import get_outbound_scheduler
+
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 30.0
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    # requests has no session-wide timeout, so the adapter fills it in
+    # for every call that does not pass its own
+    def __init__(self, timeout, *args, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+class PyrusTransport:
+    def __init__(
+        self,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+    ):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = self._create_session()
+
+    def _create_session(self) -> requests.Session:
+        adapter = TimeoutHTTPAdapter(
+            timeout=self.timeout,
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def request(
+        self, method: str, url: str, login: str = "", **kwargs
+    ) -> requests.Response:
+        # Every call is metered and retried per bot login by the scheduler
+        def send() -> requests.Response:
+            # A retried upload sends the file from its start again
+            for file in (kwargs.get("files") or {}).values():
+                if hasattr(file, "seek"):
+                    file.seek(0)
+            return self.session.request(method, url, **kwargs)
+
+        return get_outbound_scheduler().send(login, method, send)
+
+    def close(self):
+        self.session.close()
+
+
+_transport: Optional[PyrusTransport] = None
+_transport_lock = threading.Lock()
+
+
+def configure_transport(
+    pool_size: int = DEFAULT_POOL_SIZE,
+    connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+    read_timeout: float = DEFAULT_READ_TIMEOUT,
+) -> PyrusTransport:
+    global _transport
+
+    with _transport_lock:
+        if _transport is not None:
+            _transport.close()
+        _transport = PyrusTransport(pool_size, connect_timeout, read_timeout)
+        print(
+            f"✅ Transport: pool size {pool_size}, timeouts {connect_timeout}s/{read_timeout}s"
+        )
+        return _transport
+
+
+def get_transport() -> PyrusTransport:
+    global _transport
+
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = PyrusTransport()
+    return _transport
+
@@ -0,0 +1,202 @@
+import threading
+import time
+from contextlib import contextmanager
+import pyrus.models.requests
+from pyrus_client import PyrusClient
+from reminder_store import Reminder, ReminderStore, CATALOG_HEADERS
+from typing import List, Tuple
+
+
+DEFAULT_RETRY_DELAY = 30
+DEFAULT_SNAPSHOT_TTL = 24 * 60 * 60
+DEFAULT_FLUSH_WINDOW = 2
+
+
+def catalog_diff(
+    rows: List[Reminder], snapshot: List[Reminder]
+) -> Tuple[List[Reminder], List[str]]:
+    # Catalog items are keyed by the first column (the reminder id)
+    known = {row[0]: tuple(row) for row in snapshot}
+    current = {row[0]: tuple(row) for row in rows}
+    upsert = [row for key, row in current.items() if known.get(key) != row]
+    delete = [key for key in known if key not in current]
+    return upsert, delete  # type: ignore
+
+
+class CatalogMirror:
+    # Mirrors the reminder store into the Pyrus catalog in the background.
+    # Webhooks only write the store and call schedule().
+    def __init__(
+        self,
+        store: ReminderStore,
+        pyrus_client: PyrusClient,
+        catalog_id,
+        retry_delay: float = DEFAULT_RETRY_DELAY,
+        snapshot_ttl: float = DEFAULT_SNAPSHOT_TTL,
+        flush_window: float = DEFAULT_FLUSH_WINDOW,
+    ):
+        self.store = store
+        self.retry_delay = retry_delay
+        self.snapshot_ttl = snapshot_ttl
+        self.flush_window = flush_window
+        self.pyrus_client = pyrus_client
+        self.catalog_id = int(catalog_id)
+        self._seeded_key = f"catalog_seeded:{self.catalog_id}"
+        self._snapshot_key = f"catalog_snapshot_at:{self.catalog_id}"
+        self._pending = threading.Event()
+        self._stopping = threading.Event()
+        self._dirty = False
+        self._sync_lock = threading.Lock()
+        self._thread = None
+
+    def is_seeded(self) -> bool:
+        return self.store.get_meta(self._seeded_key) is not None
+
+    @contextmanager
+    def _writer(self):
+        with self._sync_lock, self.store.catalog_lock(self.catalog_id):
+            yield
+
+    def seed(self):
+        if self.is_seeded():
+            return
+        with self._writer():
+            self._seed()
+
+    def _seed(self):
+        # The first run imports the existing catalog, until then the store
+        # is not complete and must not overwrite it
+        if self.is_seeded():
+            return
+
+        print(f"⌛ Catalog mirror: importing catalog {self.catalog_id}")
+        catalog_response = self.pyrus_client.get_catalog(self.catalog_id)
+        if catalog_response.items is None:
+            raise Exception(
+                f"Catalog {self.catalog_id} is not available: {catalog_response.error}"
+            )
+
+        catalog_rows = [
+            tuple(str(value) for value in item.values)
+            for item in catalog_response.items
+            if item.values is not None and len(item.values) == len(CATALOG_HEADERS)
+        ]
+        imported = self.store.import_rows(catalog_rows)
+        self._save_snapshot(catalog_rows)  # type: ignore
+        self.store.set_meta(self._seeded_key, "1")
+        print(f"✅ Catalog mirror: imported {imported} reminders")
+
+    def _save_snapshot(self, rows: List[Reminder]):
+        self.store.replace_snapshot(self.catalog_id, rows)
+        self.store.set_meta(self._snapshot_key, str(time.time()))
+
+    def is_snapshot_stale(self) -> bool:
+        # A snapshot that is too old may have missed manual catalog edits
+        snapshot_at = self.store.get_meta(self._snapshot_key)
+        return (
+            snapshot_at is None or time.time() - float(snapshot_at) > self.snapshot_ttl
+        )
+
+    def _print_response(self, response):
+        print(f"🗑️ Deleted: {response.deleted}")
+        print(f"✅ Updated: {response.updated}")
+        print(f"➕ Added: {response.added}")
+
+    def _full_sync(self, rows: List[Reminder]):
+        request = pyrus.models.requests.SyncCatalogRequest(
+            apply=True,
+            catalog_headers=CATALOG_HEADERS,
+            items=[list(row) for row in rows],
+        )
+        if not rows:
+            # The request leaves out an empty item list, which would keep the
+            # catalog as it is. An explicit empty list clears it.
+            request.items = []
+        response = self.pyrus_client.sync_catalog(self.catalog_id, request)
+        if response.error is not None:
+            raise Exception(f"Catalog sync failed: {response.error}")
+
+        self._save_snapshot(rows)
+        print(f"🔄 Catalog mirror: full sync, {len(rows)} reminders in catalog")
+        self._print_response(response)
+
+    def _diff_sync(self, rows: List[Reminder]):
+        upsert, delete = catalog_diff(rows, self.store.snapshot(self.catalog_id))
+        if not upsert and not delete:
+            print("✅ Catalog mirror: catalog is up to date")
+            return
+
+        request = pyrus.models.requests.UpdateCatalogItemsRequest(
+            upsert=[list(row) for row in upsert], delete=delete
+        )
+        response = self.pyrus_client.update_catalog_items(self.catalog_id, request)
+        if response.error is not None:
+            # The snapshot no longer matches the catalog, rewrite it whole
+            print(f"❌ Catalog mirror: diff failed: {response.error}")
+            self._full_sync(rows)
+            return
+
+        self._save_snapshot(rows)
+        print(f"🔄 Catalog mirror: {len(upsert)} upserted, {len(delete)} deleted")
+        self._print_response(response)
+
+    def sync(self):
+        with self._writer():
+            self._seed()
+            rows = self.store.all()
+            if self.is_snapshot_stale():
+                self._full_sync(rows)
+            else:
+                self._diff_sync(rows)
+
+    def schedule(self):
+        # Changes are written behind: everything scheduled within one
+        # flush window goes out as a single catalog write
+        self._dirty = True
+        self._pending.set()
+
+    def flush(self):
+        self._pending.clear()
+        self._dirty = False
+        self.sync()
+
+    def _run(self):
+        while True:
+            self._pending.wait()
+            self._stopping.wait(self.flush_window)
+            if self._stopping.is_set():
+                # stop() writes what is left
+                return
+
+            self._pending.clear()
+            self._dirty = False
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"❌ Catalog mirror: {e}, retrying in {self.retry_delay}s")
+                self._stopping.wait(self.retry_delay)
+                self._dirty = True
+                self._pending.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="catalog-mirror", daemon=True
+            )
+            self._thread.start()
+            # Bring the catalog up to date with the store once on startup
+            self.schedule()
+
+    def stop(self, timeout: float = 30):
+        self._stopping.set()
+        self._pending.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+        if self._dirty:
+            print("⌛ Catalog mirror: flushing pending changes before shutdown")
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Catalog mirror: final flush failed: {e}")
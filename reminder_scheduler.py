@@ -0,0 +1,164 @@
+import heapq
+import threading
+import time
+from datetime import datetime, time as day_time
+from typing import Callable, List, Optional, Tuple
+from reminder_store import Reminder, ReminderStore
+from scheduler_lease import SchedulerLease
+
+
+DEFAULT_DELIVERY_TIME = day_time(8, 5)
+DEFAULT_POLL_INTERVAL = 5
+DEFAULT_RETRY_DELAY = 60
+DEFAULT_SWEEP_INTERVAL = 5 * 60
+
+# (due at, reminder id, timestamp the entry was scheduled for)
+TimerEntry = Tuple[float, str, str]
+
+
+def reminder_due_at(timestamp: str, delivery_time: day_time) -> float:
+    # "YYYY-MM-DD HH:MM" fires at its own time, a bare date at delivery_time.
+    # Only timed reminders are spread over the day, all date-only reminders
+    # of a day still fire together at delivery_time.
+    day, _, at = timestamp.partition(" ")
+    if at:
+        return datetime.strptime(f"{day} {at}", "%Y-%m-%d %H:%M").timestamp()
+    due_date = datetime.strptime(day, "%Y-%m-%d").date()
+    return datetime.combine(due_date, delivery_time).timestamp()
+
+
+class ReminderScheduler:
+    # Fires every reminder at its own due time from a min-heap of timers.
+    # The heap is loaded from the store once and then follows the rows the
+    # webhooks change (an indexed change_seq query), so nothing is scanned
+    # again. An entry is checked against the store when it fires, timers of
+    # reminders that were moved or deleted are dropped there. Every
+    # sweep_interval the reminders due today are checked for a missing timer.
+    def __init__(
+        self,
+        store: ReminderStore,
+        deliver: Callable[[List[Reminder], List[Reminder]], None],
+        delivery_time: day_time = DEFAULT_DELIVERY_TIME,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        lease: Optional[SchedulerLease] = None,
+        retry_delay: float = DEFAULT_RETRY_DELAY,
+        sweep_interval: float = DEFAULT_SWEEP_INTERVAL,
+    ):
+        self.store = store
+        self.deliver = deliver
+        self.delivery_time = delivery_time
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.retry_delay = retry_delay
+        self.sweep_interval = sweep_interval
+        self._heap: List[TimerEntry] = []
+        self._seen_seq = 0
+        self._swept_at = 0.0
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def push(self, reminder: Reminder):
+        reminder_id, _, timestamp, _ = reminder
+        try:
+            due_at = reminder_due_at(timestamp, self.delivery_time)
+        except ValueError:
+            print(f"⚠️ Reminder timers: bad timestamp in {reminder}")
+            return
+        heapq.heappush(self._heap, (due_at, reminder_id, timestamp))
+
+    def _refresh(self):
+        for reminder, change_seq in self.store.changed_since(self._seen_seq):
+            self.push(reminder)
+            self._seen_seq = max(self._seen_seq, change_seq)
+
+    def _sweep(self, now: float):
+        # Safety net: a reminder due by now that has no timer is fired
+        if now - self._swept_at < self.sweep_interval:
+            return
+        self._swept_at = now
+        scheduled = {entry[1] for entry in self._heap}
+        missed = 0
+        for reminder in self.store.due_on(datetime.fromtimestamp(now).date()):
+            if reminder[0] in scheduled:
+                continue
+            try:
+                due_at = reminder_due_at(reminder[2], self.delivery_time)
+            except ValueError:
+                continue
+            if due_at <= now:
+                heapq.heappush(self._heap, (due_at, reminder[0], reminder[2]))
+                missed += 1
+        if missed:
+            print(f"⚠️ Reminder timers: {missed} reminders without a timer found")
+
+    def _pop_due(self, now: float) -> Tuple[List[Reminder], List[Reminder]]:
+        today = datetime.fromtimestamp(now).date().isoformat()
+        due: List[Reminder] = []
+        expired: List[Reminder] = []
+        popped = set()
+        while self._heap and self._heap[0][0] <= now:
+            _, reminder_id, timestamp = heapq.heappop(self._heap)
+            reminder = self.store.get_by_id(reminder_id)
+            if reminder is None or reminder[2] != timestamp or reminder_id in popped:
+                continue
+            popped.add(reminder_id)
+            if timestamp[:10] < today:
+                expired.append(reminder)
+            else:
+                due.append(reminder)
+        return due, expired
+
+    def _deliver(self, due: List[Reminder], expired: List[Reminder]):
+        try:
+            self.deliver(due, expired)
+        except Exception as e:
+            # Sent and deleted reminders are gone from the store by now, the
+            # check in _pop_due drops their timers and only the rest fire again
+            print(f"❌ Reminder timers: {e}, retrying in {self.retry_delay}s")
+            retry_at = time.time() + self.retry_delay
+            for reminder_id, _, timestamp, _ in due + expired:
+                heapq.heappush(self._heap, (retry_at, reminder_id, timestamp))
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self._refresh()
+                now = time.time()
+                self._sweep(now)
+                if self._heap and self._heap[0][0] <= now:
+                    if self.lease is not None and not self.lease.acquire():
+                        # The leader delivers, keep the timers for a failover
+                        self._stopping.wait(self.poll_interval)
+                        continue
+                    due, expired = self._pop_due(now)
+                    if due or expired:
+                        self._deliver(due, expired)
+                    continue
+            except Exception as e:
+                print(f"❌ Reminder timers: {e}")
+
+            next_due = self._heap[0][0] - time.time() if self._heap else None
+            self._stopping.wait(
+                self.poll_interval
+                if next_due is None
+                else max(0, min(next_due, self.poll_interval))
+            )
+
+    def start(self):
+        if self._thread is None:
+            # Rows changed while loading come again from _refresh
+            self._seen_seq = self.store.last_change_seq()
+            self._swept_at = time.time()
+            for reminder in self.store.all():
+                self.push(reminder)
+            print(f"✅ Reminder timers: {len(self._heap)} reminders scheduled")
+            self._thread = threading.Thread(
+                target=self._run, name="reminder-timers", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout: float = 30):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
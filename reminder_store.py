@@ -0,0 +1,301 @@
+import fcntl
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+CATALOG_HEADERS = ["id", "task_id", "timestamp", "message_type"]
+DEFAULT_REMINDER_STORE_PATH = "reminders.sqlite3"
+
+# (id, task_id, timestamp, message_type), the column order of catalog 211552
+Reminder = Tuple[str, str, str, str]
+
+
+class ReminderStore:
+    # Local source of truth for reminders. The Pyrus catalog is only a
+    # mirror of this table (see reminder_catalog.CatalogMirror).
+    def __init__(self, path: str = DEFAULT_REMINDER_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        connection = self._connection()
+        connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS reminders (
+                id TEXT PRIMARY KEY,
+                task_id TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                message_type TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                form_id INTEGER,
+                change_seq INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS reminders_task_message
+                ON reminders (task_id, message_type);
+            CREATE INDEX IF NOT EXISTS reminders_timestamp
+                ON reminders (timestamp);
+            CREATE INDEX IF NOT EXISTS reminders_change_seq
+                ON reminders (change_seq);
+            CREATE TABLE IF NOT EXISTS catalog_snapshot (
+                catalog_id TEXT NOT NULL,
+                id TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                message_type TEXT NOT NULL,
+                PRIMARY KEY (catalog_id, id)
+            );
+            CREATE TABLE IF NOT EXISTS notify_journal (
+                run_date TEXT NOT NULL,
+                reminder_id TEXT NOT NULL,
+                sent_at REAL NOT NULL,
+                PRIMARY KEY (run_date, reminder_id)
+            );
+            CREATE TABLE IF NOT EXISTS store_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can not be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _rows(self, query: str, params: Iterable = ()) -> List[Reminder]:
+        return [
+            tuple(row)  # type: ignore
+            for row in self._connection().execute(query, tuple(params)).fetchall()
+        ]
+
+    @contextmanager
+    def _change(self):
+        # A write transaction numbered by the change counter. Writers are
+        # serialized by BEGIN IMMEDIATE, so the numbers follow the commit
+        # order and a reader never sees a lower one appear later.
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            change_seq = connection.execute(
+                """
+                INSERT INTO store_meta (key, value) VALUES ('change_seq', '1')
+                ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+                RETURNING CAST(value AS INTEGER)
+                """
+            ).fetchone()[0]
+            yield connection, change_seq
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def upsert(
+        self, task_id, timestamp: str, message_type: str, form_id: Optional[int] = None
+    ) -> Reminder:
+        # One indexed write: the reminder keeps its id, only the date changes.
+        # The form id is local only, it lets notify_job fetch tasks in bulk.
+        with self._change() as (connection, change_seq):
+            connection.execute(
+                """
+                INSERT INTO reminders (id, task_id, timestamp, message_type, updated_at, form_id, change_seq)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (task_id, message_type) DO UPDATE SET
+                    timestamp = excluded.timestamp,
+                    updated_at = excluded.updated_at,
+                    form_id = COALESCE(excluded.form_id, reminders.form_id),
+                    change_seq = excluded.change_seq
+                """,
+                (
+                    str(uuid.uuid4()),
+                    str(task_id),
+                    timestamp,
+                    message_type,
+                    time.time(),
+                    form_id,
+                    change_seq,
+                ),
+            )
+        return self.get(task_id, message_type)  # type: ignore
+
+    def get(self, task_id, message_type: str) -> Optional[Reminder]:
+        rows = self._rows(
+            "SELECT id, task_id, timestamp, message_type FROM reminders WHERE task_id = ? AND message_type = ?",
+            (str(task_id), message_type),
+        )
+        return rows[0] if rows else None
+
+    def delete(self, task_id, message_type: str) -> bool:
+        with self._change() as (connection, _):
+            cursor = connection.execute(
+                "DELETE FROM reminders WHERE task_id = ? AND message_type = ?",
+                (str(task_id), message_type),
+            )
+        return cursor.rowcount > 0
+
+    def delete_ids(self, reminder_ids: Iterable[str]) -> int:
+        reminder_ids = list(reminder_ids)
+        if not reminder_ids:
+            return 0
+        with self._change() as (connection, _):
+            cursor = connection.executemany(
+                "DELETE FROM reminders WHERE id = ?",
+                [(reminder_id,) for reminder_id in reminder_ids],
+            )
+        return cursor.rowcount
+
+    def get_by_id(self, reminder_id: str) -> Optional[Reminder]:
+        rows = self._rows(
+            "SELECT id, task_id, timestamp, message_type FROM reminders WHERE id = ?",
+            (reminder_id,),
+        )
+        return rows[0] if rows else None
+
+    def due_on(self, day: date) -> List[Reminder]:
+        # A timestamp is a date, optionally followed by " HH:MM"
+        return self._rows(
+            "SELECT id, task_id, timestamp, message_type FROM reminders WHERE timestamp >= ? AND timestamp < ? ORDER BY id",
+            (day.isoformat(), (day + timedelta(days=1)).isoformat()),
+        )
+
+    def due_before(self, day: date) -> List[Reminder]:
+        return self._rows(
+            "SELECT id, task_id, timestamp, message_type FROM reminders WHERE timestamp < ? ORDER BY id",
+            (day.isoformat(),),
+        )
+
+    def last_change_seq(self) -> int:
+        value = self.get_meta("change_seq")
+        return int(value) if value is not None else 0
+
+    def changed_since(self, change_seq: int) -> List[Tuple[Reminder, int]]:
+        return [
+            (tuple(row[:4]), row[4])  # type: ignore
+            for row in self._connection().execute(
+                "SELECT id, task_id, timestamp, message_type, change_seq FROM reminders WHERE change_seq > ? ORDER BY change_seq",
+                (change_seq,),
+            )
+        ]
+
+    def all(self) -> List[Reminder]:
+        return self._rows(
+            "SELECT id, task_id, timestamp, message_type FROM reminders ORDER BY id"
+        )
+
+    def form_ids(self, task_ids: Iterable) -> Dict[str, int]:
+        # Task id -> form id for the tasks whose form is known
+        task_ids = list({str(task_id) for task_id in task_ids})
+        if not task_ids:
+            return {}
+        placeholders = ", ".join("?" * len(task_ids))
+        return {
+            task_id: form_id
+            for task_id, form_id in self._connection().execute(
+                f"SELECT task_id, form_id FROM reminders WHERE form_id IS NOT NULL AND task_id IN ({placeholders})",
+                task_ids,
+            )
+        }
+
+    def import_rows(self, rows: Iterable[Reminder]) -> int:
+        # Rows written locally win over imported ones
+        with self._change() as (connection, change_seq):
+            cursor = connection.executemany(
+                """
+                INSERT OR IGNORE INTO reminders (id, task_id, timestamp, message_type, updated_at, change_seq)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        str(row[0]),
+                        str(row[1]),
+                        str(row[2]),
+                        str(row[3]),
+                        time.time(),
+                        change_seq,
+                    )
+                    for row in rows
+                ],
+            )
+        return cursor.rowcount
+
+    def mark_sent(self, run_date: date, reminder_id: str):
+        self._connection().execute(
+            "INSERT OR IGNORE INTO notify_journal (run_date, reminder_id, sent_at) VALUES (?, ?, ?)",
+            (run_date.isoformat(), reminder_id, time.time()),
+        )
+
+    def sent_on(self, run_date: date) -> Set[str]:
+        # Reminders already notified by an earlier attempt of this run
+        return {
+            row[0]
+            for row in self._connection().execute(
+                "SELECT reminder_id FROM notify_journal WHERE run_date = ?",
+                (run_date.isoformat(),),
+            )
+        }
+
+    def prune_journal(self, before: date) -> int:
+        cursor = self._connection().execute(
+            "DELETE FROM notify_journal WHERE run_date < ?", (before.isoformat(),)
+        )
+        return cursor.rowcount
+
+    def snapshot(self, catalog_id) -> List[Reminder]:
+        # Rows the catalog held after the last successful write
+        return self._rows(
+            "SELECT id, task_id, timestamp, message_type FROM catalog_snapshot WHERE catalog_id = ? ORDER BY id",
+            (str(catalog_id),),
+        )
+
+    def replace_snapshot(self, catalog_id, rows: Iterable[Reminder]):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "DELETE FROM catalog_snapshot WHERE catalog_id = ?", (str(catalog_id),)
+            )
+            connection.executemany(
+                """
+                INSERT INTO catalog_snapshot (catalog_id, id, task_id, timestamp, message_type)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                [
+                    (str(catalog_id), *(str(value) for value in row))
+                    for row in rows
+                ],
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    @contextmanager
+    def catalog_lock(self, catalog_id):
+        # Worker processes sharing the store take turns writing the catalog,
+        # otherwise one of them could overwrite it with an older view
+        with open(f"{self.path}-catalog-{catalog_id}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = (
+            self._connection()
+            .execute("SELECT value FROM store_meta WHERE key = ?", (key,))
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        self._connection().execute(
+            "INSERT INTO store_meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
@@ -0,0 +1,196 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+import functools
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+
+DEFAULT_SCHEDULER_LEASE_PATH = "scheduler.sqlite3"
+DEFAULT_LEASE_TTL = 60
+DEFAULT_POLL_INTERVAL = 5
+
+
+class SchedulerLease:
+    # Every gunicorn worker runs its own APScheduler. The jobs only run in
+    # the process that holds the lease, it renews it while it is alive and
+    # another process takes over once it expires.
+    def __init__(
+        self,
+        path: str = DEFAULT_SCHEDULER_LEASE_PATH,
+        name: str = "scheduler",
+        ttl: float = DEFAULT_LEASE_TTL,
+    ):
+        self.path = path
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.is_leader = False
+        self.expires_at = 0.0
+        connection = self._connect()
+        try:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS lease_runs (
+                    job TEXT NOT NULL,
+                    run_key TEXT NOT NULL,
+                    finished_at REAL NOT NULL,
+                    PRIMARY KEY (job, run_key)
+                )
+                """
+            )
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def acquire(self) -> bool:
+        # Takes the lease when it is free or expired, renews it when it is ours
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT holder, expires_at FROM leases WHERE name = ?", (self.name,)
+            ).fetchone()
+            acquired = row is None or row[0] == self.holder or row[1] < now
+            self.expires_at = now + self.ttl if acquired else row[1]
+            if acquired:
+                connection.execute(
+                    "INSERT OR REPLACE INTO leases (name, holder, expires_at) VALUES (?, ?, ?)",
+                    (self.name, self.holder, now + self.ttl),
+                )
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+        if acquired != self.is_leader:
+            print(
+                f"👑 Scheduler lease: {self.holder} {'is the leader now' if acquired else 'lost the lease'}"
+            )
+        self.is_leader = acquired
+        return acquired
+
+    def is_finished(self, job: str, run_key: str) -> bool:
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT 1 FROM lease_runs WHERE job = ? AND run_key = ?",
+                (job, run_key),
+            ).fetchone()
+        finally:
+            connection.close()
+        return row is not None
+
+    def mark_finished(self, job: str, run_key: str):
+        connection = self._connect()
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO lease_runs (job, run_key, finished_at) VALUES (?, ?, ?)",
+                (job, run_key, time.time()),
+            )
+        finally:
+            connection.close()
+
+    def run_once(
+        self,
+        job: str,
+        run_key: str,
+        func: Callable,
+        deadline: float,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ):
+        # Runs func in the lease holder only, once per run_key. Followers
+        # watch the lease until the run is marked finished: a leader killed
+        # before or during the run loses the lease and the follower that
+        # takes it over runs it again (notify_job resumes from its journal).
+        while not self.is_finished(job, run_key):
+            if self.acquire():
+                try:
+                    return func()
+                finally:
+                    # Also after a failure, the leader already retried it
+                    self.mark_finished(job, run_key)
+
+            now = time.time()
+            if now >= deadline or self._stopping.is_set():
+                print(f"⏩ Scheduler lease: {job} {run_key} was not finished in time")
+                return None
+            self._stopping.wait(
+                min(
+                    deadline - now,
+                    poll_interval,
+                    max(self.expires_at - now, 0) + 0.1,
+                )
+            )
+
+        print(f"⏩ Scheduler lease: {job} {run_key} ran in another process")
+        return None
+
+    def release(self):
+        connection = self._connect()
+        try:
+            connection.execute(
+                "DELETE FROM leases WHERE name = ? AND holder = ?",
+                (self.name, self.holder),
+            )
+        finally:
+            connection.close()
+        self.is_leader = False
+
+    def _heartbeat(self):
+        while not self._stopping.is_set():
+            try:
+                self.acquire()
+            except sqlite3.Error as e:
+                print(f"❌ Scheduler lease: {e}")
+            self._stopping.wait(self.ttl / 3)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._heartbeat, name="scheduler-lease", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(self.ttl / 3)
+            self._thread = None
+        if self.is_leader:
+            self.release()
+
+    def guard(self, func: Callable) -> Callable:
+        # Decorator for daily jobs: one run per day across all processes,
+        # followers wait for it until the end of the day (see run_once)
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            today = datetime.now().date()
+            deadline = datetime.combine(
+                today + timedelta(days=1), datetime.min.time()
+            ).timestamp()
+            return self.run_once(
+                func.__name__,
+                today.isoformat(),
+                functools.partial(func, *args, **kwargs),
+                deadline,
+            )
+
+        return wrapper
@@ -0,0 +1,107 @@
+import contextlib
+import io
+import unittest
+from types import SimpleNamespace
+from bot.echo_guard import EchoGuard
+
+
+BOT_USER_ID = 555
+PERSON_ID = 777
+FIELD_UPDATES = [{"id": 9, "value": "A-1"}]
+
+
+class FakeCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+def webhook_task(comment_id, author_id=None, field_updates=FIELD_UPDATES):
+    comment = {"id": comment_id, "field_updates": field_updates}
+    if author_id is not None:
+        comment["author"] = {"id": author_id}
+    return {"id": 77, "comments": [{"id": 1}, comment]}
+
+
+def write_response(author_id=BOT_USER_ID):
+    # The task returned by comment_task, its newest comment is the bot's
+    return SimpleNamespace(
+        comments=[SimpleNamespace(author=SimpleNamespace(id=author_id))]
+    )
+
+
+class Test_echo_guard(unittest.TestCase):
+    def setUp(self):
+        self.echo_guard = EchoGuard(FakeCache(), "bot@example.com")
+
+    def is_echo(self, task):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.echo_guard.is_echo(task)
+
+    def test_bot_comment_is_an_echo(self):
+        self.echo_guard.remember_author(write_response())
+
+        self.assertEqual(self.echo_guard.bot_user_id(), BOT_USER_ID)
+        self.assertTrue(self.is_echo(webhook_task(2, BOT_USER_ID)))
+
+    def test_person_setting_the_written_value_is_not_an_echo(self):
+        self.echo_guard.expect_write(77, FIELD_UPDATES)
+        self.echo_guard.remember_author(write_response())
+
+        self.assertFalse(self.is_echo(webhook_task(2, PERSON_ID)))
+
+    def test_expected_write_before_the_bot_is_known(self):
+        # The echo may come before the response to the write
+        self.echo_guard.expect_write(77, FIELD_UPDATES)
+
+        self.assertTrue(self.is_echo(webhook_task(2, BOT_USER_ID)))
+        # Redeliveries of the same comment are echoes too
+        self.assertTrue(self.is_echo(webhook_task(2, BOT_USER_ID)))
+        # The write is spent, a later comment with the same value is not
+        self.assertFalse(self.is_echo(webhook_task(3, PERSON_ID)))
+
+    def test_other_values_are_not_an_echo(self):
+        self.echo_guard.expect_write(77, FIELD_UPDATES)
+
+        self.assertFalse(
+            self.is_echo(webhook_task(2, field_updates=[{"id": 9, "value": "A-2"}]))
+        )
+        self.assertFalse(
+            self.is_echo(
+                webhook_task(
+                    2, field_updates=FIELD_UPDATES + [{"id": 10, "value": "x"}]
+                )
+            )
+        )
+        self.assertFalse(self.is_echo(webhook_task(2, field_updates=[])))
+
+    def test_forget_write(self):
+        self.echo_guard.expect_write(77, FIELD_UPDATES)
+
+        self.echo_guard.forget_write(77, FIELD_UPDATES)
+
+        self.assertFalse(self.is_echo(webhook_task(2)))
+
+    def test_task_without_comments(self):
+        self.echo_guard.remember_author(write_response())
+
+        self.assertFalse(self.is_echo({"id": 77}))
+        self.assertFalse(self.is_echo({"id": 77, "comments": [{"text": "x"}]}))
+
+    def test_remember_author_without_comments(self):
+        self.echo_guard.remember_author(None)
+        self.echo_guard.remember_author(SimpleNamespace(comments=[]))
+
+        self.assertIsNone(self.echo_guard.bot_user_id())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+from pyrus.models.entities import FormField
+from bot.field_extractor import find_fields
+
+
+WEBHOOK_FIELDS = [
+    {"id": 1, "type": "text", "name": "Заказ", "value": "A-1"},
+    {
+        "id": 2,
+        "type": "title",
+        "name": "Доставка",
+        "value": {
+            "fields": [
+                {
+                    "id": 3,
+                    "type": "date",
+                    "name": "Дата отгрузки",
+                    "value": "2026-10-18",
+                },
+                {
+                    "id": 4,
+                    "type": "title",
+                    "name": "Оплата",
+                    "value": {
+                        "fields": [
+                            {"id": 5, "type": "text", "name": "Тип оплаты / Статус"}
+                        ]
+                    },
+                },
+            ]
+        },
+    },
+    {
+        "id": 6,
+        "type": "table",
+        "name": "Товары",
+        "value": [{"row_id": 0, "cells": []}],
+    },
+    {"id": 7, "type": "date", "name": "Дата отгрузки", "value": "2026-10-25"},
+]
+
+
+class Test_find_fields(unittest.TestCase):
+    def test_fields_nested_in_titles(self):
+        found = find_fields(
+            WEBHOOK_FIELDS,
+            [
+                ("text", "Заказ"),
+                ("date", "Дата отгрузки"),
+                ("text", "Тип оплаты / Статус"),
+            ],
+        )
+
+        self.assertEqual(
+            {key: field["id"] for key, field in found.items()},
+            {
+                ("text", "Заказ"): 1,
+                ("date", "Дата отгрузки"): 3,
+                ("text", "Тип оплаты / Статус"): 5,
+            },
+        )
+
+    def test_first_match_wins(self):
+        # The date inside the title comes before the top level one
+        found = find_fields(WEBHOOK_FIELDS, [("date", "Дата отгрузки")])
+
+        self.assertEqual(found[("date", "Дата отгрузки")]["id"], 3)
+
+    def test_titles_and_tables_are_found_themselves(self):
+        found = find_fields(WEBHOOK_FIELDS, [("title", "Оплата"), ("table", "Товары")])
+
+        self.assertEqual(found[("title", "Оплата")]["id"], 4)
+        self.assertEqual(found[("table", "Товары")]["id"], 6)
+
+    def test_type_must_match(self):
+        self.assertEqual(find_fields(WEBHOOK_FIELDS, [("text", "Дата отгрузки")]), {})
+
+    def test_nothing_wanted(self):
+        self.assertEqual(find_fields(WEBHOOK_FIELDS, []), {})
+        self.assertEqual(find_fields([], [("text", "Заказ")]), {})
+
+    def test_library_form_fields(self):
+        # Tasks read through pyrus-api hold FormField objects with Title values
+        fields = [
+            FormField(**field)
+            for field in (
+                {"id": 1, "type": "text", "name": "Заказ", "value": "A-1"},
+                {
+                    "id": 2,
+                    "type": "title",
+                    "name": "Доставка",
+                    "value": {
+                        "checkmark": "checked",
+                        "fields": [
+                            {"id": 9, "type": "text", "name": "№ ордера", "value": "7"}
+                        ],
+                    },
+                },
+            )
+        ]
+
+        found = find_fields(fields, [("text", "№ ордера"), ("text", "Заказ")])
+
+        self.assertEqual(found[("text", "№ ордера")].id, 9)
+        self.assertEqual(found[("text", "№ ордера")].value, "7")
+        self.assertEqual(found[("text", "Заказ")].id, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
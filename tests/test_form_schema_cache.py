@@ -0,0 +1,180 @@
+import unittest
+from flask import Flask
+from bot.form_schema_cache import FormSchemaCache, invalidate_view
+
+
+FORM_FIELDS = [
+    {"id": 1, "name": "Заказ", "type": "text"},
+    {
+        "id": 2,
+        "name": "Доставка",
+        "type": "title",
+        "info": {
+            "fields": [
+                {"id": 3, "name": "Дата отгрузки", "type": "date"},
+                {
+                    "id": 4,
+                    "name": "Адрес",
+                    "type": "text",
+                    "visibility_condition": {"field_id": 0},
+                },
+            ]
+        },
+    },
+]
+
+
+class FakeCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class FakePyrusAPI:
+    def __init__(self, fields):
+        self.fields = fields
+        self.requested = []
+
+    def get_request(self, url):
+        self.requested.append(url)
+        return {"fields": self.fields}
+
+
+class Test_form_schema_cache(unittest.TestCase):
+    def setUp(self):
+        self.cache = FakeCache()
+        self.pyrus_api = FakePyrusAPI(FORM_FIELDS)
+        self.form_schema_cache = FormSchemaCache(self.cache, self.pyrus_api)
+
+    def test_get_downloads_once(self):
+        first = self.form_schema_cache.get(100)
+        second = self.form_schema_cache.get(100)
+
+        self.assertEqual(len(self.pyrus_api.requested), 1)
+        self.assertIs(first, second)
+        self.assertEqual(first["field_ids"], [1, 2, 3, 4])
+        self.assertEqual(first["visibility_conditions"], {4: True})
+
+    def test_get_refreshes_for_an_unknown_field(self):
+        self.form_schema_cache.get(100)
+        self.pyrus_api.fields = FORM_FIELDS + [{"id": 5, "name": "Новое", "type": "text"}]
+
+        schema = self.form_schema_cache.get(100, [{"id": 1}, {"id": 5}])
+
+        self.assertEqual(len(self.pyrus_api.requested), 2)
+        self.assertIn(5, schema["field_ids"])
+
+    def test_get_keeps_the_schema_for_known_fields(self):
+        self.form_schema_cache.get(100)
+
+        self.form_schema_cache.get(
+            100, [{"id": 1}, {"id": 2, "value": {"fields": [{"id": 3}]}}]
+        )
+
+        self.assertEqual(len(self.pyrus_api.requested), 1)
+
+    def test_removed_field_waits_for_the_ttl(self):
+        self.form_schema_cache.get(100)
+        self.pyrus_api.fields = FORM_FIELDS[:1]
+
+        schema = self.form_schema_cache.get(100, [{"id": 1}])
+
+        self.assertEqual(len(self.pyrus_api.requested), 1)
+        self.assertIn("Дата отгрузки", schema["field_names"])
+
+    def test_invalidate(self):
+        self.form_schema_cache.get(100)
+        self.pyrus_api.fields = FORM_FIELDS[:1]
+
+        self.form_schema_cache.invalidate(100)
+        schema = self.form_schema_cache.get(100)
+
+        self.assertEqual(len(self.pyrus_api.requested), 2)
+        self.assertEqual(schema["field_ids"], [1])
+
+    def test_entries_of_other_forms_are_kept(self):
+        self.form_schema_cache.get(100)
+        self.form_schema_cache.get(200)
+
+        self.form_schema_cache.invalidate(200)
+        self.form_schema_cache.get(100)
+
+        self.assertEqual(len(self.pyrus_api.requested), 2)
+
+    def test_field_by_name(self):
+        self.assertEqual(
+            self.form_schema_cache.field_by_name(100, "Заказ", "text"),
+            {"id": 1, "type": "text"},
+        )
+        # Fields nested in a title are found too
+        self.assertEqual(
+            self.form_schema_cache.field_by_name(100, "Дата отгрузки"),
+            {"id": 3, "type": "date"},
+        )
+        self.assertIsNone(self.form_schema_cache.field_by_name(100, "Заказ", "date"))
+        self.assertIsNone(self.form_schema_cache.field_by_name(100, "Нет такого"))
+
+    def test_missing_form(self):
+        self.pyrus_api.get_request = lambda url: {"error": "not found"}
+
+        self.assertIsNone(self.form_schema_cache.get(100))
+        self.assertIsNone(self.form_schema_cache.field_by_name(100, "Заказ"))
+
+
+class Test_invalidate_view(unittest.TestCase):
+    def setUp(self):
+        self.cache = FakeCache()
+        self.pyrus_api = FakePyrusAPI(FORM_FIELDS)
+        self.form_schema_cache = FormSchemaCache(self.cache, self.pyrus_api)
+        self.form_schema_cache.get(100)
+
+    def _client(self, admin_token):
+        app = Flask(__name__)
+        app.add_url_rule(
+            "/form-schema/<int:form_id>/invalidate",
+            view_func=invalidate_view(self.form_schema_cache, admin_token),
+            methods=["POST"],
+        )
+        return app.test_client()
+
+    def test_invalidates_with_the_token(self):
+        client = self._client("token")
+
+        response = client.post(
+            "/form-schema/100/invalidate", headers={"Authorization": "Bearer token"}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cache.values, {})
+
+    def test_rejects_a_wrong_token(self):
+        client = self._client("token")
+
+        for headers in ({}, {"Authorization": "Bearer other"}, {"Authorization": "token"}):
+            with self.subTest(headers=headers):
+                response = client.post("/form-schema/100/invalidate", headers=headers)
+
+                self.assertEqual(response.status_code, 403)
+        self.assertEqual(len(self.cache.values), 1)
+
+    def test_disabled_without_a_token(self):
+        client = self._client(None)
+
+        response = client.post(
+            "/form-schema/100/invalidate", headers={"Authorization": "Bearer None"}
+        )
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(len(self.cache.values), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
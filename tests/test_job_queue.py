@@ -0,0 +1,163 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from bot.job_queue import JobQueue, MemoryQueueBackend, SQLiteQueueBackend
+
+
+class SQLiteBackendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "jobs.sqlite3")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _status(self, job_id):
+        connection = sqlite3.connect(self.path)
+        try:
+            row = connection.execute(
+                "SELECT status, attempts FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        finally:
+            connection.close()
+        return tuple(row) if row else None
+
+
+class Test_sqlite_queue_backend(SQLiteBackendTestCase):
+    def test_put_get_ack(self):
+        backend = SQLiteQueueBackend(self.path)
+        job_id = backend.put("sync", {"task": {"id": 1}})
+
+        self.assertEqual(backend.size(), 1)
+        self.assertEqual(backend.get(timeout=0), (job_id, "sync", {"task": {"id": 1}}))
+        self.assertEqual(self._status(job_id), ("running", 1))
+        self.assertIsNone(backend.get(timeout=0))
+
+        backend.ack(job_id)
+
+        self.assertIsNone(self._status(job_id))
+
+    def test_failed_job_is_retried_up_to_max_attempts(self):
+        backend = SQLiteQueueBackend(self.path, max_attempts=2)
+        job_id = backend.put("sync", {})
+
+        backend.get(timeout=0)
+        self.assertTrue(backend.fail(job_id, "error"))
+        self.assertEqual(self._status(job_id), ("queued", 1))
+
+        backend.get(timeout=0)
+        self.assertFalse(backend.fail(job_id, "error"))
+        self.assertEqual(self._status(job_id), ("failed", 2))
+        self.assertIsNone(backend.get(timeout=0))
+
+    def test_job_of_a_dead_worker_is_queued_again(self):
+        dead = SQLiteQueueBackend(self.path, stale_after=1)
+        job_id = dead.put("sync", {})
+        dead.get(timeout=0)
+        # The process is gone, nobody refreshes the job any more
+        dead._untrack(job_id)
+
+        time.sleep(1.2)
+        other = SQLiteQueueBackend(self.path, stale_after=1)
+
+        self.assertEqual(self._status(job_id), ("queued", 1))
+        self.assertEqual(other.get(timeout=0), (job_id, "sync", {}))
+        other.ack(job_id)
+
+    def test_running_job_is_not_queued_again(self):
+        live = SQLiteQueueBackend(self.path, stale_after=1)
+        job_id = live.put("sync", {})
+        live.get(timeout=0)
+
+        # Longer than stale_after, the heartbeat keeps the job fresh
+        time.sleep(1.5)
+        SQLiteQueueBackend(self.path, stale_after=1)
+
+        self.assertEqual(self._status(job_id), ("running", 1))
+        live.ack(job_id)
+
+    def test_job_that_kills_its_worker_is_given_up(self):
+        backend = SQLiteQueueBackend(self.path, stale_after=1, max_attempts=1)
+        job_id = backend.put("sync", {})
+        backend.get(timeout=0)
+        backend._untrack(job_id)
+
+        time.sleep(1.2)
+        SQLiteQueueBackend(self.path, stale_after=1, max_attempts=1)
+
+        self.assertEqual(self._status(job_id), ("failed", 1))
+
+    def test_put_wakes_a_waiting_worker(self):
+        backend = SQLiteQueueBackend(self.path)
+        jobs = []
+        thread = threading.Thread(target=lambda: jobs.append(backend.get(timeout=5)))
+        thread.start()
+        time.sleep(0.1)
+
+        started = time.monotonic()
+        job_id = backend.put("sync", {})
+        thread.join()
+
+        self.assertEqual(jobs, [(job_id, "sync", {})])
+        self.assertLess(time.monotonic() - started, 2)
+
+
+class Test_memory_queue_backend(unittest.TestCase):
+    def test_failed_job_is_retried_up_to_max_attempts(self):
+        backend = MemoryQueueBackend(max_attempts=2)
+        job_id = backend.put("sync", {})
+
+        job = backend.get(timeout=0)
+        self.assertTrue(backend.fail(job_id, "error", job))
+        job = backend.get(timeout=0)
+        self.assertFalse(backend.fail(job_id, "error", job))
+
+        self.assertIsNone(backend.get(timeout=0))
+
+
+class Test_job_queue(SQLiteBackendTestCase):
+    def _run(self, backend, handler, payloads):
+        job_queue = JobQueue(backend, workers=2)
+        job_queue.register("sync", handler)
+        for payload in payloads:
+            job_queue.enqueue("sync", payload)
+        job_queue.start()
+        job_queue.stop()
+
+    def test_jobs_are_run_and_retried(self):
+        for backend in (
+            MemoryQueueBackend(max_attempts=3),
+            SQLiteQueueBackend(self.path, max_attempts=3),
+        ):
+            with self.subTest(backend=type(backend).__name__):
+                runs = []
+                lock = threading.Lock()
+
+                def handler(payload):
+                    with lock:
+                        runs.append(payload)
+                        attempt = runs.count(payload)
+                    if payload == "flaky" and attempt < 2:
+                        raise Exception("Pyrus is down")
+                    if payload == "broken":
+                        raise Exception("Bad payload")
+
+                self._run(backend, handler, ["ok", "flaky", "broken"])
+
+                self.assertEqual(runs.count("ok"), 1)
+                self.assertEqual(runs.count("flaky"), 2)
+                self.assertEqual(runs.count("broken"), 3)
+                self.assertEqual(backend.size(), 0)
+
+    def test_unknown_job(self):
+        job_queue = JobQueue(MemoryQueueBackend())
+
+        with self.assertRaises(KeyError):
+            job_queue.enqueue("sync", {})
+
+
+if __name__ == "__main__":
+    unittest.main()
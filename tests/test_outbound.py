@@ -0,0 +1,325 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from email.utils import formatdate
+from unittest import mock
+import requests
+from pyrus_auth import TokenBroker
+from pyrus_client import PyrusClient
+from pyrus_rate_limit import OutboundScheduler, TokenBucket, parse_retry_after
+from pyrus_transport import PyrusTransport
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.url = "https://api.pyrus.com/v4/tasks/1"
+
+    def close(self):
+        pass
+
+
+class FakeSend:
+    # Answers with the given responses in turn, an exception is raised
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def __call__(self):
+        result = self.results[min(self.calls, len(self.results) - 1)]
+        self.calls += 1
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class Test_outbound_scheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = OutboundScheduler(rate=1000, burst=1000, max_attempts=3)
+        self.pauses = []
+        patches = [
+            mock.patch("pyrus_rate_limit.time.sleep"),
+            mock.patch.object(
+                TokenBucket,
+                "pause",
+                autospec=True,
+                side_effect=lambda bucket, seconds: self.pauses.append(seconds),
+            ),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_429_retry_after_seconds(self):
+        send = FakeSend(FakeResponse(429, {"Retry-After": "7"}), FakeResponse(200))
+
+        response = self.scheduler.send("login", "POST", send)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(send.calls, 2)
+        self.assertEqual(self.pauses, [7.0])
+
+    def test_429_retry_after_http_date(self):
+        retry_after = formatdate(time.time() + 30, usegmt=True)
+        send = FakeSend(
+            FakeResponse(429, {"Retry-After": retry_after}), FakeResponse(200)
+        )
+
+        response = self.scheduler.send("login", "GET", send)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.pauses), 1)
+        self.assertAlmostEqual(self.pauses[0], 30, delta=2)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("3"), 3.0)
+        self.assertEqual(parse_retry_after(formatdate(0, usegmt=True)), 0.0)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after("soon"))
+
+    def test_attempts_are_bounded(self):
+        send = FakeSend(FakeResponse(503))
+
+        response = self.scheduler.send("login", "GET", send)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(send.calls, 3)
+
+    def test_retried_statuses(self):
+        cases = [
+            ("GET", 500, True),
+            ("GET", 502, True),
+            ("GET", 504, True),
+            ("GET", 404, False),
+            ("POST", 429, True),
+            ("POST", 503, True),
+            ("POST", 500, False),
+            ("POST", 502, False),
+            ("POST", 504, False),
+        ]
+        for method, status_code, retried in cases:
+            with self.subTest(method=method, status_code=status_code):
+                send = FakeSend(FakeResponse(status_code), FakeResponse(200))
+
+                response = self.scheduler.send("login", method, send)
+
+                self.assertEqual(send.calls, 2 if retried else 1)
+                self.assertEqual(response.status_code, 200 if retried else status_code)
+
+    def test_retried_errors(self):
+        cases = [
+            ("POST", requests.exceptions.ConnectTimeout(), True),
+            ("POST", requests.exceptions.ReadTimeout(), False),
+            ("POST", requests.exceptions.ConnectionError(), False),
+            ("GET", requests.exceptions.ReadTimeout(), True),
+            ("GET", requests.exceptions.ConnectionError(), True),
+        ]
+        for method, error, retried in cases:
+            with self.subTest(method=method, error=type(error).__name__):
+                send = FakeSend(error, FakeResponse(200))
+
+                if retried:
+                    self.assertEqual(
+                        self.scheduler.send("login", method, send).status_code, 200
+                    )
+                else:
+                    with self.assertRaises(type(error)):
+                        self.scheduler.send("login", method, send)
+                self.assertEqual(send.calls, 2 if retried else 1)
+
+
+class Test_token_broker(unittest.TestCase):
+    def setUp(self):
+        self.broker = TokenBroker()
+        self.requested = []
+        self.lock = threading.Lock()
+
+        def request_token(login, secret_key):
+            time.sleep(0.05)
+            with self.lock:
+                self.requested.append(login)
+                return {
+                    "access_token": f"token-{len(self.requested)}",
+                    "api_url": "https://api.pyrus.com/v4/",
+                    "files_url": "https://files.pyrus.com/",
+                }
+
+        self.broker._request_token = request_token
+
+    def test_single_flight(self):
+        tokens = []
+        threads = [
+            threading.Thread(
+                target=lambda: tokens.append(self.broker.get_token("login", "key"))
+            )
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.requested, ["login"])
+        self.assertEqual(set(tokens), {"token-1"})
+
+    def test_logins_do_not_share_tokens(self):
+        self.assertEqual(self.broker.get_token("first", "key"), "token-1")
+        self.assertEqual(self.broker.get_token("second", "key"), "token-2")
+
+    def test_stale_token_is_replaced(self):
+        token = self.broker.get_token("login", "key")
+
+        # The caller got a 401 with it
+        renewed = self.broker.get_token("login", "key", stale_token=token)
+
+        self.assertNotEqual(renewed, token)
+        self.assertEqual(self.broker.get_token("login", "key"), renewed)
+        self.assertEqual(len(self.requested), 2)
+
+    def test_stale_token_is_not_taken_from_cache(self):
+        cache = {}
+        fake_cache = mock.Mock(
+            get=cache.get, set=lambda key, value, timeout: cache.update({key: value})
+        )
+        token = self.broker.get_token("login", "key", cache=fake_cache)
+        other_worker = TokenBroker()
+        other_worker._request_token = self.broker._request_token
+
+        renewed = other_worker.get_token(
+            "login", "key", cache=fake_cache, stale_token=token
+        )
+
+        self.assertNotEqual(renewed, token)
+
+    def test_origins_are_kept_with_the_token(self):
+        auth = self.broker.get_auth("login", "key")
+
+        self.assertEqual(auth["token"], "token-1")
+        self.assertEqual(auth["api_url"], "https://api.pyrus.com/v4/")
+        self.assertEqual(auth["files_url"], "https://files.pyrus.com/")
+
+
+class FakeTransport:
+    def __init__(self, response):
+        self.response = response
+        self.requests = []
+
+    def request(self, method, url, login="", **kwargs):
+        files = kwargs.get("files") or {}
+        self.requests.append(
+            (
+                method,
+                url,
+                kwargs["headers"],
+                {name: file.read() for name, file in files.items()},
+            )
+        )
+        return self.response
+
+
+class Test_pyrus_client(unittest.TestCase):
+    def setUp(self):
+        self.client = PyrusClient("login", "key")
+        self.auth = {
+            "token": "token",
+            "api_url": "https://api.example.pyrus.com/v4/",
+            "files_url": "https://files.example.pyrus.com/",
+            "expires_at": time.time() + 3600,
+        }
+        patch = mock.patch(
+            "pyrus_client.token_broker.get_auth", side_effect=lambda *args: self.auth
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_auth_uses_the_origins_of_the_account(self):
+        self.assertEqual(self.client._auth()["access_token"], "token")
+
+        self.assertEqual(self.client.access_token, "token")
+        self.assertEqual(
+            self.client._create_url("/tasks/1"),
+            "https://api.example.pyrus.com/v4/tasks/1",
+        )
+        self.assertEqual(
+            self.client._create_files_url("/files/download/1"),
+            "https://files.example.pyrus.com/files/download/1",
+        )
+
+    def test_auth_without_origins_keeps_the_default_hosts(self):
+        self.auth = {"token": "token", "expires_at": time.time() + 3600}
+
+        self.client._auth()
+
+        self.assertEqual(
+            self.client._create_url("/tasks/1"), "https://api.pyrus.com/v4/tasks/1"
+        )
+
+    def test_upload_goes_through_the_transport(self):
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {"guid": "file-guid", "md5_hash": "hash"}
+        transport = FakeTransport(response)
+        with tempfile.NamedTemporaryFile(delete=False) as file:
+            file.write(b"receipt")
+        self.addCleanup(os.unlink, file.name)
+
+        with mock.patch("pyrus_client.get_transport", return_value=transport):
+            upload = self.client.upload_file(file.name)
+
+        self.assertEqual(upload.guid, "file-guid")
+        [(method, url, headers, files)] = transport.requests
+        self.assertEqual(method, "POST")
+        self.assertEqual(url, "https://api.example.pyrus.com/v4/files/upload")
+        self.assertEqual(headers["Authorization"], "Bearer token")
+        # requests sets the multipart Content-Type itself
+        self.assertNotIn("Content-Type", headers)
+        self.assertEqual(files, {"file": b"receipt"})
+
+    def test_upload_size_limit(self):
+        with tempfile.NamedTemporaryFile() as file:
+            file.write(b"receipt")
+            file.flush()
+            with mock.patch.object(PyrusClient, "MAX_FILE_SIZE_IN_BYTES", 3):
+                with self.assertRaises(Exception):
+                    self.client._post_file_request(
+                        "https://api.pyrus.com/v4/files/upload", file.name
+                    )
+
+
+class Test_pyrus_transport(unittest.TestCase):
+    def test_retried_upload_sends_the_whole_file(self):
+        transport = PyrusTransport()
+        self.addCleanup(transport.close)
+        sent = []
+
+        def request(method, url, **kwargs):
+            sent.append(kwargs["files"]["file"].read())
+            return FakeResponse(503 if len(sent) == 1 else 200)
+
+        scheduler = OutboundScheduler(rate=1000, burst=1000, max_attempts=3)
+        patches = [
+            mock.patch.object(transport.session, "request", side_effect=request),
+            mock.patch(
+                "pyrus_transport.get_outbound_scheduler", return_value=scheduler
+            ),
+            mock.patch("pyrus_rate_limit.time.sleep"),
+            mock.patch.object(TokenBucket, "pause"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        with tempfile.TemporaryFile() as file:
+            file.write(b"receipt")
+            response = transport.request(
+                "POST", "https://api.pyrus.com/v4/files/upload", files={"file": file}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sent, [b"receipt", b"receipt"])
+
+
+if __name__ == "__main__":
+    unittest.main()
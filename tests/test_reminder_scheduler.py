@@ -0,0 +1,149 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, time as day_time
+from reminder_store import ReminderStore
+from reminder_scheduler import ReminderScheduler, reminder_due_at
+
+
+NOW = datetime(2026, 10, 18, 12, 0).timestamp()
+
+
+class Test_reminder_due_at(unittest.TestCase):
+    def test_due_at(self):
+        self.assertEqual(
+            reminder_due_at("2026-10-18 09:30", day_time(8, 5)),
+            datetime(2026, 10, 18, 9, 30).timestamp(),
+        )
+        self.assertEqual(
+            reminder_due_at("2026-10-18", day_time(8, 5)),
+            datetime(2026, 10, 18, 8, 5).timestamp(),
+        )
+
+
+class Test_reminder_scheduler(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ReminderStore(os.path.join(self.tmp.name, "reminders.sqlite3"))
+        self.deliveries = []
+        self.failing = False
+        self.scheduler = ReminderScheduler(
+            self.store, self._deliver, retry_delay=60, sweep_interval=0
+        )
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _deliver(self, due, expired):
+        self.deliveries.append((due, expired))
+        if self.failing:
+            raise Exception("Pyrus is down")
+        self.store.delete_ids(reminder[0] for reminder in due + expired)
+
+    def _load(self):
+        # What start() does, without the thread
+        self.scheduler._seen_seq = self.store.last_change_seq()
+        for reminder in self.store.all():
+            self.scheduler.push(reminder)
+
+    def _fire(self, now=NOW):
+        self.scheduler._refresh()
+        due, expired = self.scheduler._pop_due(now)
+        if due or expired:
+            self.scheduler._deliver(due, expired)
+        return due, expired
+
+    def test_new_reminder_is_picked_up(self):
+        self._load()
+        reminder = self.store.upsert(1, "2026-10-18 10:00", "shipment_date")
+
+        self.assertEqual(self._fire(), ([reminder], []))
+
+    def test_reminder_moved_to_an_earlier_date(self):
+        self.store.upsert(1, "2026-10-25", "shipment_date")
+        self._load()
+
+        moved = self.store.upsert(1, "2026-10-18 11:00", "shipment_date")
+
+        self.assertEqual(self._fire(), ([moved], []))
+        # The timer of the old date finds nothing to send
+        self.assertEqual(self._fire(datetime(2026, 10, 26).timestamp()), ([], []))
+
+    def test_deleted_reminder_does_not_fire(self):
+        self.store.upsert(1, "2026-10-18 10:00", "shipment_date")
+        self._load()
+
+        self.store.delete(1, "shipment_date")
+
+        self.assertEqual(self._fire(), ([], []))
+        self.assertEqual(self.deliveries, [])
+
+    def test_expired_reminder(self):
+        reminder = self.store.upsert(1, "2026-10-17", "shipment_date")
+        self._load()
+
+        self.assertEqual(self._fire(), ([], [reminder]))
+
+    def test_failed_delivery_is_retried(self):
+        due = self.store.upsert(1, "2026-10-18 10:00", "shipment_date")
+        expired = self.store.upsert(2, "2026-10-17", "shipment_date")
+        self._load()
+        self.failing = True
+
+        failed_at = time.time()
+        self._fire()
+
+        # Both are due again once the retry delay is over, not before
+        self.assertEqual(self.scheduler._pop_due(failed_at + 30), ([], []))
+        self.failing = False
+        self.assertEqual(self._fire(failed_at + 61), ([due], [expired]))
+        self.assertEqual(self.store.all(), [])
+
+    def test_sweep_finds_a_reminder_without_timer(self):
+        self._load()
+        # Written behind the cursor, _refresh does not see it
+        reminder = self.store.upsert(1, "2026-10-18 10:00", "shipment_date")
+        self.scheduler._seen_seq = self.store.last_change_seq()
+
+        self.scheduler._sweep(NOW)
+
+        self.assertEqual(self._fire(), ([reminder], []))
+
+    def test_sweep_skips_reminders_with_a_timer(self):
+        self.store.upsert(1, "2026-10-18 10:00", "shipment_date")
+        self._load()
+
+        self.scheduler._sweep(NOW)
+
+        self.assertEqual(len(self.scheduler._heap), 1)
+
+    def test_change_seq_follows_commit_order(self):
+        self._load()
+        seen = self.store.last_change_seq()
+        barrier = threading.Barrier(4)
+
+        def write(task_id):
+            barrier.wait()
+            for i in range(10):
+                self.store.upsert(task_id, f"2026-10-18 10:{i:02d}", "shipment_date")
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        changed = self.store.changed_since(seen)
+        change_seqs = [change_seq for _, change_seq in changed]
+        self.assertEqual(change_seqs, sorted(set(change_seqs)))
+        self.assertEqual(change_seqs[-1], self.store.last_change_seq())
+        # Every task is seen with its last write
+        self.assertEqual(
+            sorted(reminder[2] for reminder, _ in changed), ["2026-10-18 10:09"] * 4
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
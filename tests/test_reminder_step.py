@@ -0,0 +1,312 @@
+import contextlib
+import io
+import random
+import unittest
+from bot.reminder_step import format_fields
+from bot.visibility_conditions import compile_visibility_conditions
+
+
+# format_fields as it was before TaskFieldIndex, kept verbatim to check the
+# rewrite against. It read the visibility conditions from the task fields.
+
+def legacy_format_fields(
+    form_fields,
+    task_fields,
+    required_step,
+    field_html_tag_begin="<li>",
+    field_html_tag_end="</li>",
+):
+    if form_fields is None or task_fields is None or required_step is None:
+        print("⚠️ No form_fields or task_fields or required_step")
+        return False
+
+    filtered_fields_list = []
+    formated_fields_list = []
+
+    def _filtered_field(field_id, task_fields):
+        found_field = {}
+
+        for fields_from_list in task_fields:
+            # if second level
+            value = fields_from_list.get("value")
+            if value is not None and isinstance(value, dict) and "fields" in value:
+                # if value and fields:
+                # if this is group check visiability
+                if not _check_visibility_condition(fields_from_list, task_fields):
+                    continue
+
+                # find field in group by id
+                for fields_from_list_lv_2 in fields_from_list["value"]["fields"]:
+                    if fields_from_list_lv_2["id"] == field_id:
+                        found_field = fields_from_list_lv_2
+
+            # if one level
+            if fields_from_list["id"] == field_id:
+                found_field = fields_from_list
+
+        if not _check_visibility_condition(found_field, task_fields):
+            return None
+
+        return found_field
+
+    def _check_visibility_condition(task_field, task_fields):
+        def find_field_by_id(field_id, field_list):
+            for field in field_list:
+                if field["id"] == field_id:
+                    return field
+                value = field.get("value")
+                if value is not None and isinstance(value, dict) and "fields" in value:
+                    nested_fields = value["fields"]
+                    found_field = find_field_by_id(field_id, nested_fields)
+                    if found_field is not None:
+                        return found_field
+            return None
+
+        def check_field(current_field):
+            if (
+                field is None
+                or current_field["condition_type"] is None
+                or current_field["field_id"] is None
+                or current_field["value"] is None
+            ):
+                print("⛔ check_field: is not ready")
+                return False
+
+            condition_type = int(current_field["condition_type"])
+            field_id = current_field["field_id"]
+            value = current_field["value"]
+            filtered_field = [find_field_by_id(field_id, task_fields)]
+            if isinstance(filtered_field[-1], type(None)):
+                print("⛔ filtered_field: is None and not ready")
+                return False
+
+            chosen_field = filtered_field[-1]
+
+            # Check if field has condition_type 3 or 2 (Заполнено и не Заполнено)
+            if condition_type == 2 or condition_type == 3:
+                type_chosen_field = chosen_field.get("type")
+                value_chosen_field = chosen_field.get("value")
+                if type_chosen_field == "multiple_choice":
+                    if (
+                        condition_type == 2 and value_chosen_field is None
+                    ):  # Не заполнено
+                        return True
+                    if (
+                        condition_type == 3 and value_chosen_field is not None
+                    ):  # Заполнено
+                        return True
+                if type_chosen_field == "checkmark":
+                    if condition_type == 2 and value_chosen_field == "unchecked":
+                        return True
+                    if condition_type == 3 and value_chosen_field == "checked":
+                        return True
+            if (
+                "value" in chosen_field
+                and "choice_ids" in chosen_field["value"]
+                and int(value) in chosen_field["value"]["choice_ids"]
+            ):
+                return True
+
+            return False
+
+        # Check if field has visibility_condition
+        visibility_condition = task_field.get("visibility_condition")
+        if visibility_condition is None:
+            return True
+
+        # Check if field has children (conditions) lv 1
+        conditions = visibility_condition.get("children")
+        conditions_id = visibility_condition.get("field_id")
+        if conditions_id is not None:
+            conditions_is_empty = conditions_id == 0 and conditions is None
+            if conditions_is_empty:
+                return True
+        if conditions is None:
+            return False
+
+        # Loop over conditions (children - lv 1)
+        for condition in conditions:
+            # Get options of the current conditon (children - lv 2 - options))
+            condition_options = condition.get("children")
+            if condition_options is None:
+                is_valid_field = check_field(condition)
+                if not is_valid_field:
+                    return False
+                continue
+
+            has_correct_value_lv2 = (
+                False  # Flag for checking if in one condition has correct value
+            )
+
+            # Loop over options (children - lv 2)
+            for option in condition_options:
+                # Check to find corrent field and if it has correct value
+                if check_field(option):
+                    has_correct_value_lv2 = True
+                    break
+
+            if not has_correct_value_lv2:
+                return False
+
+        return True
+
+    for field in form_fields:
+        if (
+            "info" in field
+            and "required_step" in field["info"]
+            and field["info"]["required_step"] == required_step
+        ):
+            found_field = _filtered_field(field["id"], task_fields)
+            if found_field:
+                filtered_fields_list.append(found_field)
+        elif "info" in field and "fields" in field["info"]:
+            for field_lv_two in field["info"]["fields"]:
+                if (
+                    "info" in field_lv_two
+                    and "required_step" in field_lv_two["info"]
+                    and field_lv_two["info"]["required_step"] == required_step
+                ):
+                    found_field = _filtered_field(field_lv_two["id"], task_fields)
+                    if found_field:
+                        filtered_fields_list.append(found_field)
+
+    for (
+        filtered_field
+    ) in filtered_fields_list:  # loop over filtered fields from form API
+        for task_field in task_fields:  # loop over fields from task API
+            if (
+                "value" in task_field
+                and isinstance(task_field["value"], dict)
+                and "fields" in task_field["value"]
+            ):  # field has second level of fields
+                for task_field_lv_2 in task_field["value"]["fields"]:
+                    if filtered_field["id"] == task_field_lv_2["id"]:
+                        formated_fields_list.append(
+                            f'{field_html_tag_begin}{"✅" if "value" in task_field_lv_2 and task_field_lv_2["value"] != "unchecked" or "value" in task_field_lv_2 and task_field_lv_2["value"] == "checked" else "✔️" if "value" in task_field_lv_2 and task_field_lv_2["value"] == "unchecked" else "❌"}{filtered_field["name"]}{field_html_tag_end}'
+                        )
+            else:
+                if filtered_field["id"] == task_field["id"]:
+                    formated_fields_list.append(
+                        f'{field_html_tag_begin}{"✅" if "value" in task_field and task_field["value"] != "unchecked" or "value" in task_field and task_field["value"] == "checked" else "✔️" if "value" in task_field and task_field["value"] == "unchecked" else "❌"}{filtered_field["name"]}{field_html_tag_end}'
+                    )
+
+    return formated_fields_list
+
+
+def task_visibility_conditions(task_fields):
+    # The conditions legacy_format_fields found on the task fields, in the
+    # form field layout compile_visibility_conditions reads
+    form_fields = []
+    for field in task_fields:
+        if "visibility_condition" in field:
+            form_fields.append(
+                {"id": field["id"], "visibility_condition": field["visibility_condition"]}
+            )
+        value = field.get("value")
+        if isinstance(value, dict) and "fields" in value:
+            form_fields += task_visibility_conditions(value["fields"])
+    return form_fields
+
+
+def random_form_and_task(seed):
+    rnd = random.Random(seed)
+    ids = list(range(1, rnd.randint(3, 25)))
+    rnd.shuffle(ids)
+    free_ids = iter(ids)
+
+    def leaf():
+        return {
+            "condition_type": rnd.choice([1, 2, 3, None]),
+            "field_id": rnd.choice(ids + [999]),
+            "value": rnd.choice([1, 2, 3, None]),
+        }
+
+    def condition():
+        if rnd.random() < 0.5:
+            return None
+        if rnd.random() < 0.1:
+            return {"field_id": 0}
+        children = [
+            (
+                {"children": [leaf() for _ in range(rnd.randint(0, 3))]}
+                if rnd.random() < 0.4
+                else leaf()
+            )
+            for _ in range(rnd.randint(0, 3))
+        ]
+        return {
+            "field_id": rnd.choice([1, 5]),
+            "children": children if rnd.random() < 0.9 else None,
+        }
+
+    def task_fields(depth):
+        fields = []
+        for _ in range(rnd.randint(1, 4)):
+            field_id = next(free_ids, None)
+            if field_id is None:
+                break
+            field = {
+                "id": field_id,
+                "name": f"field {field_id}",
+                "type": rnd.choice(["text", "checkmark", "multiple_choice", "title"]),
+            }
+            if depth < 3 and rnd.random() < 0.3:
+                field["value"] = {"fields": task_fields(depth + 1)}
+            else:
+                value = rnd.choice(
+                    [None, "checked", "unchecked", "text", {"choice_ids": [rnd.randint(1, 3)]}]
+                )
+                if value is not None:
+                    field["value"] = value
+            visibility_condition = condition()
+            if visibility_condition:
+                field["visibility_condition"] = visibility_condition
+            fields.append(field)
+        return fields
+
+    task = task_fields(0)
+    form = []
+    for field_id in ids:
+        if rnd.random() < 0.6:
+            if rnd.random() < 0.2:
+                form.append(
+                    {
+                        "id": field_id,
+                        "info": {
+                            "fields": [
+                                {"id": nested_id, "info": {"required_step": rnd.choice([1, 2])}}
+                                for nested_id in rnd.sample(ids, min(3, len(ids)))
+                            ]
+                        },
+                    }
+                )
+            else:
+                form.append({"id": field_id, "info": {"required_step": rnd.choice([1, 2])}})
+    return form, task
+
+
+class Test_format_fields(unittest.TestCase):
+    def test_matches_the_legacy_implementation(self):
+        for seed in range(3000):
+            form, task = random_form_and_task(seed)
+            visibility_conditions = compile_visibility_conditions(
+                task_visibility_conditions(task)
+            )
+            for step in (1, 2):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    expected = legacy_format_fields(form, task, step)
+                    actual = format_fields(
+                        form, task, step, visibility_conditions=visibility_conditions
+                    )
+                if actual != expected:
+                    self.fail(f"seed {seed}, step {step}: {actual} != {expected}")
+
+    def test_missing_input(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertFalse(format_fields(None, [], 1))
+            self.assertFalse(format_fields([], None, 1))
+            self.assertFalse(format_fields([], [], None))
+
+
+if __name__ == "__main__":
+    unittest.main()
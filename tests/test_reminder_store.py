@@ -0,0 +1,435 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from datetime import date
+from types import SimpleNamespace
+from pyrus_client import PyrusClient
+from reminder_store import ReminderStore
+from reminder_catalog import CatalogMirror, catalog_diff
+from notify_in_pyrus_task import Notification_in_pyrus_task
+
+
+def _write_response():
+    return SimpleNamespace(error=None, deleted=[], updated=[], added=[])
+
+
+class FakePyrusClient:
+    def __init__(self, catalog_rows=()):
+        self.catalog_rows = [list(row) for row in catalog_rows]
+        self.synced = []
+        self.sync_requests = []
+        self.diffs = []
+
+    def get_catalog(self, catalog_id):
+        return SimpleNamespace(
+            items=[SimpleNamespace(values=row) for row in self.catalog_rows],
+            error=None,
+        )
+
+    def sync_catalog(self, catalog_id, request):
+        self.sync_requests.append(request)
+        self.synced.append(request.items)
+        return _write_response()
+
+    def update_catalog_items(self, catalog_id, request):
+        upsert = getattr(request, "upsert", None) or []
+        self.diffs.append(
+            (
+                [item.values for item in upsert],
+                getattr(request, "delete", None) or [],
+            )
+        )
+        return _write_response()
+
+
+class StoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ReminderStore(os.path.join(self.tmp.name, "reminders.sqlite3"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+class Test_reminder_store(StoreTestCase):
+    def test_upsert_keeps_id(self):
+        first = self.store.upsert(1, "2026-10-18", "shipment_date", form_id=7)
+        second = self.store.upsert(1, "2026-10-19 09:30", "shipment_date")
+
+        self.assertEqual(first[0], second[0])
+        self.assertEqual(second[1:], ("1", "2026-10-19 09:30", "shipment_date"))
+        # The form id is kept when a later write does not know it
+        self.assertEqual(self.store.form_ids([1]), {"1": 7})
+
+    def test_delete(self):
+        self.store.upsert(1, "2026-10-18", "shipment_date")
+        self.store.upsert(1, "2026-10-18", "payment_date")
+
+        self.assertTrue(self.store.delete(1, "shipment_date"))
+        self.assertFalse(self.store.delete(1, "shipment_date"))
+        self.assertIsNone(self.store.get(1, "shipment_date"))
+        self.assertIsNotNone(self.store.get(1, "payment_date"))
+
+    def test_due_on_and_due_before(self):
+        self.store.upsert(1, "2026-10-17 23:59", "shipment_date")
+        self.store.upsert(2, "2026-10-18", "shipment_date")
+        self.store.upsert(3, "2026-10-18 09:30", "shipment_date")
+        self.store.upsert(4, "2026-10-19 00:00", "shipment_date")
+
+        due = {row[1] for row in self.store.due_on(date(2026, 10, 18))}
+        expired = {row[1] for row in self.store.due_before(date(2026, 10, 18))}
+
+        self.assertEqual(due, {"2", "3"})
+        self.assertEqual(expired, {"1"})
+
+    def test_changed_since_follows_writes(self):
+        seen = self.store.last_change_seq()
+        reminder = self.store.upsert(1, "2026-10-18", "shipment_date")
+
+        changed = self.store.changed_since(seen)
+
+        self.assertEqual([row for row, _ in changed], [reminder])
+        self.assertEqual(self.store.changed_since(changed[-1][1]), [])
+
+
+class Test_catalog_diff(unittest.TestCase):
+    def test_diff(self):
+        snapshot = [("a", "1", "2026-10-18", "x"), ("b", "2", "2026-10-18", "x")]
+        rows = [("a", "1", "2026-10-19", "x"), ("c", "3", "2026-10-18", "x")]
+
+        upsert, delete = catalog_diff(rows, snapshot)
+
+        self.assertEqual(
+            upsert, [("a", "1", "2026-10-19", "x"), ("c", "3", "2026-10-18", "x")]
+        )
+        self.assertEqual(delete, ["b"])
+
+    def test_no_changes(self):
+        rows = [("a", "1", "2026-10-18", "x")]
+
+        self.assertEqual(catalog_diff(rows, list(rows)), ([], []))
+
+
+class Test_catalog_mirror(StoreTestCase):
+    def _mirror(self, client, **kwargs):
+        return CatalogMirror(self.store, client, 211552, retry_delay=0.1, **kwargs)
+
+    def test_seed_imports_catalog(self):
+        client = FakePyrusClient([["a", "1", "2026-10-18", "shipment_date"]])
+        mirror = self._mirror(client)
+
+        mirror.seed()
+        mirror.seed()
+
+        self.assertTrue(mirror.is_seeded())
+        self.assertEqual(self.store.all(), [("a", "1", "2026-10-18", "shipment_date")])
+        self.assertEqual(self.store.snapshot(211552), self.store.all())
+
+    def test_sync_sends_only_the_diff(self):
+        client = FakePyrusClient([["a", "1", "2026-10-18", "shipment_date"]])
+        mirror = self._mirror(client)
+        mirror.seed()
+        reminder = self.store.upsert(2, "2026-10-19", "shipment_date")
+
+        mirror.sync()
+
+        self.assertEqual(client.synced, [])
+        self.assertEqual(client.diffs, [([list(reminder)], [])])
+
+    def test_stale_snapshot_is_rewritten_whole(self):
+        client = FakePyrusClient()
+        mirror = self._mirror(client, snapshot_ttl=0)
+        mirror.seed()
+        self.store.upsert(1, "2026-10-18", "shipment_date")
+
+        mirror.sync()
+
+        self.assertEqual(len(client.synced), 1)
+        self.assertEqual(client.diffs, [])
+
+    def test_empty_store_clears_the_catalog(self):
+        client = FakePyrusClient([["a", "1", "2026-10-18", "shipment_date"]])
+        mirror = self._mirror(client, snapshot_ttl=0)
+        mirror.seed()
+        self.store.delete(1, "shipment_date")
+
+        mirror.sync()
+
+        self.assertEqual(client.synced, [[]])
+        body = PyrusClient().serialize_request(client.sync_requests[0])
+        self.assertIn(b'"items": []', body)
+
+    def test_deliver_seeds_before_deleting(self):
+        # The catalog holds the reminder under the id of an older release
+        client = FakePyrusClient([["old-id", "1", "2026-10-18", "shipment_date"]])
+        mirror = self._mirror(client)
+        reminder = self.store.upsert(1, "2026-10-18", "shipment_date")
+        notification = Notification_in_pyrus_task(
+            self.store, mirror, "login", "key", FakeSentry()
+        )
+        author = SimpleNamespace(id=1, first_name="Ivan", last_name="Ivanov")
+        notification.pyrus_client = SimpleNamespace(
+            auth=lambda: SimpleNamespace(success=True),
+            get_task=lambda task_id: SimpleNamespace(
+                task=SimpleNamespace(author=author), original_response={}
+            ),
+        )
+        notification.async_pyrus_api = FakeAsyncPyrusAPI()
+
+        notification.deliver([reminder])
+        mirror.seed()
+
+        self.assertTrue(mirror.is_seeded())
+        self.assertEqual(self.store.all(), [])
+
+    def test_reminder_deleted_by_a_webhook_before_the_seed(self):
+        try:
+            from bot.create_reminder_comment import CreateReminderComment
+        except Exception as e:
+            raise unittest.SkipTest(
+                f"create_reminder_comment can not be imported here: {e}"
+            )
+        client = FakePyrusClient([["a", "1", "2026-10-18", "shipment_date"]])
+        mirror = self._mirror(client)
+        handler = CreateReminderComment(
+            self.store,
+            mirror,
+            None,
+            "key",
+            "login",
+            FakeSentry(),
+            {"text": {}, "date": []},
+        )
+
+        handler._delete_reminder("1", "shipment_date")
+        mirror.sync()
+
+        self.assertEqual(self.store.all(), [])
+        self.assertEqual(client.diffs, [([], ["a"])])
+
+    def test_schedule_coalesces_writes(self):
+        client = FakePyrusClient()
+        mirror = self._mirror(client, flush_window=0.2)
+        mirror.seed()
+        mirror.start()
+        time.sleep(0.5)
+        writes = len(client.diffs) + len(client.synced)
+
+        for task_id in range(3):
+            self.store.upsert(task_id, "2026-10-18", "shipment_date")
+            mirror.schedule()
+        time.sleep(0.5)
+        mirror.stop()
+
+        self.assertEqual(len(client.diffs) + len(client.synced), writes + 1)
+        self.assertEqual(len(client.diffs[-1][0]), 3)
+
+    def test_stop_flushes_pending_changes(self):
+        client = FakePyrusClient()
+        mirror = self._mirror(client, flush_window=60)
+        mirror.seed()
+        mirror.start()
+        reminder = self.store.upsert(1, "2026-10-18", "shipment_date")
+        mirror.schedule()
+
+        mirror.stop()
+
+        self.assertEqual(client.diffs, [([list(reminder)], [])])
+
+
+class FakeAsyncPyrusAPI:
+    def __init__(self, failing_task_ids=()):
+        self.failing_task_ids = set(failing_task_ids)
+        self.comments = []
+
+    async def call(self, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    async def gather(self, *calls, return_exceptions=False):
+        return await asyncio.gather(*calls, return_exceptions=return_exceptions)
+
+    async def comment_task(self, task_id, data):
+        if task_id in self.failing_task_ids:
+            raise Exception(f"Task {task_id} comment failed")
+        self.comments.append(task_id)
+        return {}
+
+    def close(self):
+        pass
+
+
+class FakeMirror:
+    def __init__(self):
+        self.flushes = 0
+        self.schedules = 0
+
+    def flush(self):
+        self.flushes += 1
+
+    def schedule(self):
+        self.schedules += 1
+
+
+class FakeSentry:
+    def capture_exception(self, error):
+        pass
+
+
+class Test_notify_journal(StoreTestCase):
+    run_date = date(2026, 10, 18)
+
+    def _notification(self, async_pyrus_api):
+        notification = Notification_in_pyrus_task(
+            self.store, FakeMirror(), "login", "key", FakeSentry()
+        )
+        author = SimpleNamespace(id=1, first_name="Ivan", last_name="Ivanov")
+        notification.pyrus_client = SimpleNamespace(
+            get_task=lambda task_id: SimpleNamespace(
+                task=SimpleNamespace(author=author), original_response={}
+            )
+        )
+        notification.async_pyrus_api = async_pyrus_api
+        return notification
+
+    def test_failed_reminder_stays_for_the_retry(self):
+        sent = self.store.upsert(1, "2026-10-18", "shipment_date")
+        failed = self.store.upsert(2, "2026-10-18", "shipment_date")
+        first_run = FakeAsyncPyrusAPI(failing_task_ids={"2"})
+
+        with self.assertRaises(Exception):
+            self._notification(first_run)._deliver(
+                [sent, failed], [], self.run_date, flush=True
+            )
+
+        self.assertEqual(first_run.comments, ["1"])
+        self.assertEqual(self.store.all(), [failed])
+
+        retry = FakeAsyncPyrusAPI()
+        self._notification(retry)._deliver([failed], [], self.run_date, flush=True)
+
+        self.assertEqual(retry.comments, ["2"])
+        self.assertEqual(self.store.all(), [])
+
+    def test_journaled_reminder_is_not_sent_again(self):
+        # A crash after the comment and before the delete
+        reminder = self.store.upsert(1, "2026-10-18", "shipment_date")
+        self.store.mark_sent(self.run_date, reminder[0])
+        async_pyrus_api = FakeAsyncPyrusAPI()
+
+        self._notification(async_pyrus_api)._deliver(
+            [reminder], [], self.run_date, flush=True
+        )
+
+        self.assertEqual(async_pyrus_api.comments, [])
+        self.assertEqual(self.store.all(), [])
+
+
+class FakeRegisterClient:
+    # Form register and single task reads, tasks of failing_forms can not be
+    # read from the register and missing tasks are left out of it
+    def __init__(self, failing_forms=(), missing_task_ids=()):
+        self.failing_forms = set(failing_forms)
+        self.missing_task_ids = set(missing_task_ids)
+        self.registers = []
+        self.task_reads = []
+
+    def _task(self, task_id):
+        author = SimpleNamespace(id=1, first_name="Ivan", last_name="Ivanov")
+        return SimpleNamespace(id=task_id, author=author)
+
+    def get_registry(self, form_id, request):
+        self.registers.append((form_id, request.task_ids))
+        if form_id in self.failing_forms:
+            return SimpleNamespace(tasks=None, error="server_error")
+        return SimpleNamespace(
+            tasks=[
+                self._task(task_id)
+                for task_id in request.task_ids
+                if task_id not in self.missing_task_ids
+            ],
+            error=None,
+        )
+
+    def get_task(self, task_id):
+        self.task_reads.append(task_id)
+        return SimpleNamespace(task=self._task(task_id), original_response={})
+
+
+class Test_notify_register(StoreTestCase):
+    run_date = date(2026, 10, 18)
+
+    def _deliver(self, pyrus_client, register_batch_size=2):
+        notification = Notification_in_pyrus_task(
+            self.store,
+            FakeMirror(),
+            "login",
+            "key",
+            FakeSentry(),
+            register_batch_size=register_batch_size,
+        )
+        notification.pyrus_client = pyrus_client
+        async_pyrus_api = FakeAsyncPyrusAPI()
+        notification.async_pyrus_api = async_pyrus_api
+        reminders = self.store.due_on(self.run_date)
+        notification._deliver(reminders, [], self.run_date, flush=True)
+        return sorted(async_pyrus_api.comments, key=int)
+
+    def test_tasks_are_read_from_the_register_in_batches(self):
+        for task_id in range(1, 6):
+            self.store.upsert(task_id, "2026-10-18", "shipment_date", form_id=7)
+        pyrus_client = FakeRegisterClient()
+
+        comments = self._deliver(pyrus_client)
+
+        self.assertEqual(comments, ["1", "2", "3", "4", "5"])
+        self.assertEqual(
+            sorted(task_ids for _, task_ids in pyrus_client.registers),
+            [[1, 2], [3, 4], [5]],
+        )
+        self.assertEqual(pyrus_client.task_reads, [])
+        self.assertEqual(self.store.all(), [])
+
+    def test_one_register_per_form(self):
+        self.store.upsert(1, "2026-10-18", "shipment_date", form_id=7)
+        self.store.upsert(2, "2026-10-18", "shipment_date", form_id=8)
+        pyrus_client = FakeRegisterClient()
+
+        self._deliver(pyrus_client, register_batch_size=100)
+
+        self.assertEqual(sorted(pyrus_client.registers), [(7, [1]), (8, [2])])
+
+    def test_task_missing_from_the_register_is_read_alone(self):
+        for task_id in range(1, 4):
+            self.store.upsert(task_id, "2026-10-18", "shipment_date", form_id=7)
+        pyrus_client = FakeRegisterClient(missing_task_ids={2})
+
+        comments = self._deliver(pyrus_client)
+
+        self.assertEqual(comments, ["1", "2", "3"])
+        self.assertEqual(pyrus_client.task_reads, [2])
+
+    def test_failed_register_falls_back_to_single_reads(self):
+        self.store.upsert(1, "2026-10-18", "shipment_date", form_id=7)
+        self.store.upsert(2, "2026-10-18", "shipment_date", form_id=8)
+        pyrus_client = FakeRegisterClient(failing_forms={7})
+
+        comments = self._deliver(pyrus_client)
+
+        self.assertEqual(comments, ["1", "2"])
+        self.assertEqual(pyrus_client.task_reads, [1])
+
+    def test_reminder_without_form_is_read_alone(self):
+        self.store.upsert(1, "2026-10-18", "payment_date")
+        pyrus_client = FakeRegisterClient()
+
+        comments = self._deliver(pyrus_client)
+
+        self.assertEqual(comments, ["1"])
+        self.assertEqual(pyrus_client.registers, [])
+        self.assertEqual(pyrus_client.task_reads, [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
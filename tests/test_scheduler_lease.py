@@ -0,0 +1,132 @@
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from scheduler_lease import SchedulerLease
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A leader that takes the lease, starts the run and hangs in it until killed
+LEADER = """
+import sys, time
+from scheduler_lease import SchedulerLease
+lease = SchedulerLease(sys.argv[1], ttl=1)
+lease.holder += "-leader"
+lease.start()
+def run():
+    print("started", flush=True)
+    time.sleep(60)
+lease.run_once("notify_job", "2026-10-18", run, time.time() + 60, poll_interval=0.1)
+"""
+
+
+class Test_scheduler_lease(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "scheduler.sqlite3")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _lease(self, holder: str) -> SchedulerLease:
+        lease = SchedulerLease(self.path, ttl=1)
+        lease.holder += f"-{holder}"
+        return lease
+
+    def _run_once(self, lease, func, timeout=10):
+        return lease.run_once(
+            "notify_job", "2026-10-18", func, time.time() + timeout, poll_interval=0.1
+        )
+
+    def test_lease_is_exclusive_until_it_expires(self):
+        leader = self._lease("leader")
+        follower = self._lease("follower")
+
+        self.assertTrue(leader.acquire())
+        self.assertFalse(follower.acquire())
+        time.sleep(1.1)
+        self.assertTrue(follower.acquire())
+        self.assertFalse(leader.acquire())
+
+    def test_runs_once(self):
+        first = self._lease("first")
+        second = self._lease("second")
+        runs = []
+
+        self._run_once(first, lambda: runs.append("first"))
+        self._run_once(second, lambda: runs.append("second"))
+
+        self.assertEqual(runs, ["first"])
+
+    def test_follower_waits_for_a_live_leader(self):
+        leader = self._lease("leader")
+        leader.start()
+        follower = self._lease("follower")
+        runs = []
+
+        def leader_run():
+            runs.append("leader")
+            time.sleep(2)
+
+        thread = threading.Thread(target=self._run_once, args=(leader, leader_run))
+        thread.start()
+        time.sleep(0.2)
+        self._run_once(follower, lambda: runs.append("follower"))
+        thread.join()
+        leader.stop()
+
+        # The leader renewed its lease through the run, the follower only
+        # returned once the run was finished
+        self.assertEqual(runs, ["leader"])
+        self.assertFalse(thread.is_alive())
+
+    def test_follower_gives_up_at_the_deadline(self):
+        leader = self._lease("leader")
+        leader.start()
+        follower = self._lease("follower")
+        leader.acquire()
+
+        started = time.time()
+        result = self._run_once(follower, lambda: "ran", timeout=0.5)
+        leader.stop()
+
+        self.assertIsNone(result)
+        self.assertLess(time.time() - started, 2)
+
+    def test_leader_killed_mid_run(self):
+        leader = subprocess.Popen(
+            [sys.executable, "-c", LEADER, self.path],
+            cwd=ROOT,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        self.addCleanup(leader.wait)
+        self.addCleanup(leader.kill)
+        self.addCleanup(leader.stdout.close)
+        for line in leader.stdout:
+            if line.strip() == "started":
+                break
+
+        follower = self._lease("follower")
+        runs = []
+        thread = threading.Thread(
+            target=self._run_once, args=(follower, lambda: runs.append("follower"))
+        )
+        thread.start()
+        time.sleep(0.5)
+        self.assertEqual(runs, [])
+
+        os.kill(leader.pid, signal.SIGKILL)
+        thread.join(10)
+
+        self.assertEqual(runs, ["follower"])
+        self.assertTrue(follower.is_finished("notify_job", "2026-10-18"))
+
+
+if __name__ == "__main__":
+    unittest.main()
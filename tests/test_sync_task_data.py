@@ -0,0 +1,322 @@
+import contextlib
+import io
+import threading
+import unittest
+from pyrus.models.responses import TaskResponse
+from bot.sync_task_data import SyncTaskData
+
+
+LINK_FIELD = "Заказ в Pyrus"
+SOURCE_FIELD = "№ ордеров из 1С"
+TARGET_FIELD = "№ ордера"
+TARGET_FORM_ID = 2
+TARGET_FIELD_ID = 9
+
+
+class FakeCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.values[key] = value
+
+    def add(self, key, value, timeout=None):
+        if key in self.values:
+            return False
+        self.values[key] = value
+        return True
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class FakeSentry:
+    def __init__(self):
+        self.messages = []
+        self.exceptions = []
+
+    def capture_message(self, message, level=None):
+        self.messages.append(message)
+
+    def capture_exception(self, error):
+        self.exceptions.append(error)
+
+
+class FakePyrusAPI:
+    # The linked form keeps the target field in a title
+    def __init__(self):
+        self.requested = []
+
+    def get_request(self, url):
+        self.requested.append(url)
+        return {
+            "id": TARGET_FORM_ID,
+            "fields": [
+                {
+                    "id": 1,
+                    "type": "title",
+                    "name": "Склад",
+                    "info": {
+                        "fields": [
+                            {
+                                "id": TARGET_FIELD_ID,
+                                "type": "text",
+                                "name": TARGET_FIELD,
+                            }
+                        ]
+                    },
+                }
+            ],
+        }
+
+
+class FakePyrusClient:
+    # Linked tasks held in Pyrus: task id -> value of TARGET_FIELD
+    def __init__(self, values):
+        self.values = values
+        self.calls = []
+        self.comment_error = None
+        self.failing_task_ids = set()
+        # Set while a call is in flight, syncs that overlap see it
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def get_task(self, task_id):
+        with self.lock:
+            self.calls.append(("get_task", task_id))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # Long enough for the other linked task to start
+            threading.Event().wait(0.05)
+            if task_id in self.failing_task_ids:
+                raise ConnectionError(f"Task {task_id} can not be read")
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        return TaskResponse(
+            task={
+                "id": task_id,
+                "form_id": TARGET_FORM_ID,
+                "fields": [
+                    {
+                        "id": TARGET_FIELD_ID,
+                        "type": "text",
+                        "name": TARGET_FIELD,
+                        "value": self.values[task_id],
+                    }
+                ],
+            }
+        )
+
+    def comment_task(self, task_id, task_comment_request):
+        self.calls.append(("comment_task", task_id))
+        if self.comment_error is not None:
+            return TaskResponse(
+                error=self.comment_error, error_code="invalid_field_id"
+            )
+        for field_update in task_comment_request.field_updates:
+            self.values[task_id] = field_update["value"]
+        return TaskResponse(
+            task={"id": task_id, "comments": [{"id": 1000, "author": {"id": 555}}]}
+        )
+
+
+def webhook_task(comment_id, value, linked_task_id=77):
+    return {
+        "id": 5,
+        "text": "Заказ",
+        "fields": [
+            {
+                "id": 1,
+                "type": "form_link",
+                "name": LINK_FIELD,
+                "value": {"task_id": linked_task_id},
+            }
+        ],
+        "comments": [
+            {
+                "id": comment_id,
+                "field_updates": [
+                    {"id": 2, "type": "text", "name": SOURCE_FIELD, "value": value}
+                ],
+            }
+        ],
+    }
+
+
+class SyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = FakeCache()
+        self.sentry = FakeSentry()
+        self.pyrus_client = FakePyrusClient({77: "old"})
+        self.pyrus_api = FakePyrusAPI()
+
+    def _sync(self, task, traked_fields=None) -> SyncTaskData:
+        sync = SyncTaskData(
+            cache=self.cache,
+            pyrus_secret_key="key",
+            pyrus_login="bot@example.com",
+            sentry_sdk=self.sentry,
+            traked_fields=traked_fields or {LINK_FIELD: [SOURCE_FIELD, TARGET_FIELD]},
+        )
+        sync.pyrus_client = self.pyrus_client
+        sync.form_schema_cache.pyrus_api = self.pyrus_api
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(sync.process_request({"task": task}), ("{}", 200))
+        return sync
+
+
+class Test_sync_skip_writes(SyncTestCase):
+    def test_first_sync_reads_and_writes(self):
+        sync = self._sync(webhook_task(11, "A-1"))
+
+        self.assertEqual(
+            self.pyrus_client.calls, [("get_task", 77), ("comment_task", 77)]
+        )
+        self.assertEqual(self.pyrus_client.values[77], "A-1")
+        self.assertEqual(sync.skipped_writes, 0)
+
+    def test_new_value_is_written_without_a_read(self):
+        self._sync(webhook_task(11, "A-1"))
+        self.pyrus_client.calls.clear()
+
+        self._sync(webhook_task(12, "A-2"))
+
+        self.assertEqual(self.pyrus_client.calls, [("comment_task", 77)])
+        self.assertEqual(self.pyrus_client.values[77], "A-2")
+
+    def test_unchanged_value_is_confirmed_and_skipped(self):
+        self._sync(webhook_task(11, "A-1"))
+        self.pyrus_client.calls.clear()
+
+        sync = self._sync(webhook_task(12, "A-1"))
+
+        self.assertEqual(self.pyrus_client.calls, [("get_task", 77)])
+        self.assertEqual(sync.skipped_writes, 1)
+
+    def test_value_held_by_the_task_is_skipped(self):
+        self.pyrus_client.values[77] = "A-1"
+
+        sync = self._sync(webhook_task(11, "A-1"))
+
+        self.assertEqual(self.pyrus_client.calls, [("get_task", 77)])
+        self.assertEqual(sync.skipped_writes, 1)
+
+    def test_hand_edit_is_not_skipped(self):
+        self._sync(webhook_task(11, "A-1"))
+        # Someone changed the field in Pyrus, the value cache still says A-1
+        self.pyrus_client.values[77] = "typed by hand"
+        self.pyrus_client.calls.clear()
+
+        sync = self._sync(webhook_task(12, "A-1"))
+
+        self.assertEqual(
+            self.pyrus_client.calls, [("get_task", 77), ("comment_task", 77)]
+        )
+        self.assertEqual(self.pyrus_client.values[77], "A-1")
+        self.assertEqual(sync.skipped_writes, 0)
+
+    def test_skipped_writes_are_counted_per_handler(self):
+        self.pyrus_client.values[77] = "A-1"
+
+        first = self._sync(webhook_task(11, "A-1"))
+        second = self._sync(webhook_task(12, "A-1"))
+
+        self.assertEqual((first.skipped_writes, second.skipped_writes), (1, 1))
+
+
+class Test_sync_cached_field_ids(SyncTestCase):
+    def test_field_ids_come_from_the_cached_form(self):
+        self._sync(webhook_task(11, "A-1"))
+        self.pyrus_client.calls.clear()
+
+        for comment_id, value in ((12, "A-2"), (13, "A-3")):
+            self._sync(webhook_task(comment_id, value))
+
+        self.assertEqual(
+            self.pyrus_client.calls, [("comment_task", 77), ("comment_task", 77)]
+        )
+        self.assertEqual(self.pyrus_client.values[77], "A-3")
+        # The form is downloaded once, the field is found inside its title
+        self.assertEqual(len(self.pyrus_api.requested), 1)
+
+    def test_failed_write_forgets_the_linked_form(self):
+        self._sync(webhook_task(11, "A-1"))
+        self.pyrus_client.comment_error = "Field 9 does not exist"
+        self._sync(webhook_task(12, "A-2"))
+        self.pyrus_client.comment_error = None
+        self.pyrus_client.calls.clear()
+
+        self._sync(webhook_task(13, "A-3"))
+
+        # The linked task may have moved to another form, it is read again
+        self.assertEqual(
+            self.pyrus_client.calls, [("get_task", 77), ("comment_task", 77)]
+        )
+        self.assertEqual(len(self.sentry.messages), 1)
+
+
+class Test_sync_linked_tasks(SyncTestCase):
+    # Two linked tasks, both pairs of the second link go to task 78 in a
+    # single write
+    TRACKED_FIELDS = {
+        LINK_FIELD: [SOURCE_FIELD, TARGET_FIELD],
+        "Счёт в Pyrus": [
+            [SOURCE_FIELD, TARGET_FIELD],
+            ["Сумма из 1С", TARGET_FIELD],
+        ],
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.pyrus_client = FakePyrusClient({77: "old", 78: "old"})
+
+    def _webhook_task(self, comment_id):
+        task = webhook_task(comment_id, "A-1")
+        task["fields"].append(
+            {
+                "id": 3,
+                "type": "form_link",
+                "name": "Счёт в Pyrus",
+                "value": {"task_id": 78},
+            }
+        )
+        task["comments"][0]["field_updates"].append(
+            {"id": 4, "type": "text", "name": "Сумма из 1С", "value": "100"}
+        )
+        return task
+
+    def test_linked_tasks_are_synced_in_parallel(self):
+        self._sync(self._webhook_task(11), self.TRACKED_FIELDS)
+
+        self.assertEqual(
+            sorted(self.pyrus_client.calls),
+            [
+                ("comment_task", 77),
+                ("comment_task", 78),
+                ("get_task", 77),
+                ("get_task", 78),
+            ],
+        )
+        self.assertEqual(self.pyrus_client.max_in_flight, 2)
+        self.assertEqual(self.pyrus_client.values, {77: "A-1", 78: "100"})
+
+    def test_one_failed_linked_task_does_not_stop_the_other(self):
+        self.pyrus_client.failing_task_ids = {78}
+
+        self._sync(self._webhook_task(11), self.TRACKED_FIELDS)
+
+        self.assertIn(("comment_task", 77), self.pyrus_client.calls)
+        self.assertNotIn(("comment_task", 78), self.pyrus_client.calls)
+        self.assertEqual(self.pyrus_client.values, {77: "A-1", 78: "old"})
+        self.assertEqual(len(self.sentry.exceptions), 1)
+        self.assertIsInstance(self.sentry.exceptions[0], ConnectionError)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import contextlib
+import io
+import pickle
+import unittest
+from bot.form_schema_cache import FormSchemaCache
+from bot.reminder_step import format_fields
+from bot.visibility_conditions import (
+    compile_visibility_condition,
+    compile_visibility_conditions,
+    evaluate_visibility,
+)
+
+
+# Field 3 is shown when "Оплата" (2) is "Наличные" (choice 1), the fields of
+# group 4 when the checkmark 5 is checked
+FORM_FIELDS = [
+    {"id": 1, "name": "Заказ", "type": "text", "info": {"required_step": 1}},
+    {"id": 2, "name": "Оплата", "type": "multiple_choice"},
+    {
+        "id": 3,
+        "name": "Чек",
+        "type": "text",
+        "info": {"required_step": 1},
+        "visibility_condition": {
+            "field_id": 2,
+            "children": [{"condition_type": 1, "field_id": 2, "value": 1}],
+        },
+    },
+    {
+        "id": 4,
+        "name": "Доставка",
+        "type": "title",
+        "visibility_condition": {
+            "field_id": 5,
+            "children": [{"condition_type": 3, "field_id": 5, "value": 0}],
+        },
+        "info": {
+            "fields": [
+                {"id": 6, "name": "Адрес", "type": "text", "info": {"required_step": 1}}
+            ]
+        },
+    },
+    {"id": 5, "name": "Нужна доставка", "type": "checkmark"},
+]
+
+
+def task_fields(choice_id, delivery):
+    # Task fields do not carry the conditions, only the form does
+    return [
+        {"id": 1, "name": "Заказ", "type": "text", "value": "A-1"},
+        {"id": 2, "name": "Оплата", "type": "multiple_choice", "value": {"choice_ids": [choice_id]}},
+        {"id": 3, "name": "Чек", "type": "text"},
+        {
+            "id": 4,
+            "name": "Доставка",
+            "type": "title",
+            "value": {"fields": [{"id": 6, "name": "Адрес", "type": "text"}]},
+        },
+        {"id": 5, "name": "Нужна доставка", "type": "checkmark", "value": delivery},
+    ]
+
+
+class FakeCache:
+    # Stores pickled values like the file system and Redis caches do
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        value = self.values.get(key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, timeout=None):
+        self.values[key] = pickle.dumps(value)
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class FakePyrusAPI:
+    def get_request(self, url):
+        return {"fields": FORM_FIELDS}
+
+
+class Test_visibility_conditions(unittest.TestCase):
+    def test_compile(self):
+        self.assertIs(compile_visibility_condition(None), True)
+        self.assertIs(compile_visibility_condition({"field_id": 0}), True)
+        self.assertIs(compile_visibility_condition({"field_id": 2}), False)
+        self.assertEqual(
+            compile_visibility_condition(FORM_FIELDS[2]["visibility_condition"]),
+            (((2, 1, 1),),),
+        )
+        # A clause none of whose leaves is complete hides the field
+        self.assertIs(
+            compile_visibility_condition(
+                {"field_id": 2, "children": [{"condition_type": 1, "field_id": 2, "value": None}]}
+            ),
+            False,
+        )
+
+    def test_compiled_conditions_survive_pickling(self):
+        programs = compile_visibility_conditions(FORM_FIELDS)
+
+        restored = pickle.loads(pickle.dumps(programs))
+
+        self.assertEqual(restored, programs)
+        self.assertEqual(set(restored), {3, 4})
+        fields_by_id = {field["id"]: field for field in task_fields(1, "checked")}
+        self.assertTrue(evaluate_visibility(restored[3], fields_by_id))
+        fields_by_id = {field["id"]: field for field in task_fields(2, "checked")}
+        self.assertFalse(evaluate_visibility(restored[3], fields_by_id))
+
+    def test_filled_and_empty(self):
+        filled = (((5, 3, 0),),)
+        empty = (((5, 2, 0),),)
+        checked = {5: {"id": 5, "type": "checkmark", "value": "checked"}}
+        unchecked = {5: {"id": 5, "type": "checkmark", "value": "unchecked"}}
+
+        self.assertTrue(evaluate_visibility(filled, checked))
+        self.assertFalse(evaluate_visibility(filled, unchecked))
+        self.assertTrue(evaluate_visibility(empty, unchecked))
+        self.assertFalse(evaluate_visibility(empty, {}))
+
+
+class Test_form_level_visibility(unittest.TestCase):
+    def setUp(self):
+        self.form_schema_cache = FormSchemaCache(FakeCache(), FakePyrusAPI())
+
+    def _checklist(self, fields):
+        # The schema comes out of the cache pickled, as in production
+        self.form_schema_cache.get(100)
+        schema = self.form_schema_cache.get(100, fields)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return format_fields(
+                schema["fields"],
+                fields,
+                1,
+                visibility_conditions=schema["visibility_conditions"],
+            )
+
+    def test_form_condition_hides_a_field(self):
+        self.assertEqual(
+            self._checklist(task_fields(2, "checked")),
+            ["<li>✅Заказ</li>", "<li>❌Адрес</li>"],
+        )
+
+    def test_form_condition_shows_a_field(self):
+        self.assertEqual(
+            self._checklist(task_fields(1, "checked")),
+            ["<li>✅Заказ</li>", "<li>❌Чек</li>", "<li>❌Адрес</li>"],
+        )
+
+    def test_hidden_group_hides_its_fields(self):
+        self.assertEqual(
+            self._checklist(task_fields(1, "unchecked")),
+            ["<li>✅Заказ</li>", "<li>❌Чек</li>"],
+        )
+
+    def test_conditions_compiled_from_the_form_by_default(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            checklist = format_fields(FORM_FIELDS, task_fields(2, "unchecked"), 1)
+
+        self.assertEqual(checklist, ["<li>✅Заказ</li>"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import contextlib
+import io
+import threading
+import unittest
+from bot.webhook_dedup import WebhookDeduplicator
+
+
+class FakeCache:
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.values[key] = value
+
+    def add(self, key, value, timeout=None):
+        with self.lock:
+            if key in self.values:
+                return False
+            self.values[key] = value
+            return True
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def enqueue(self, name, payload):
+        self.jobs.append((name, payload))
+
+
+def webhook_task(comment_id=11):
+    return {"id": 5, "comments": [{"id": 10}, {"id": comment_id}]}
+
+
+class Test_webhook_dedup(unittest.TestCase):
+    def setUp(self):
+        self.deduplicator = WebhookDeduplicator(FakeCache(), "sync")
+        self.handled = []
+
+    def handle(self, task):
+        comments = task.get("comments") or [{}]
+        self.handled.append(comments[-1].get("id"))
+        return '{"handled": true}', 200
+
+    def run_webhook(self, task, handle=None):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.deduplicator.run(task, handle or self.handle)
+
+    def test_redelivery_gets_the_stored_response(self):
+        first = self.run_webhook(webhook_task())
+        second = self.run_webhook(webhook_task())
+
+        self.assertEqual(first, ('{"handled": true}', 200))
+        self.assertEqual(second, first)
+        self.assertEqual(self.handled, [11])
+
+    def test_new_comment_is_a_new_delivery(self):
+        self.run_webhook(webhook_task(11))
+        self.run_webhook(webhook_task(12))
+
+        self.assertEqual(self.handled, [11, 12])
+
+    def test_redelivery_while_the_first_is_in_flight(self):
+        started = threading.Event()
+        release = threading.Event()
+        responses = []
+
+        def slow_handle(task):
+            started.set()
+            release.wait(5)
+            return self.handle(task)
+
+        thread = threading.Thread(
+            target=lambda: responses.append(
+                self.run_webhook(webhook_task(), slow_handle)
+            )
+        )
+        thread.start()
+        started.wait(5)
+
+        # Pyrus gave up waiting and delivered the webhook again
+        in_flight = self.run_webhook(webhook_task())
+        release.set()
+        thread.join()
+
+        self.assertEqual(in_flight, ("{}", 200))
+        self.assertEqual(responses, [('{"handled": true}', 200)])
+        self.assertEqual(self.handled, [11])
+
+    def test_failed_delivery_is_processed_on_retry(self):
+        def failing_handle(task):
+            raise Exception("Pyrus is down")
+
+        with self.assertRaises(Exception):
+            self.run_webhook(webhook_task(), failing_handle)
+        response = self.run_webhook(webhook_task())
+
+        self.assertEqual(response, ('{"handled": true}', 200))
+        self.assertEqual(self.handled, [11])
+
+    def test_begin_and_abort(self):
+        task = webhook_task()
+
+        self.assertIsNone(self.deduplicator.begin(task))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(self.deduplicator.begin(task), ("{}", 200))
+        self.deduplicator.abort(task)
+
+        self.assertIsNone(self.deduplicator.begin(task))
+
+    def test_task_without_comment_ids_is_not_deduplicated(self):
+        for task in ({"id": 5}, {"id": 5, "comments": [{"text": "x"}]}):
+            self.run_webhook(task)
+            self.run_webhook(task)
+
+        self.assertEqual(len(self.handled), 4)
+
+    def test_fast_ack_enqueues_once(self):
+        job_queue = FakeJobQueue()
+
+        for _ in range(2):
+            with contextlib.redirect_stdout(io.StringIO()):
+                response = self.deduplicator.run(
+                    webhook_task(), self.handle, job_queue, "webhook-sync-task-data"
+                )
+            self.assertEqual(response, ("{}", 200))
+
+        self.assertEqual(job_queue.jobs, [("webhook-sync-task-data", webhook_task())])
+        self.assertEqual(self.handled, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
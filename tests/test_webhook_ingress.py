@@ -0,0 +1,183 @@
+import contextlib
+import hashlib
+import hmac
+import io
+import json
+import unittest
+from flask import Flask
+from bot.reminder_step import reminder_step_view
+from bot.webhook_ingress import WebhookIngress
+
+
+SECRET = "secret"
+BODY = json.dumps({"task": {"id": 1}}).encode()
+
+
+def sign(body: bytes, secret: str = SECRET) -> str:
+    return hmac.new(secret.encode(), msg=body, digestmod=hashlib.sha1).hexdigest()
+
+
+class Test_webhook_ingress(unittest.TestCase):
+    def setUp(self):
+        self.payloads = []
+        self.ingress = WebhookIngress(SECRET, max_body_size=1024)
+        app = Flask(__name__)
+
+        @app.route("/webhook", methods=["GET", "POST"])
+        @self.ingress.route
+        def webhook(data):
+            self.payloads.append(data)
+            return "{}", 200
+
+        self.client = app.test_client()
+
+    def post(self, body: bytes, signature=None, **kwargs):
+        headers = {} if signature is None else {"X-Pyrus-Sig": signature}
+        return self.client.post("/webhook", data=body, headers=headers, **kwargs)
+
+    def test_valid_signature(self):
+        response = self.post(BODY, sign(BODY))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.payloads, [{"task": {"id": 1}}])
+
+    def test_signature_is_case_insensitive(self):
+        response = self.post(BODY, sign(BODY).upper())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.payloads), 1)
+
+    def test_bad_signature(self):
+        response = self.post(BODY, sign(BODY, "other secret"))
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.payloads, [])
+
+    def test_missing_signature(self):
+        response = self.post(BODY)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.payloads, [])
+
+    def test_missing_secret(self):
+        self.ingress.secret = ""
+
+        response = self.post(BODY, sign(BODY, ""))
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_empty_body(self):
+        response = self.client.get("/webhook", headers={"X-Pyrus-Sig": sign(b"")})
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_oversized_content_length(self):
+        body = json.dumps({"task": {"id": 1, "text": "a" * 2048}}).encode()
+
+        response = self.post(body, sign(body))
+
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.payloads, [])
+
+    def test_oversized_body_without_content_length(self):
+        body = json.dumps({"task": {"id": 1, "text": "a" * 2048}}).encode()
+
+        # A chunked request: no Content-Length, the server ends the stream
+        response = self.client.post(
+            "/webhook",
+            input_stream=io.BytesIO(body),
+            headers={"X-Pyrus-Sig": sign(body)},
+            environ_overrides={"wsgi.input_terminated": True},
+        )
+
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.payloads, [])
+
+    def test_body_without_content_length(self):
+        response = self.client.post(
+            "/webhook",
+            input_stream=io.BytesIO(BODY),
+            headers={"X-Pyrus-Sig": sign(BODY)},
+            environ_overrides={"wsgi.input_terminated": True},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.payloads, [{"task": {"id": 1}}])
+
+    def test_invalid_json(self):
+        body = b"{not json"
+
+        response = self.post(body, sign(body))
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.payloads, [])
+
+    def test_payload_without_task(self):
+        for body in (b"[1, 2]", json.dumps({"event": "x"}).encode()):
+            response = self.post(body, sign(body))
+
+            self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.payloads, [])
+
+
+class Test_default_body_limit(unittest.TestCase):
+    def test_large_task_is_accepted(self):
+        # A task with a long comment history
+        body = json.dumps({"task": {"id": 1, "text": "a" * 4 * 1024 * 1024}}).encode()
+        payloads = []
+        app = Flask(__name__)
+        app.add_url_rule(
+            "/webhook",
+            view_func=WebhookIngress(SECRET).route(payloads.append),
+            methods=["POST"],
+        )
+
+        response = app.test_client().post(
+            "/webhook", data=body, headers={"X-Pyrus-Sig": sign(body)}
+        )
+
+        self.assertEqual(len(payloads), 1)
+        self.assertNotEqual(response.status_code, 413)
+
+
+class Test_step_reminder_route(unittest.TestCase):
+    def setUp(self):
+        # The route as main.py mounts it, without the rest of the app
+        app = Flask(__name__)
+        app.add_url_rule(
+            "/step-reminder",
+            view_func=WebhookIngress(SECRET).route(
+                reminder_step_view(None, SECRET, "login")
+            ),
+            methods=["GET", "POST"],
+        )
+        self.client = app.test_client()
+
+    def test_signed_request_is_processed(self):
+        # A task without a current step gets the empty answer
+        body = json.dumps({"task": {"id": 1, "fields": []}}).encode()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = self.client.post(
+                "/step-reminder", data=body, headers={"X-Pyrus-Sig": sign(body)}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(as_text=True), "{}")
+
+    def test_unsigned_request_is_rejected(self):
+        # /step-reminder used to accept any request with a X-Pyrus-Sig header
+        response = self.client.post(
+            "/step-reminder", data=BODY, headers={"X-Pyrus-Sig": "0" * 40}
+        )
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_missing_signature_is_rejected(self):
+        response = self.client.post("/step-reminder", data=BODY)
+
+        self.assertEqual(response.status_code, 403)
+
+
+if __name__ == "__main__":
+    unittest.main()